@@ -0,0 +1,486 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+"""
+Runs ``DifettoPNR``, ``DifettoATPG`` and ``DifettoTest`` for many designs on a
+shared, bounded pool of CPUs and memory:
+
+    python3 -m librelane_plugin_difetto.batch --cpus 32 --memory 128G designs/*/config.yaml
+
+Every flow of every design is a job, invoking LibreLane as in
+``test/spm/commands.sh``: a design's ATPG starts once its PnR is done, and its
+test once both are. A job reserves CPUs and memory from the pool for as long
+as it runs (``--job-cpus``, ``--job-memory``) and is only started once they
+are free. It is pinned to the CPUs it reserved, and LibreLane is told to use
+as many threads. Memory is only reserved, not enforced: jobs estimated too low
+may still exceed the pool.
+
+Once every job has finished or been skipped (as one it depends on failed,) a
+summary of each design's coverage, pattern counts and runtimes is written to
+``summary.json`` and ``summary.csv`` in ``--out``, along with a log per job.
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import threading
+import subprocess
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import click
+from librelane.logging import info, success, warn, err
+
+FLOWS = ["DifettoPNR", "DifettoATPG", "DifettoTest"]
+TAG_SUFFIXES = {"DifettoPNR": "pnr", "DifettoATPG": "atpg", "DifettoTest": "test"}
+
+DEFAULT_JOB_CPUS = {"DifettoPNR": 4, "DifettoATPG": 1, "DifettoTest": 1}
+DEFAULT_JOB_MEMORY = {
+    "DifettoPNR": 4 * 1024**3,
+    "DifettoATPG": 2 * 1024**3,
+    "DifettoTest": 2 * 1024**3,
+}
+
+# (metric, column) of the summary, from the last state of each design
+SUMMARY_METRICS = [
+    ("difetto__atpg__coverage", "coverage"),
+    ("difetto__atpg__pattern_count", "atpg_pattern_count"),
+    ("difetto__test__chain_length", "chain_length"),
+    ("difetto__test__pattern_count", "test_pattern_count"),
+    ("difetto__sim__failed_vector_count", "failed_vector_count"),
+]
+
+
+@dataclass
+class Job:
+    config: str
+    flow: str
+    cpus: int
+    memory: int
+    dependencies: List["Job"] = field(default_factory=list)
+    # pending, running, done, failed or skipped
+    status: str = "pending"
+    cpu_ids: List[int] = field(default_factory=list)
+    wall_time: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.config}:{self.flow}"
+
+
+class ResourcePool:
+    """
+    Runs jobs as soon as the jobs they depend on are done and the CPUs and
+    memory they need are free, up to ``cpu_ids`` and ``memory`` at once.
+    """
+
+    def __init__(self, cpu_ids: List[int], memory: int):
+        self.free_cpu_ids = list(cpu_ids)
+        self.free_memory = memory
+        self.condition = threading.Condition()
+
+    def fits(self, job: Job) -> bool:
+        return job.cpus <= len(self.free_cpu_ids) and job.memory <= self.free_memory
+
+    def run(self, jobs: List[Job], run_job: Callable[[Job], bool]):
+        """
+        Runs ``run_job`` for every job on its own thread, with
+        :attr:`Job.cpu_ids` set to the CPUs it reserved, returning once they
+        have all finished. ``run_job`` returns whether the job succeeded.
+        """
+
+        def worker(job: Job):
+            try:
+                succeeded = run_job(job)
+            except Exception as e:
+                err(f"{job.name}: {e}")
+                succeeded = False
+            with self.condition:
+                job.status = "done" if succeeded else "failed"
+                self.free_cpu_ids += job.cpu_ids
+                self.free_memory += job.memory
+                self.condition.notify()
+
+        with self.condition:
+            while True:
+                for job in jobs:
+                    if job.status != "pending":
+                        continue
+                    statuses = {dependency.status for dependency in job.dependencies}
+                    if statuses & {"failed", "skipped"}:
+                        job.status = "skipped"
+                        warn(f"{job.name}: skipped, as a job it depends on failed.")
+                    elif statuses <= {"done"} and self.fits(job):
+                        job.status = "running"
+                        job.cpu_ids = self.free_cpu_ids[: job.cpus]
+                        del self.free_cpu_ids[: job.cpus]
+                        self.free_memory -= job.memory
+                        threading.Thread(target=worker, args=(job,)).start()
+                if all(job.status not in ["pending", "running"] for job in jobs):
+                    return
+                self.condition.wait()
+
+
+def get_run_dir(config: str, tag: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(config)), "runs", tag)
+
+
+def find_state_out(run_dir: str, step_slug: Optional[str] = None) -> Optional[str]:
+    """
+    :returns: The ``state_out.json`` of the last step of a run, or of the
+        last step with the given slug (e.g. ``difetto-cut``,) if any.
+    """
+    if not os.path.isdir(run_dir):
+        return None
+    for step_dir in sorted(os.listdir(run_dir), reverse=True):
+        if step_slug is not None and not step_dir.endswith(f"-{step_slug}"):
+            continue
+        state_out = os.path.join(run_dir, step_dir, "state_out.json")
+        if os.path.isfile(state_out):
+            return state_out
+    return None
+
+
+def parse_runtime(runtime: str) -> float:
+    # librelane.common.format_elapsed_time: HH:MM:SS.mmm
+    hours, minutes, seconds = runtime.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def collect_step_times(run_dir: str) -> Dict[str, float]:
+    """
+    :returns: The runtime of every Difetto step of a run that finished.
+    """
+    step_times: Dict[str, float] = {}
+    if not os.path.isdir(run_dir):
+        return step_times
+    for step_dir in sorted(os.listdir(run_dir)):
+        config_path = os.path.join(run_dir, step_dir, "config.json")
+        runtime_path = os.path.join(run_dir, step_dir, "runtime.txt")
+        if not (os.path.isfile(config_path) and os.path.isfile(runtime_path)):
+            continue
+        with open(config_path, encoding="utf8") as f:
+            step_id = json.load(f).get("meta", {}).get("step", "")
+        if step_id.startswith("Difetto."):
+            with open(runtime_path, encoding="utf8") as f:
+                step_times[step_id] = parse_runtime(f.read())
+    return step_times
+
+
+class Batch:
+    def __init__(
+        self,
+        configs: List[str],
+        tag_prefix: str,
+        out_dir: str,
+        librelane_options: List[str],
+        job_cpus: Dict[str, int],
+        job_memory: Dict[str, int],
+        env: Dict[str, str],
+    ):
+        self.configs = configs
+        self.tag_prefix = tag_prefix
+        self.out_dir = out_dir
+        self.librelane_options = librelane_options
+        self.env = env
+        self.jobs: List[Job] = []
+        self.jobs_by_config: Dict[str, Dict[str, Job]] = {}
+        for config in configs:
+            by_flow: Dict[str, Job] = {}
+            for flow in FLOWS:
+                job = Job(config, flow, job_cpus[flow], job_memory[flow])
+                # commands.sh: ATPG starts from Difetto.Cut, test from
+                # Difetto.QuaighSim and Difetto.Chain
+                if flow == "DifettoATPG":
+                    job.dependencies = [by_flow["DifettoPNR"]]
+                elif flow == "DifettoTest":
+                    job.dependencies = [by_flow["DifettoPNR"], by_flow["DifettoATPG"]]
+                by_flow[flow] = job
+                self.jobs.append(job)
+            self.jobs_by_config[config] = by_flow
+
+    def get_tag(self, job: Job) -> str:
+        stem = os.path.splitext(os.path.basename(job.config))[0]
+        return f"{self.tag_prefix}_{stem}_{TAG_SUFFIXES[job.flow]}"
+
+    def get_initial_states(self, job: Job) -> List[str]:
+        by_flow = self.jobs_by_config[job.config]
+        needed: List[Tuple[Job, str]] = []
+        if job.flow == "DifettoATPG":
+            needed = [(by_flow["DifettoPNR"], "difetto-cut")]
+        elif job.flow == "DifettoTest":
+            needed = [
+                (by_flow["DifettoATPG"], "difetto-quaighsim"),
+                (by_flow["DifettoPNR"], "difetto-chain"),
+            ]
+        states = []
+        for dependency, step_slug in needed:
+            run_dir = get_run_dir(job.config, self.get_tag(dependency))
+            state_out = find_state_out(run_dir, step_slug)
+            if state_out is None:
+                raise FileNotFoundError(f"no '{step_slug}' step in '{run_dir}'")
+            states.append(state_out)
+        return states
+
+    def run_job(self, job: Job) -> bool:
+        cmd = [
+            sys.executable,
+            "-m",
+            "librelane",
+            "--run-tag",
+            self.get_tag(job),
+            "--flow",
+            job.flow,
+            "--overwrite",
+            "-j",
+            str(job.cpus),
+        ]
+        for state in self.get_initial_states(job):
+            cmd += ["--with-initial-state", state]
+        cmd += self.librelane_options
+        cmd.append(job.config)
+        if hasattr(os, "sched_setaffinity"):
+            # pinned before LibreLane starts, so every thread and process it
+            # starts inherits the reserved CPUs
+            cmd = [
+                sys.executable,
+                "-c",
+                f"import os, sys; os.sched_setaffinity(0, {sorted(set(job.cpu_ids))}); os.execv(sys.executable, sys.argv[1:])",
+                *cmd,
+            ]
+
+        # configs in different directories may share a name, and their tag
+        log_path = os.path.join(
+            self.out_dir, f"{self.configs.index(job.config)}_{self.get_tag(job)}.log"
+        )
+        info(f"{job.name}: started on CPU(s) {job.cpu_ids}, logging to '{log_path}'.")
+        start = time.perf_counter()
+        with open(log_path, "w", encoding="utf8") as log:
+            process = subprocess.run(
+                cmd, stdout=log, stderr=subprocess.STDOUT, env=self.env
+            )
+        job.wall_time = time.perf_counter() - start
+        if process.returncode != 0:
+            err(f"{job.name}: failed after {job.wall_time:.1f}s, see '{log_path}'.")
+            return False
+        success(f"{job.name}: done in {job.wall_time:.1f}s.")
+        return True
+
+    def summarize(self) -> List[Dict[str, Any]]:
+        """
+        :returns: A row per design, with the metrics of its last state and the
+            status and runtimes of its flows.
+        """
+        rows = []
+        for config, by_flow in self.jobs_by_config.items():
+            row: Dict[str, Any] = {"design": config}
+            metrics: Dict[str, Any] = {}
+            step_times: Dict[str, float] = {}
+            for flow, job in by_flow.items():
+                suffix = TAG_SUFFIXES[flow]
+                row[f"{suffix}_status"] = job.status
+                row[f"{suffix}_wall_time"] = (
+                    None if job.wall_time is None else round(job.wall_time, 3)
+                )
+                if job.status != "done":
+                    continue
+                run_dir = get_run_dir(config, self.get_tag(job))
+                if state_out := find_state_out(run_dir):
+                    with open(state_out, encoding="utf8") as f:
+                        metrics.update(json.load(f).get("metrics") or {})
+                step_times.update(collect_step_times(run_dir))
+            for metric, column in SUMMARY_METRICS:
+                row[column] = metrics.get(metric)
+            row["total_wall_time"] = round(
+                sum(
+                    job.wall_time
+                    for job in by_flow.values()
+                    if job.wall_time is not None
+                ),
+                3,
+            )
+            row["step_runtimes"] = step_times
+            rows.append(row)
+        return rows
+
+
+def write_summary(rows: List[Dict[str, Any]], json_path: str, csv_path: str):
+    with open(json_path, "w", encoding="utf8") as f:
+        json.dump({"designs": rows}, f, indent=2)
+    columns = [column for column in rows[0] if column != "step_runtimes"]
+    with open(csv_path, "w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(
+                ["" if row[column] is None else row[column] for column in columns]
+            )
+
+
+def parse_size(value: str) -> int:
+    units = {"k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+    value = value.strip().lower().rstrip("ib").rstrip("b")
+    multiplier = units.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        raise click.BadParameter(f"invalid size '{value}'")
+
+
+def parse_flow_values(
+    values: Tuple[str, ...], parse: Callable[[str], int], defaults: Dict[str, int]
+) -> Dict[str, int]:
+    result = dict(defaults)
+    for value in values:
+        flow, _, amount = value.partition("=")
+        if flow not in FLOWS or amount == "":
+            raise click.BadParameter(
+                f"expected FLOW=VALUE with FLOW one of {', '.join(FLOWS)}, got '{value}'"
+            )
+        result[flow] = parse(amount)
+    return result
+
+
+def get_usable_cpu_ids() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+@click.command()
+@click.option(
+    "--cpus",
+    type=int,
+    default=None,
+    help="The CPUs shared by all jobs. [default: every CPU this process may use]",
+)
+@click.option(
+    "--memory",
+    default=None,
+    help="The memory shared by all jobs, e.g. 64G. [default: the physical memory]",
+)
+@click.option(
+    "--job-cpus",
+    multiple=True,
+    metavar="FLOW=N",
+    help=f"The CPUs a job of a flow reserves. [default: {', '.join(f'{k}={v}' for k, v in DEFAULT_JOB_CPUS.items())}]",
+)
+@click.option(
+    "--job-memory",
+    multiple=True,
+    metavar="FLOW=SIZE",
+    help=f"The memory a job of a flow reserves. [default: {', '.join(f'{k}={v // 1024**3}G' for k, v in DEFAULT_JOB_MEMORY.items())}]",
+)
+@click.option(
+    "--tag-prefix",
+    default="batch",
+    show_default=True,
+    help="Runs are tagged <prefix>_<config name>_{pnr,atpg,test}.",
+)
+@click.option(
+    "--out",
+    "out_dir",
+    type=click.Path(file_okay=False),
+    default="batch",
+    show_default=True,
+    help="The directory for the job logs and the summary.",
+)
+@click.option(
+    "--librelane-option",
+    "librelane_options",
+    multiple=True,
+    help="An option passed on to every LibreLane invocation, e.g. --librelane-option=--pdk=sky130A.",
+)
+@click.option(
+    "--pyosys-worker",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="The socket of a pyosys worker for the Yosys-based steps of every job to share (see librelane_plugin_difetto.worker).",
+)
+@click.argument(
+    "configs", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+def main(
+    cpus,
+    memory,
+    job_cpus,
+    job_memory,
+    tag_prefix,
+    out_dir,
+    librelane_options,
+    pyosys_worker,
+    configs,
+):
+    """
+    Runs the Difetto flows for every design configuration in CONFIGS.
+    """
+    cpu_ids = get_usable_cpu_ids()
+    if cpus is not None:
+        if cpus < 1:
+            raise click.BadParameter("must be at least 1", param_hint="--cpus")
+        # more CPUs than there are oversubscribes them
+        cpu_ids = [cpu_ids[i % len(cpu_ids)] for i in range(cpus)]
+    if memory is None:
+        memory_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    else:
+        memory_bytes = parse_size(memory)
+
+    # a job larger than the pool runs on its own rather than never
+    cpus_by_flow = {
+        flow: max(1, min(value, len(cpu_ids)))
+        for flow, value in parse_flow_values(job_cpus, int, DEFAULT_JOB_CPUS).items()
+    }
+    memory_by_flow = {
+        flow: min(value, memory_bytes)
+        for flow, value in parse_flow_values(
+            job_memory, parse_size, DEFAULT_JOB_MEMORY
+        ).items()
+    }
+
+    env = os.environ.copy()
+    if pyosys_worker is not None:
+        env["DIFETTO_PYOSYS_WORKER"] = os.path.abspath(pyosys_worker)
+
+    os.makedirs(out_dir, exist_ok=True)
+    batch = Batch(
+        list(configs),
+        tag_prefix,
+        out_dir,
+        list(librelane_options),
+        cpus_by_flow,
+        memory_by_flow,
+        env,
+    )
+    info(
+        f"Running {len(batch.jobs)} jobs for {len(configs)} design(s) on {len(cpu_ids)} CPU(s) and {memory_bytes / 1024**3:.1f}GiB."
+    )
+    start = time.perf_counter()
+    ResourcePool(cpu_ids, memory_bytes).run(batch.jobs, batch.run_job)
+    info(f"Ran every job in {time.perf_counter() - start:.1f}s.")
+
+    rows = batch.summarize()
+    write_summary(
+        rows,
+        os.path.join(out_dir, "summary.json"),
+        os.path.join(out_dir, "summary.csv"),
+    )
+    for row in rows:
+        statuses = ", ".join(
+            f"{TAG_SUFFIXES[flow]}: {row[f'{TAG_SUFFIXES[flow]}_status']}"
+            for flow in FLOWS
+        )
+        coverage = "n/a" if row["coverage"] is None else f"{row['coverage']}%"
+        info(
+            f"{row['design']}: {statuses}; coverage {coverage}, {row['atpg_pattern_count'] or 0} pattern(s), {row['total_wall_time']:.1f}s."
+        )
+    info(f"Summary written to '{os.path.join(out_dir, 'summary.csv')}'.")
+
+    if any(job.status != "done" for job in batch.jobs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+"""
+Utilities for working with combinational netlists in the BENCH format (as
+produced by nl2bench) and the test patterns generated for them: partitioning
+into output cones, merging pattern sets and stuck-at fault simulation.
+
+Patterns are handled as strings of ``0``\\s and ``1``\\s where the ``i``\\th
+character is the value of the ``i``\\th input of the netlist, matching the
+``raw_tvs`` files produced by Quaigh.
+"""
+
+import re
+import heapq
+import random
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, TextIO, Tuple
+
+from .scripts.common.patterns import read_patterns_text
+
+# (net, stuck-at value)
+Fault = Tuple[str, int]
+
+_gate_rx = re.compile(r"^\s*(\S+)\s*=\s*(\w+)\s*\((.*)\)\s*$")
+_port_rx = re.compile(r"^\s*(INPUT|OUTPUT)\s*\((.+)\)\s*$")
+
+
+def _evaluate(function: str, values: List[int], mask: int) -> int:
+    if function in ("BUF", "BUFF"):
+        return values[0]
+    elif function == "NOT":
+        return ~values[0] & mask
+    elif function == "VDD":
+        return mask
+    elif function in ("VSS", "GND"):
+        return 0
+
+    result = values[0]
+    if function in ("AND", "NAND"):
+        for value in values[1:]:
+            result &= value
+    elif function in ("OR", "NOR"):
+        for value in values[1:]:
+            result |= value
+    elif function in ("XOR", "XNOR"):
+        for value in values[1:]:
+            result ^= value
+    else:
+        raise ValueError(f"Unsupported BENCH function '{function}'")
+    if function in ("NAND", "NOR", "XNOR"):
+        result = ~result & mask
+    return result
+
+
+@dataclass
+class Bench:
+    """
+    A combinational netlist in the BENCH format.
+
+    :param inputs: The primary inputs, in declaration order.
+    :param outputs: The primary outputs, in declaration order.
+    :param gates: A mapping from each driven net to its function and the nets
+        of its arguments, in declaration order.
+    """
+
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    gates: Dict[str, Tuple[str, List[str]]] = field(default_factory=dict)
+
+    @classmethod
+    def load(Self, path: str) -> "Bench":
+        with open(path, encoding="utf8") as f:
+            return Self.parse(f)
+
+    @classmethod
+    def parse(Self, lines: Iterable[str]) -> "Bench":
+        bench = Self()
+        for i, line in enumerate(lines):
+            line = line.split("#", maxsplit=1)[0].strip()
+            if line == "":
+                continue
+            if port_match := _port_rx.match(line):
+                kind, name = port_match[1], port_match[2].strip()
+                (bench.inputs if kind == "INPUT" else bench.outputs).append(name)
+            elif gate_match := _gate_rx.match(line):
+                arguments = [
+                    argument.strip()
+                    for argument in gate_match[3].split(",")
+                    if argument.strip() != ""
+                ]
+                bench.gates[gate_match[1]] = (gate_match[2].upper(), arguments)
+            else:
+                raise ValueError(f"Invalid BENCH statement on line {i + 1}: '{line}'")
+        return bench
+
+    def dump(self, f: TextIO, header: Optional[str] = None):
+        if header is not None:
+            print(f"# {header}", file=f)
+        for input in self.inputs:
+            print(f"INPUT({input})", file=f)
+        for output in self.outputs:
+            print(f"OUTPUT({output})", file=f)
+        for net, (function, arguments) in self.gates.items():
+            print(f"{net} = {function}({' , '.join(arguments)})", file=f)
+
+    def faults(self) -> List[Fault]:
+        """
+        :returns: Both stuck-at faults of every net of the netlist.
+        """
+        return [
+            (net, value) for net in self.inputs + list(self.gates) for value in (0, 1)
+        ]
+
+    def topological_order(self) -> List[str]:
+        """
+        :returns: The driven nets of the netlist ordered such that every gate
+            comes after the gates driving its arguments.
+        """
+        order: List[str] = []
+        done: Set[str] = set(self.inputs)
+        in_progress: Set[str] = set()
+        for root in self.gates:
+            if root in done:
+                continue
+            stack = [(root, False)]
+            while len(stack):
+                net, expanded = stack.pop()
+                if expanded:
+                    in_progress.discard(net)
+                    done.add(net)
+                    order.append(net)
+                    continue
+                if net in done:
+                    continue
+                if net in in_progress:
+                    raise ValueError(f"Combinational loop through net '{net}'")
+                if net not in self.gates:
+                    raise ValueError(f"Net '{net}' is neither an input nor driven")
+                in_progress.add(net)
+                stack.append((net, True))
+                for argument in self.gates[net][1]:
+                    if argument not in done:
+                        stack.append((argument, False))
+        return order
+
+    def cone(self, outputs: Iterable[str]) -> Set[str]:
+        """
+        :returns: All nets in the transitive fan-in of the given outputs,
+            including the outputs themselves and the inputs they depend on.
+        """
+        seen: Set[str] = set()
+        stack = list(outputs)
+        while len(stack):
+            net = stack.pop()
+            if net in seen:
+                continue
+            seen.add(net)
+            if gate := self.gates.get(net):
+                stack.extend(gate[1])
+        return seen
+
+    def observers(self, nets: Iterable[str]) -> List[str]:
+        """
+        :returns: The outputs in the transitive fan-out of the given nets, i.e.
+            those at which faults on these nets may be observed, in
+            declaration order.
+        """
+        fanout: Dict[str, List[str]] = {}
+        for net, (_, arguments) in self.gates.items():
+            for argument in arguments:
+                fanout.setdefault(argument, []).append(net)
+        seen: Set[str] = set()
+        stack = list(nets)
+        while len(stack):
+            net = stack.pop()
+            if net in seen:
+                continue
+            seen.add(net)
+            stack.extend(fanout.get(net, []))
+        return [output for output in self.outputs if output in seen]
+
+    def subset(self, outputs: List[str]) -> "Bench":
+        """
+        :returns: A netlist with only the given outputs and the gates and
+            inputs in their fan-in cones. Inputs keep their relative order.
+        """
+        cone = self.cone(outputs)
+        return Bench(
+            inputs=[input for input in self.inputs if input in cone],
+            outputs=list(outputs),
+            gates={net: gate for net, gate in self.gates.items() if net in cone},
+        )
+
+    def partition(self, count: int) -> List[List[str]]:
+        """
+        Splits the outputs of the netlist into up to ``count`` groups whose
+        fan-in cones are roughly equal in size and overlap as little as
+        possible, so each group can be processed independently.
+
+        Outputs are assigned largest cone first to whichever group would be
+        smallest after absorbing the cone, so outputs sharing logic tend to
+        land in the same group.
+
+        :returns: The outputs of each non-empty group, in declaration order.
+        """
+        cones = {output: self.cone([output]) for output in self.outputs}
+        groups: List[Set[str]] = [set() for _ in range(max(1, count))]
+        members: List[Set[str]] = [set() for _ in groups]
+        for output in sorted(self.outputs, key=lambda o: -len(cones[o])):
+            cone = cones[output]
+            best = min(
+                range(len(groups)),
+                key=lambda i: (len(groups[i]) + len(cone - groups[i]), i),
+            )
+            groups[best].update(cone)
+            members[best].add(output)
+        return [
+            [output for output in self.outputs if output in group]
+            for group in members
+            if len(group)
+        ]
+
+
+def read_patterns(path: str) -> List[str]:
+    """
+    :returns: The patterns of a text test vector file (as produced by
+        ``quaigh atpg``) as strings of ``0``\\s and ``1``\\s, where the
+        ``i``\\th character is the value of the ``i``\\th input.
+    """
+    with open(path, encoding="utf8") as f:
+        return [pattern.to01() for pattern in read_patterns_text(f)]
+
+
+def write_patterns(f: TextIO, patterns: Iterable[str], header: Optional[str] = None):
+    """
+    Writes patterns in the same text format as ``quaigh atpg``.
+    """
+    if header is not None:
+        print(f"* {header}", file=f)
+    for i, pattern in enumerate(patterns):
+        print(f"{i + 1}: {pattern}", file=f)
+
+
+def random_patterns(rng: random.Random, count: int, width: int) -> List[str]:
+    """
+    :returns: ``count`` uniformly random patterns for ``width`` inputs.
+    """
+    return [format(rng.getrandbits(width), f"0{width}b") for _ in range(count)]
+
+
+def remap_patterns(
+    patterns: Iterable[str], old_inputs: List[str], new_inputs: List[str]
+) -> List[str]:
+    """
+    Reorders patterns generated for one version of a netlist to match the
+    inputs of another by name. Inputs that no longer exist are dropped, and
+    new inputs are set to ``0``.
+    """
+    old_index = {input: i for i, input in enumerate(old_inputs)}
+    positions = [old_index.get(input) for input in new_inputs]
+    remapped = []
+    for pattern in patterns:
+        if len(pattern) != len(old_inputs):
+            raise ValueError(
+                f"Pattern '{pattern}' does not match the {len(old_inputs)} inputs of its netlist"
+            )
+        remapped.append("".join("0" if i is None else pattern[i] for i in positions))
+    return remapped
+
+
+def merge_patterns(
+    inputs: List[str],
+    pattern_sets: Iterable[Tuple[List[str], List[str]]],
+) -> List[str]:
+    """
+    Merges sets of patterns generated for sub-netlists into one set of
+    patterns for the full netlist.
+
+    Each pattern only specifies the inputs of its sub-netlist and leaves the
+    rest as don't-cares, so patterns from different sub-netlists are combined
+    into one wherever they agree on their shared inputs (and duplicates are
+    dropped.) Inputs left unspecified are set to ``0``.
+
+    :param inputs: The inputs of the full netlist.
+    :param pattern_sets: Pairs of the inputs of a sub-netlist and the patterns
+        generated for it.
+    :returns: The merged patterns in the input order of the full netlist.
+    """
+    index = {input: i for i, input in enumerate(inputs)}
+    merged: List[Tuple[int, int]] = []  # (care mask, values)
+    for sub_inputs, patterns in pattern_sets:
+        positions = [index[input] for input in sub_inputs]
+        care = 0
+        for position in positions:
+            care |= 1 << position
+        # the patterns merged so far by care mask, then by their values on
+        # the inputs shared with this set (the earliest last,) so that finding
+        # the first compatible one is a lookup per care mask, not a scan
+        candidates: Dict[int, Dict[int, List[int]]] = {}
+        for i in reversed(range(len(merged))):
+            merged_care, merged_values = merged[i]
+            candidates.setdefault(merged_care, {}).setdefault(
+                merged_values & care, []
+            ).append(i)
+        # once merged, a pattern of this set only remains compatible with its
+        # own duplicates
+        seen: Set[int] = set()
+        for pattern in patterns:
+            if len(pattern) != len(positions):
+                raise ValueError(
+                    f"Pattern '{pattern}' does not match the {len(positions)} inputs of its netlist"
+                )
+            values = 0
+            for position, bit in zip(positions, pattern):
+                if bit == "1":
+                    values |= 1 << position
+            if values in seen:
+                continue
+            seen.add(values)
+            first: Optional[List[int]] = None
+            for merged_care, by_values in candidates.items():
+                stack = by_values.get(values & merged_care)
+                if stack and (first is None or stack[-1] < first[-1]):
+                    first = stack
+            if first is None:
+                merged.append((care, values))
+            else:
+                i = first.pop()
+                merged_care, merged_values = merged[i]
+                merged[i] = (merged_care | care, merged_values | values)
+    return [
+        "".join("1" if (values >> i) & 1 else "0" for i in range(len(inputs)))
+        for _, values in merged
+    ]
+
+
+class FaultSimulator(object):
+    """
+    A parallel-pattern, event-driven simulator for single stuck-at faults on
+    every net of a netlist.
+
+    All patterns are simulated at once: the value of each net is an integer
+    whose ``p``\\th bit is the net's value under the ``p``\\th pattern.
+
+    :param bench: The netlist.
+    :param patterns: Patterns in the input order of the netlist.
+    """
+
+    def __init__(self, bench: Bench, patterns: List[str]):
+        self.bench = bench
+        self.pattern_count = len(patterns)
+        self.mask = (1 << self.pattern_count) - 1
+        self.order = bench.topological_order()
+        self.level = {net: i for i, net in enumerate(self.order)}
+        self.observed = set(bench.outputs)
+        self.fanout: Dict[str, List[str]] = {}
+        for net, (_, arguments) in bench.gates.items():
+            for argument in set(arguments):
+                self.fanout.setdefault(argument, []).append(net)
+
+        self.good: Dict[str, int] = {}
+        for i, input in enumerate(bench.inputs):
+            value = 0
+            for p, pattern in enumerate(patterns):
+                if pattern[i] == "1":
+                    value |= 1 << p
+            self.good[input] = value
+        for net in self.order:
+            function, arguments = bench.gates[net]
+            self.good[net] = _evaluate(
+                function, [self.good[a] for a in arguments], self.mask
+            )
+
+    def responses(self) -> List[str]:
+        """
+        :returns: The values of the outputs of the fault-free netlist under
+            each pattern, in the output order of the netlist.
+        """
+        return [
+            "".join(
+                "1" if (self.good[output] >> p) & 1 else "0"
+                for output in self.bench.outputs
+            )
+            for p in range(self.pattern_count)
+        ]
+
+    def observe(self, fault: Fault) -> Dict[str, int]:
+        """
+        :returns: A mapping from each output at which a fault is observed to a
+            mask of the patterns under which it is.
+        """
+        site, stuck = fault
+        faulty = {site: self.mask if stuck else 0}
+        if faulty[site] == self.good[site]:
+            return {}
+        queue: List[Tuple[int, str]] = []
+        queued: Set[str] = set()
+
+        def schedule(net: str):
+            for sink in self.fanout.get(net, []):
+                if sink not in queued:
+                    queued.add(sink)
+                    heapq.heappush(queue, (self.level[sink], sink))
+
+        schedule(site)
+        while len(queue):
+            _, net = heapq.heappop(queue)
+            function, arguments = self.bench.gates[net]
+            value = _evaluate(
+                function,
+                [faulty.get(a, self.good[a]) for a in arguments],
+                self.mask,
+            )
+            if value != self.good[net]:
+                faulty[net] = value
+                schedule(net)
+
+        return {
+            net: value ^ self.good[net]
+            for net, value in faulty.items()
+            if net in self.observed and value != self.good[net]
+        }
+
+    def detect(self, fault: Fault) -> int:
+        """
+        :returns: A mask of the patterns that detect a fault at any output.
+        """
+        detected = 0
+        for mask in self.observe(fault).values():
+            detected |= mask
+        return detected
+
+    def simulate(self, faults: Optional[Iterable[Fault]] = None) -> Dict[Fault, int]:
+        """
+        :returns: A mapping from each fault to a mask of the patterns that
+            detect it. Undetected faults map to ``0``.
+        """
+        return {
+            fault: self.detect(fault)
+            for fault in (self.bench.faults() if faults is None else faults)
+        }
+
+
+def select_patterns(detections: Dict[Fault, int]) -> List[int]:
+    """
+    Drops redundant patterns from a fault-simulated set: a pattern is only
+    kept if it is the first to detect at least one fault.
+
+    :param detections: The result of :meth:`FaultSimulator.simulate`.
+    :returns: The indices of the patterns to keep, in ascending order.
+    """
+    kept: Set[int] = set()
+    for mask in detections.values():
+        if mask != 0:
+            kept.add((mask & -mask).bit_length() - 1)
+    return sorted(kept)
+
+
+def relax_patterns(bench: Bench, patterns: List[str]) -> List[int]:
+    """
+    Finds the inputs each pattern actually needs to specify (its care bits,)
+    so the rest may be filled in arbitrarily, e.g. by a scan decompressor.
+
+    Every fault is credited to the first pattern that detects it, and to the
+    output with the smallest fan-in cone at which that pattern observes it.
+    The care bits of a pattern are the inputs in the cones of the outputs
+    credited with its faults: as those outputs do not depend on any other
+    input, every fault the patterns detect is still detected however the
+    other inputs are filled.
+
+    :returns: For each pattern, a mask of its care bits, where bit ``i`` is
+        the ``i``\\th input.
+    """
+    simulator = FaultSimulator(bench, patterns)
+    index = {input: i for i, input in enumerate(bench.inputs)}
+    cone_masks: Dict[str, int] = {}
+
+    def cone_mask(output: str) -> int:
+        if output not in cone_masks:
+            mask = 0
+            for net in bench.cone([output]):
+                if net in index:
+                    mask |= 1 << index[net]
+            cone_masks[output] = mask
+        return cone_masks[output]
+
+    care = [0] * len(patterns)
+    for fault in bench.faults():
+        observed = simulator.observe(fault)
+        detected = 0
+        for mask in observed.values():
+            detected |= mask
+        if detected == 0:
+            continue
+        first = (detected & -detected).bit_length() - 1
+        output = min(
+            (output for output, mask in observed.items() if (mask >> first) & 1),
+            key=lambda output: (bin(cone_mask(output)).count("1"), output),
+        )
+        care[first] |= cone_mask(output)
+    return care
@@ -0,0 +1,289 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+"""
+Content-addressed caching of step results.
+
+Each entry is keyed by a hash of everything a step's result depends upon: the
+contents of its input files, its configuration, the versions of the tools it
+invokes and the plugin's own scripts. Entries are stored as directories
+holding the step's output files and a ``manifest.json`` with its metrics.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+import subprocess
+from decimal import Decimal
+from functools import wraps
+from typing import Any, Callable, ClassVar, Dict, Iterable, List, Optional, Tuple
+
+from librelane.common import GenericDictEncoder, Path
+from librelane.config import Variable
+from librelane.logging import debug, info, warn
+from librelane.state import DesignFormat, State
+
+from .__version__ import __version__
+
+# Bump whenever the entry layout changes.
+CACHE_VERSION = 1
+
+dft_cache_vars = [
+    Variable(
+        "DFT_RESULT_CACHE_DIR",
+        Optional[Path],
+        "An optional directory in which the results of ATPG and test steps are cached, keyed by the contents of their inputs, their configuration and the versions of the tools they use. When a step is run again with identical inputs, its outputs and metrics are restored from the cache instead. The directory may be shared between runs and designs.",
+    ),
+    Variable(
+        "DFT_RESULT_CACHE_MAX_SIZE",
+        int,
+        "The maximum size of the result cache. When exceeded, the least recently used entries are evicted.",
+        default=4096,
+        units="MiB",
+    ),
+]
+
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+_tool_fingerprints: Dict[str, str] = {}
+
+
+def hash_file(path: str) -> str:
+    """
+    :returns: The SHA-256 digest of a file's contents, memoized for as long as
+        the file's size and modification time do not change.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if found := _file_hashes.get(memo_key):
+        return found
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _file_hashes[memo_key] = digest
+    return digest
+
+
+def tool_fingerprint(tool: str) -> str:
+    """
+    :returns: The output of ``<tool> --version``, or, for tools without a
+        version flag, the resolved path and the hash of the executable.
+    """
+    if found := _tool_fingerprints.get(tool):
+        return found
+    fingerprint = f"{tool}: not found"
+    if resolved := shutil.which(tool):
+        fingerprint = f"{resolved}: {hash_file(resolved)}"
+        try:
+            result = subprocess.run(
+                [resolved, "--version"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                encoding="utf8",
+                timeout=30,
+            )
+            if result.returncode == 0 and result.stdout.strip() != "":
+                fingerprint = f"{resolved}: {result.stdout.strip()}"
+        except (OSError, subprocess.SubprocessError):
+            pass
+    _tool_fingerprints[tool] = fingerprint
+    return fingerprint
+
+
+def _hash_element(sha, element: Any):
+    if element is None:
+        sha.update(b"None")
+    elif isinstance(element, dict):
+        for key in sorted(element):
+            sha.update(f"{key}:".encode("utf8"))
+            _hash_element(sha, element[key])
+    elif isinstance(element, (list, tuple)):
+        for item in element:
+            _hash_element(sha, item)
+    elif isinstance(element, os.PathLike) and os.path.isfile(element):
+        # paths are hashed by content, so moving a run directory or copying
+        # an input does not invalidate the cache
+        sha.update(hash_file(str(element)).encode("utf8"))
+    else:
+        sha.update(json.dumps(element, cls=GenericDictEncoder).encode("utf8"))
+    sha.update(b";")
+
+
+class ResultCache(object):
+    """
+    A directory of step results with size-based, least-recently-used eviction.
+
+    :param root: The directory of the cache.
+    :param max_size: The size in bytes above which entries are evicted.
+    """
+
+    def __init__(self, root: str, max_size: int):
+        self.root = os.path.join(root, f"results-v{CACHE_VERSION}")
+        self.max_size = max_size
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def restore(
+        self, key: str, step_dir: str
+    ) -> Optional[Tuple[Dict[DesignFormat, Any], Dict[str, Any]]]:
+        """
+        Copies the output files of a cache entry into the step directory.
+
+        :returns: The views and metrics of the entry, or ``None`` on a miss.
+        """
+        entry = self._entry_dir(key)
+        manifest_path = os.path.join(entry, "manifest.json")
+        try:
+            with open(manifest_path, encoding="utf8") as f:
+                manifest = json.load(f, parse_float=Decimal)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError as e:
+            warn(f"Ignoring corrupt cache entry '{entry}': {e}")
+            return None
+
+        views: Dict[DesignFormat, Any] = {}
+        for format_id, filename in manifest["views"].items():
+            format = DesignFormat.factory.get(format_id)
+            if format is None:
+                return None
+            destination = os.path.join(step_dir, filename)
+            shutil.copy(os.path.join(entry, "files", filename), destination)
+            views[format] = Path(destination)
+        # mark as recently used
+        os.utime(manifest_path)
+        return views, manifest["metrics"]
+
+    def store(
+        self,
+        key: str,
+        views: Dict[DesignFormat, Any],
+        metrics: Dict[str, Any],
+    ):
+        """
+        Adds a step's results to the cache, then evicts older entries if the
+        cache has grown beyond its maximum size.
+
+        Only results whose views are all single files are cached.
+        """
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+        manifest: Dict[str, Any] = {"views": {}, "metrics": dict(metrics)}
+        for format, value in views.items():
+            if not isinstance(value, (str, os.PathLike)) or not os.path.isfile(value):
+                debug(f"Not caching results with non-file view {format}.")
+                return
+            manifest["views"][format.id] = os.path.basename(value)
+
+        # copy then rename, so concurrent runs never see a partial entry
+        temporary = f"{entry}.{os.getpid()}-{threading.get_ident()}.tmp"
+        files_dir = os.path.join(temporary, "files")
+        os.makedirs(files_dir, exist_ok=True)
+        for format, value in views.items():
+            shutil.copy(value, os.path.join(files_dir, os.path.basename(value)))
+        with open(os.path.join(temporary, "manifest.json"), "w", encoding="utf8") as f:
+            json.dump(manifest, f, cls=GenericDictEncoder)
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            # another run stored the same entry first
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        entries: List[Tuple[float, int, str]] = []
+        total = 0
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                manifest_path = os.path.join(entry.path, "manifest.json")
+                if entry.name.endswith(".tmp") or not os.path.isfile(manifest_path):
+                    continue
+                size = 0
+                for dirpath, _, filenames in os.walk(entry.path):
+                    for filename in filenames:
+                        size += os.path.getsize(os.path.join(dirpath, filename))
+                entries.append((os.path.getmtime(manifest_path), size, entry.path))
+                total += size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            debug(f"Evicting cache entry '{path}'…")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+class CachedStep(object):
+    """
+    A mixin for steps whose results depend only on their input files, their
+    configuration and the tools they invoke. The step must include
+    :data:`dft_cache_vars` in its ``config_vars`` and decorate its ``run``
+    method with :func:`cached_run`.
+
+    :cvar cache_tools: Executables whose versions the results depend on.
+    """
+
+    cache_tools: ClassVar[List[str]] = []
+
+    def get_cache_tools(self) -> List[str]:
+        return self.cache_tools
+
+    def get_cache_files(self, state_in: State) -> Iterable[str]:
+        """
+        :returns: Files, other than the step's inputs, that the results depend
+            on (e.g. scripts, libraries or simulation models.)
+        """
+        return []
+
+    def get_cache_key(self, state_in: State) -> str:
+        sha = hashlib.sha256()
+        _hash_element(sha, [self.id, __version__, CACHE_VERSION])
+        for input in self.inputs:
+            _hash_element(sha, [input.id, state_in.get(input.id)])
+        cache_var_names = {variable.name for variable in dft_cache_vars}
+        config = {"DESIGN_NAME": self.config["DESIGN_NAME"]}
+        for variable in self.config_vars:
+            if variable.name not in cache_var_names:
+                config[variable.name] = self.config.get(variable.name)
+        _hash_element(sha, config)
+        for tool in self.get_cache_tools():
+            _hash_element(sha, tool_fingerprint(tool))
+        _hash_element(
+            sha,
+            [Path(file) for file in sorted(map(str, self.get_cache_files(state_in)))],
+        )
+        return sha.hexdigest()
+
+
+def cached_run(run: Callable) -> Callable:
+    """
+    Decorates the ``run`` method of a :class:`CachedStep`. When
+    ``DFT_RESULT_CACHE_DIR`` is set, ``run`` is skipped if an entry with the
+    same key exists, restoring its outputs and metrics instead.
+    """
+
+    @wraps(run)
+    def wrapper(self: CachedStep, state_in: State, **kwargs):
+        cache_dir = self.config["DFT_RESULT_CACHE_DIR"]
+        if cache_dir is None:
+            return run(self, state_in, **kwargs)
+
+        cache = ResultCache(
+            cache_dir, self.config["DFT_RESULT_CACHE_MAX_SIZE"] * 1024 * 1024
+        )
+        key = self.get_cache_key(state_in)
+        if restored := cache.restore(key, self.step_dir):
+            info(f"Inputs unchanged: restored results from cache ({key[:12]}).")
+            return restored
+
+        views, metrics = run(self, state_in, **kwargs)
+        cache.store(key, views, metrics)
+        return views, metrics
+
+    return wrapper
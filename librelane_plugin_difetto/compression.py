@@ -0,0 +1,401 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+"""
+A model of the scan decompressor and compactor inserted by the
+``scan_compress`` pass of the Yosys plugin, and the encoding of test patterns
+for them.
+
+Loading a pattern takes ``load_cycles`` shift cycles: the length of the
+longest internal chain, plus one cycle per stage of the decompressor to
+flush out whatever it held before. On every cycle, the tester drives one bit
+on each scan-in channel. The responses are unloaded over the next
+``unload_cycles`` cycles (overlapping the load of the next pattern) and
+arrive XORed together on the scan-out channels.
+
+Streams are :class:`bitarray.bitarray`\\s of ``cycles * channels`` bits where
+bit ``t * channels + k`` is the value of channel ``k`` on cycle ``t``, i.e.
+the same binary format as uncompressed test vectors.
+
+Within a chain, position ``0`` is the flip-flop closest to its scan-in.
+"""
+
+import json
+from collections import deque
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+import yaml
+from bitarray import bitarray
+from bitarray.util import vl_decode, vl_encode
+
+from .bench import Bench, FaultSimulator, relax_patterns
+
+# (chain, position)
+ChainBit = Tuple[int, int]
+
+
+def _parity(value: int) -> int:
+    return bin(value).count("1") & 1
+
+
+@dataclass
+class ScanCompression:
+    """
+    The structure of a decompressor and compactor, as written by
+    ``scan_compress -structure``.
+
+    :param channels: The number of scan-in (and scan-out) channels.
+    :param stages: The number of stages of the decompressor's shift register.
+    :param injectors: The stages each scan-in channel is XORed into.
+    :param taps: The stages XORed together to drive the scan-in of each chain.
+    :param compactor: The chains XORed together to drive each scan-out
+        channel.
+    :param scan_in: The names of the scan-in channel ports.
+    :param scan_out: The names of the scan-out channel ports.
+    """
+
+    channels: int
+    stages: int
+    injectors: List[List[int]]
+    taps: List[List[int]]
+    compactor: List[List[int]]
+    scan_in: List[str]
+    scan_out: List[str]
+
+    @classmethod
+    def load(Self, path: str) -> "ScanCompression":
+        with open(path, encoding="utf8") as f:
+            raw = json.load(f)
+        return Self(
+            channels=raw["channels"],
+            stages=raw["stages"],
+            injectors=raw["injectors"],
+            taps=raw["taps"],
+            compactor=raw["compactor"],
+            scan_in=raw["scan_in"],
+            scan_out=raw["scan_out"],
+        )
+
+    @property
+    def chains(self) -> int:
+        return len(self.taps)
+
+    def advance(self, state: List[int], inputs: List[int]) -> List[int]:
+        """
+        :returns: The state of the decompressor after one clock cycle.
+
+        Values may be bits or, for symbolic simulation, masks of variables
+        (XORed together.)
+        """
+        injected = [0] * self.stages
+        for value, stages in zip(inputs, self.injectors):
+            for stage in stages:
+                injected[stage] ^= value
+        return [
+            (state[stage - 1] if stage else 0) ^ injected[stage]
+            for stage in range(self.stages)
+        ]
+
+    def spread(self, state: List[int]) -> List[int]:
+        """
+        :returns: The scan-in value of each chain for a decompressor state.
+        """
+        values = []
+        for taps in self.taps:
+            value = 0
+            for stage in taps:
+                value ^= state[stage]
+            values.append(value)
+        return values
+
+
+class PatternEncoder(object):
+    """
+    Encodes test patterns as streams for the scan-in channels, and computes
+    the expected streams on the scan-out channels.
+
+    :param compression: The decompressor and compactor.
+    :param chain_lengths: The length of each internal chain, in the order of
+        the decompressor outputs they are stitched to.
+    """
+
+    def __init__(self, compression: ScanCompression, chain_lengths: List[int]):
+        if len(chain_lengths) != compression.chains:
+            raise ValueError(
+                f"The decompressor drives {compression.chains} chain(s), but {len(chain_lengths)} were stitched"
+            )
+        if any(length == 0 for length in chain_lengths):
+            raise ValueError("Scan chains may not be empty")
+        self.compression = compression
+        self.chain_lengths = chain_lengths
+        self.unload_cycles = max(chain_lengths)
+        self.load_cycles = self.unload_cycles + compression.stages
+
+        # Simulate the decompressor symbolically: variable t * channels + k is
+        # the value of channel k on cycle t.
+        channels = compression.channels
+        state = [0] * compression.stages
+        shifted_in: List[List[int]] = []
+        for t in range(self.load_cycles):
+            shifted_in.append(compression.spread(state))
+            state = compression.advance(
+                state, [1 << (t * channels + k) for k in range(channels)]
+            )
+        # After loading, the bit shifted in on the last cycle is at position 0
+        self.equations = [
+            [
+                shifted_in[self.load_cycles - 1 - position][chain]
+                for position in range(length)
+            ]
+            for chain, length in enumerate(chain_lengths)
+        ]
+
+    @property
+    def stream_length(self) -> int:
+        return self.load_cycles * self.compression.channels
+
+    @property
+    def response_length(self) -> int:
+        return self.unload_cycles * self.compression.channels
+
+    def encode(self, care: Dict[ChainBit, int]) -> Tuple[bitarray, int]:
+        """
+        Solves for a scan-in stream that loads the given values into the
+        chains. Bits that are not specified are don't-cares.
+
+        Care bits are taken in order: any that contradict those before them are
+        dropped.
+
+        :returns: The stream and the number of care bits dropped.
+        """
+        pivots: Dict[int, Tuple[int, int]] = {}
+        dropped = 0
+        for (chain, position), value in care.items():
+            row = self.equations[chain][position]
+            while row:
+                pivot = row.bit_length() - 1
+                if pivot not in pivots:
+                    pivots[pivot] = (row, value)
+                    break
+                pivot_row, pivot_value = pivots[pivot]
+                row ^= pivot_row
+                value ^= pivot_value
+            else:
+                dropped += value
+
+        # Each row only involves its pivot and variables below it, which are
+        # either free (and left at zero) or pivots solved before it
+        solution = 0
+        for pivot in sorted(pivots):
+            row, value = pivots[pivot]
+            if _parity(row & solution) != value:
+                solution |= 1 << pivot
+
+        stream = bitarray(
+            format(solution, f"0{self.stream_length}b")[::-1], endian="little"
+        )
+        return stream, dropped
+
+    def decompress(self, stream: bitarray) -> List[List[int]]:
+        """
+        :returns: The contents of each chain after loading a stream.
+        """
+        solution = int(stream[::-1].to01(), 2) if len(stream) else 0
+        return [
+            [_parity(equation & solution) for equation in chain]
+            for chain in self.equations
+        ]
+
+    def unload(self, contents: List[List[Optional[int]]]) -> Tuple[bitarray, bitarray]:
+        """
+        Computes what the scan-out channels show while the chains are shifted
+        out.
+
+        A channel's bit is masked if any chain it observes on that cycle holds
+        an unknown (``None``) value, or has been shifted out entirely (as what
+        follows depends on the next pattern.)
+
+        :returns: The expected stream and its mask.
+        """
+        chains = [deque(chain) for chain in contents]
+        expected = bitarray(endian="little")
+        mask = bitarray(endian="little")
+        for _ in range(self.unload_cycles):
+            outputs = [chain.pop() if len(chain) else None for chain in chains]
+            for members in self.compression.compactor:
+                value = 0
+                known = True
+                for chain in members:
+                    if outputs[chain] is None:
+                        known = False
+                        break
+                    value ^= outputs[chain]
+                expected.append(value if known else 0)
+                mask.append(known)
+        return expected, mask
+
+
+def chain_bits(chain_lengths: Iterable[int]) -> List[ChainBit]:
+    """
+    :returns: The chain and position of each bit of chain-ordered test
+        vectors, where the chains are concatenated.
+    """
+    bits = []
+    for chain, length in enumerate(chain_lengths):
+        bits.extend((chain, position) for position in range(length))
+    return bits
+
+
+def read_chain_lengths(chain_yml: str) -> List[int]:
+    """
+    :returns: The length of every chain in a chain YAML file, in order.
+    """
+    with open(chain_yml, encoding="utf8") as f:
+        raw = yaml.load(f, Loader=yaml.SafeLoader) or []
+    lengths = []
+    for chain in raw:
+        length = 0
+        for partition in chain["partitions"]:
+            for scan_list in partition["scan_lists"]:
+                for inst in scan_list["insts"]:
+                    length += inst.get("bits", 1) if isinstance(inst, dict) else 1
+        lengths.append(length)
+    return lengths
+
+
+def write_streams(f: BinaryIO, streams: Iterable[bitarray]):
+    for stream in streams:
+        f.write(vl_encode(stream))
+
+
+def read_streams(f: BinaryIO) -> Iterable[bitarray]:
+    stream = iter(f.read())
+    while True:
+        try:
+            yield vl_decode(stream, endian="little")
+        except StopIteration:
+            return
+
+
+@dataclass
+class CompressedPatterns:
+    """
+    :param stimuli: The scan-in stream of each pattern.
+    :param responses: The expected scan-out stream of each pattern.
+    :param mask: The mask of the scan-out streams, which is the same for
+        every pattern.
+    :param care_bits: The number of care bits over all patterns.
+    :param dropped_care_bits: The number of care bits that could not be
+        encoded.
+    :param unencodable_pattern_count: The number of patterns with at least
+        one dropped care bit.
+    :param fault_count: The number of faults in the netlist.
+    :param detected_fault_count: The number of faults detected by the patterns
+        as actually loaded into the chains, on the unmasked bits of the
+        scan-out streams.
+    """
+
+    stimuli: List[bitarray]
+    responses: List[bitarray]
+    mask: bitarray
+    care_bits: int
+    dropped_care_bits: int
+    unencodable_pattern_count: int
+    fault_count: int
+    detected_fault_count: int
+
+
+def compress_patterns(
+    encoder: PatternEncoder,
+    bench: Bench,
+    patterns: List[str],
+    tv_locations: List[ChainBit],
+    au_locations: List[ChainBit],
+) -> CompressedPatterns:
+    """
+    Encodes test patterns for the cutaway netlist ``bench``.
+
+    Only the care bits of each pattern (see
+    :func:`librelane_plugin_difetto.bench.relax_patterns`) are encoded, and
+    the responses are then computed for the patterns as the decompressor
+    actually loads them, don't-cares included.
+
+    :param tv_locations: The chain and position of each input of ``bench``.
+    :param au_locations: The chain and position that captures each output of
+        ``bench``. Positions that capture none are masked.
+    """
+    care_masks = relax_patterns(bench, patterns)
+    stimuli = []
+    applied = []
+    care_bits = 0
+    dropped_care_bits = 0
+    unencodable_pattern_count = 0
+    for pattern, care_mask in zip(patterns, care_masks):
+        care = {
+            tv_locations[i]: int(pattern[i])
+            for i in range(len(pattern))
+            if (care_mask >> i) & 1
+        }
+        stream, dropped = encoder.encode(care)
+        care_bits += len(care)
+        dropped_care_bits += dropped
+        unencodable_pattern_count += dropped != 0
+        stimuli.append(stream)
+        contents = encoder.decompress(stream)
+        applied.append(
+            "".join(str(contents[chain][position]) for chain, position in tv_locations)
+        )
+
+    simulator = FaultSimulator(bench, applied)
+    # which bits are masked only depends on the positions that capture outputs
+    observed: List[List[Optional[int]]] = [
+        [None] * length for length in encoder.chain_lengths
+    ]
+    for chain, position in au_locations:
+        observed[chain][position] = 0
+    _, mask = encoder.unload(observed)
+    captured = []
+    responses = []
+    for response in simulator.responses():
+        contents: List[List[Optional[int]]] = [
+            [None] * length for length in encoder.chain_lengths
+        ]
+        for value, (chain, position) in zip(response, au_locations):
+            contents[chain][position] = int(value)
+        expected, _ = encoder.unload(contents)
+        captured.append(contents)
+        responses.append(expected)
+
+    # A fault is only detected if it shows on an unmasked bit of the scan-out
+    # streams: errors may be masked, or cancel out in the compactor
+    locations = dict(zip(bench.outputs, au_locations))
+    faults = bench.faults()
+    detected_fault_count = 0
+    for fault in faults:
+        errors = simulator.observe(fault)
+        patterns = 0
+        for pattern_mask in errors.values():
+            patterns |= pattern_mask
+        for p in range(simulator.pattern_count):
+            if not (patterns >> p) & 1:
+                continue
+            contents = [list(chain) for chain in captured[p]]
+            for output, pattern_mask in errors.items():
+                if (pattern_mask >> p) & 1:
+                    chain, position = locations[output]
+                    contents[chain][position] ^= 1
+            faulty, _ = encoder.unload(contents)
+            if ((faulty ^ responses[p]) & mask).any():
+                detected_fault_count += 1
+                break
+
+    return CompressedPatterns(
+        stimuli=stimuli,
+        responses=responses,
+        mask=mask,
+        care_bits=care_bits,
+        dropped_care_bits=dropped_care_bits,
+        unencodable_pattern_count=unencodable_pattern_count,
+        fault_count=len(faults),
+        detected_fault_count=detected_fault_count,
+    )
@@ -0,0 +1,247 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+"""
+Diagnosis of failing test vectors against a fault dictionary of single
+stuck-at faults.
+
+The dictionary holds the signature of every fault the applied patterns
+detect: the patterns under which each output of the cutaway netlist flips.
+Faults with the same signature cannot be told apart by the patterns, so they
+are kept together as one candidate.
+
+Observed responses are the bits of the ``^`` lines of the diff files written
+by ``Difetto.SimulateTestVectors``, i.e. positions in the (possibly
+compressed) scan-out stream of each vector.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from bitarray import bitarray
+
+from .bench import Bench, Fault, FaultSimulator
+from .compression import ChainBit, PatternEncoder
+
+# ((output index, mask of patterns), …), sorted by output index
+Signature = Tuple[Tuple[int, int], ...]
+
+
+class FaultDictionary(object):
+    """
+    :param bench: The cutaway netlist.
+    :param patterns: The patterns as applied, in the input order of the
+        netlist.
+    """
+
+    def __init__(self, bench: Bench, patterns: List[str]):
+        self.bench = bench
+        self.pattern_count = len(patterns)
+        output_index = {output: i for i, output in enumerate(bench.outputs)}
+        simulator = FaultSimulator(bench, patterns)
+
+        self.classes: Dict[Signature, List[Fault]] = {}
+        self.undetected: List[Fault] = []
+        for fault in bench.faults():
+            observed = simulator.observe(fault)
+            if len(observed) == 0:
+                self.undetected.append(fault)
+                continue
+            signature = tuple(
+                sorted(
+                    (output_index[output], mask) for output, mask in observed.items()
+                )
+            )
+            self.classes.setdefault(signature, []).append(fault)
+
+        # the signatures that observe each output, with their masks
+        self.by_output: Dict[int, List[Tuple[Signature, int]]] = {}
+        for signature in self.classes:
+            for output, mask in signature:
+                self.by_output.setdefault(output, []).append((signature, mask))
+
+
+class ResponseLayout(object):
+    """
+    Maps the outputs of the cutaway netlist to the bits of the observed
+    responses.
+
+    :param chain_lengths: The length of each chain.
+    :param au_locations: The chain and position capturing each output.
+    :param encoder: The encoder of the scan compression, if any.
+    """
+
+    def __init__(
+        self,
+        chain_lengths: List[int],
+        au_locations: List[ChainBit],
+        encoder: Optional[PatternEncoder] = None,
+    ):
+        self.chain_lengths = chain_lengths
+        self.au_locations = au_locations
+        self.encoder = encoder
+        offsets = [0]
+        for length in chain_lengths:
+            offsets.append(offsets[-1] + length)
+        self.offsets = offsets
+        self.output_by_location = {
+            location: output for output, location in enumerate(au_locations)
+        }
+
+    def bits(self, outputs: Iterable[int]) -> Set[int]:
+        """
+        :returns: The response bits that flip if exactly the given outputs do.
+        """
+        if self.encoder is None:
+            return {
+                self.offsets[chain] + position
+                for chain, position in (self.au_locations[o] for o in outputs)
+            }
+        contents: List[List[Optional[int]]] = [
+            [None] * length for length in self.chain_lengths
+        ]
+        for chain, position in self.au_locations:
+            contents[chain][position] = 0
+        for output in outputs:
+            chain, position = self.au_locations[output]
+            contents[chain][position] = 1
+        flipped, _ = self.encoder.unload(contents)
+        return set(flipped.search(1))
+
+    def outputs(self, bit: int) -> List[int]:
+        """
+        :returns: The outputs that may flip a response bit.
+        """
+        if self.encoder is None:
+            for chain, length in enumerate(self.chain_lengths):
+                if bit < self.offsets[chain] + length:
+                    location = (chain, bit - self.offsets[chain])
+                    break
+            else:
+                return []
+            output = self.output_by_location.get(location)
+            return [] if output is None else [output]
+        channels = self.encoder.compression.channels
+        cycle, channel = divmod(bit, channels)
+        outputs = []
+        for chain in self.encoder.compression.compactor[channel]:
+            location = (chain, self.chain_lengths[chain] - 1 - cycle)
+            output = self.output_by_location.get(location)
+            if output is not None:
+                outputs.append(output)
+        return outputs
+
+
+@dataclass
+class Candidate:
+    """
+    A class of equivalent faults, scored against the observed responses.
+
+    :param faults: The faults, which the patterns cannot tell apart.
+    :param explained: Failing bits the faults predict (TFSF.)
+    :param unobserved: Bits the faults predict to fail that passed (TFSP.)
+    :param unexplained: Failing bits the faults do not predict (TPSF.)
+    """
+
+    faults: List[Fault]
+    explained: int
+    unobserved: int
+    unexplained: int
+
+    @property
+    def score(self) -> float:
+        """
+        The share of bits predicted or observed to fail that both are, where
+        ``1`` is an exact match.
+        """
+        total = self.explained + self.unobserved + self.unexplained
+        return self.explained / total if total else 0.0
+
+
+def diagnose(
+    dictionary: FaultDictionary,
+    layout: ResponseLayout,
+    observed: List[Set[int]],
+) -> List[Candidate]:
+    """
+    Ranks the fault classes that explain at least one failing bit.
+
+    :param observed: For each pattern of the dictionary, the bits of its
+        response that failed (empty if it passed.)
+    :returns: The candidates, best first.
+    """
+    candidates: Set[Signature] = set()
+    for p, failing in enumerate(observed):
+        for bit in failing:
+            for output in layout.outputs(bit):
+                for signature, mask in dictionary.by_output.get(output, []):
+                    if (mask >> p) & 1:
+                        candidates.add(signature)
+
+    observed_total = sum(len(failing) for failing in observed)
+    ranked = []
+    for signature in candidates:
+        flipped: Dict[int, List[int]] = {}
+        for output, mask in signature:
+            while mask:
+                p = (mask & -mask).bit_length() - 1
+                flipped.setdefault(p, []).append(output)
+                mask &= mask - 1
+        explained = 0
+        unobserved = 0
+        for p, outputs in flipped.items():
+            predicted = layout.bits(outputs)
+            matched = len(predicted & observed[p])
+            explained += matched
+            unobserved += len(predicted) - matched
+        ranked.append(
+            Candidate(
+                faults=dictionary.classes[signature],
+                explained=explained,
+                unobserved=unobserved,
+                unexplained=observed_total - explained,
+            )
+        )
+    ranked.sort(key=lambda c: (-c.score, -c.explained, c.faults))
+    return ranked
+
+
+_diff_rx = re.compile(r"^tv_(\d+)\.log$")
+
+
+def read_diffs(diff_dir: str) -> Dict[int, Set[int]]:
+    """
+    :returns: For each vector with a diff file in ``diff_dir``, the bits of its
+        response that failed.
+    """
+    diffs = {}
+    for file in os.listdir(diff_dir):
+        if match := _diff_rx.match(file):
+            failing: Set[int] = set()
+            with open(os.path.join(diff_dir, file), encoding="utf8") as f:
+                for line in f:
+                    if line.startswith("^"):
+                        failing = set(bitarray(line[1:].strip()).search(1))
+            diffs[int(match[1])] = failing
+    return diffs
+
+
+def describe(net: str, drivers: Dict[str, List[str]]) -> str:
+    """
+    :returns: A fault site named by the cell instance (and type and pin)
+        driving it, or by the port or flip-flop it is.
+    """
+    if driver := drivers.get(net):
+        instance, cell, pin = driver
+        return f"{instance} ({cell}/{pin}) → {net}"
+    # nl2bench names the internal nodes of a cell's function after its output
+    base, _, node = net.rpartition(".")
+    if node.isdigit() and (driver := drivers.get(base)):
+        instance, cell, pin = driver
+        return f"{instance} ({cell}/{pin}, internal node {node}) → {base}"
+    if net.endswith(".q"):
+        return f"{net[:-2]} (scan flip-flop output)"
+    if net.endswith(".d"):
+        return f"{net[:-2]} (scan flip-flop input)"
+    return f"{net} (port)"
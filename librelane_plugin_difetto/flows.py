@@ -1,6 +1,16 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright (c) 2025 Mohamed Gaber
+import os
+from concurrent.futures import Future
+from typing import Iterable, List, Optional, Set, Tuple, Type
+
 from librelane.flows import Flow, SequentialFlow
+from librelane.flows.flow import FlowError, FlowException
+from librelane.common import get_tpe
+from librelane.config import Variable
+from librelane.logging import info
+from librelane.state import State, DesignFormat
+from librelane.steps import Step, DeferredStepError
 from . import steps as Difetto
 
 
@@ -11,10 +21,26 @@ class DifettoPNR(Flow.factory.get("Classic")):
         ("+Difetto.Synthesis", "Difetto.BoundaryScan"),
         ("+Difetto.BoundaryScan", "Difetto.Resynthesis"),
         ("+Difetto.Resynthesis", "Difetto.ScanReplace"),
-        ("+Difetto.ScanReplace", "Difetto.Cut"),
+        ("+Difetto.ScanReplace", "Difetto.DRC"),
+        ("+Difetto.DRC", "Difetto.ScanCompress"),
+        ("+Difetto.ScanCompress", "Difetto.Cut"),
         ("-OpenROAD.CTS", "Difetto.Chain"),
     ]
 
+    config_vars = Flow.factory.get("Classic").config_vars + [
+        Variable(
+            "DFT_SCAN_COMPRESSION",
+            bool,
+            "Insert a scan decompressor and compactor (see Difetto.ScanCompress,) so many short internal scan chains are loaded and unloaded through a few scan channels. Test patterns are then encoded for the decompressor, which cuts the test data volume and shift cycles.",
+            default=False,
+        ),
+    ]
+
+    gating_config_vars = {
+        **Flow.factory.get("Classic").gating_config_vars,
+        "Difetto.ScanCompress": ["DFT_SCAN_COMPRESSION"],
+    }
+
 
 @Flow.factory.register()
 class DifettoATPG(SequentialFlow):
@@ -28,3 +54,164 @@ class DifettoTest(SequentialFlow):
         Difetto.ValidateChain,
         Difetto.SimulateTestVectors,
     ]
+
+
+class _ATPGBranch(object):
+    """
+    The background branch of a :class:`DifettoFull` run: a future for the
+    state after its latest step, and the formats its steps produce.
+
+    :meth:`wrap` turns the flow's steps into subclasses that start the
+    background steps asynchronously and join or check the branch before the
+    foreground steps, so :meth:`SequentialFlow.run` can run the flow as-is.
+    """
+
+    def __init__(self, background_ids: Set[str]) -> None:
+        self.background_ids = background_ids
+        self.future: Optional[Future[State]] = None
+        self.formats: Set[DesignFormat] = set()
+        self.deferred_errors: List[str] = []
+
+    def failed(self) -> bool:
+        return (
+            self.future is not None
+            and self.future.done()
+            and self.future.exception() is not None
+        )
+
+    def join(self, current_state: State) -> State:
+        if self.future is None:
+            return current_state
+        future, self.future = self.future, None
+        info("Waiting for ATPG to finish…")
+        try:
+            background_state = future.result()
+        except DeferredStepError as e:
+            self.deferred_errors.append(str(e))
+            return current_state
+        metrics = background_state.metrics.copy_mut()
+        metrics.update(current_state.metrics)
+        return State(
+            current_state,
+            overrides={
+                format.id: background_state[format]
+                for format in self.formats
+                if background_state.get(format.id) is not None
+            },
+            metrics=metrics,
+        )
+
+    def wrap(self, cls: Type[Step]) -> Type[Step]:
+        branch = self
+        if cls.id in self.background_ids:
+
+            class Wrapped(cls):  # type: ignore
+                def __init__(self, config, state_in, **kwargs):
+                    self.foreground_state = state_in
+                    super(Wrapped, self).__init__(
+                        config=config,
+                        state_in=branch.future or state_in,
+                        **kwargs,
+                    )
+
+                def start(self, toolbox=None, step_dir=None, **kwargs) -> State:
+                    branch.future = get_tpe().submit(
+                        super(Wrapped, self).start,
+                        toolbox=toolbox,
+                        step_dir=step_dir,
+                        **kwargs,
+                    )
+                    branch.formats.update(self.outputs)
+                    return self.foreground_state
+
+        else:
+
+            class Wrapped(cls):  # type: ignore
+                def start(self, toolbox=None, step_dir=None, **kwargs) -> State:
+                    # Fail as soon as the background branch does instead of
+                    # after the rest of PnR
+                    if branch.failed() or branch.formats.intersection(self.inputs):
+                        state_in = Future()
+                        state_in.set_result(branch.join(self.state_in.result()))
+                        self.state_in = state_in
+                    return super(Wrapped, self).start(
+                        toolbox=toolbox, step_dir=step_dir, **kwargs
+                    )
+
+        Wrapped.__name__ = cls.__name__
+        Wrapped.__qualname__ = cls.__qualname__
+        Wrapped._implementation_id = cls.get_implementation_id()
+        return Wrapped
+
+
+@Flow.factory.register()
+class DifettoFull(DifettoPNR):
+    """
+    :class:`DifettoPNR`, :class:`DifettoATPG` and :class:`DifettoTest` as one
+    flow.
+
+    The ATPG steps only need the cutaway netlist, so they are started in the
+    background as soon as ``Difetto.Cut`` is done and run alongside
+    floorplanning, placement, CTS and routing. The two branches are joined
+    before the first step that consumes one of the ATPG outputs (i.e.
+    ``Difetto.AssemblePatterns``), or at the end of the flow otherwise.
+
+    If an ATPG step fails, the flow stops before the next step instead of
+    after the rest of PnR.
+
+    ``--from``, ``--to``, ``--skip`` and gating variables work as they do for
+    other sequential flows. If ``Difetto.Cut`` does not run (e.g., when
+    resuming with ``--from``), the ATPG steps start from whichever state is
+    current when they are reached.
+    """
+
+    BackgroundSteps = DifettoATPG.Steps
+
+    Steps = DifettoPNR.Steps + DifettoTest.Steps
+    Substitutions = [
+        ("+Difetto.Cut", Difetto.WriteBench),
+        ("+Difetto.WriteBench", Difetto.QuaighATPG),
+        ("+Difetto.QuaighATPG", Difetto.QuaighSim),
+    ]
+
+    def run(
+        self,
+        initial_state: State,
+        frm: Optional[str] = None,
+        to: Optional[str] = None,
+        skip: Optional[Iterable[str]] = None,
+        reproducible: Optional[str] = None,
+        **kwargs,
+    ) -> Tuple[State, List[Step]]:
+        branch = _ATPGBranch({cls.id for cls in self.BackgroundSteps})
+        steps = self.Steps
+        self.Steps = [branch.wrap(cls) for cls in steps]
+        try:
+            current_state, step_list = super().run(
+                initial_state,
+                frm=frm,
+                to=to,
+                skip=skip,
+                reproducible=reproducible,
+                **kwargs,
+            )
+        finally:
+            self.Steps = steps
+
+        # Nothing that ran consumed the ATPG outputs (e.g., with --to)
+        if branch.future is not None:
+            current_state = branch.join(current_state)
+            assert self.run_dir is not None
+            final_views_path = os.path.join(self.run_dir, "final")
+            try:
+                current_state.save_snapshot(final_views_path)
+            except Exception as e:
+                raise FlowException(f"Failed to save final views: {e}")
+
+        if len(branch.deferred_errors) != 0:
+            raise FlowError(
+                "One or more deferred errors were encountered:\n"
+                + "\n".join(branch.deferred_errors)
+            )
+
+        return (current_state, step_list)
@@ -1,20 +1,27 @@
 import os
 import sys
 import json
+import time
 from pathlib import Path
 
+import yaml
+
 import cocotb
 from cocotb.clock import Clock
 from cocotb.handle import HierarchyObject
 from cocotb.runner import get_runner
+from cocotb.triggers import RisingEdge
+from cocotb.utils import get_sim_time
 
-from scan_chain import run_scan
+from scan_chain import find_scan_flops, run_backdoor, run_compressed, run_scan
 
 __file_dir__ = Path(__file__).absolute().parent
 
 sys.path.append(str(__file_dir__.parent / "common"))
 
+from chain import load_chains
 from patterns import read_patterns_bin
+from instrumentation import PhaseRecorder, ProgressReporter, run_profiled
 
 
 @cocotb.test()
@@ -41,7 +48,17 @@ async def chain_test(dut: HierarchyObject):
     sco = getattr(dut, sco_s)
     sce = getattr(dut, sce_s)
 
-    test_clock = Clock(tck, 10, units="us")
+    if compression_path := os.environ["CURRENT_SCAN_COMPRESSION"]:
+        with open(compression_path, encoding="utf8") as f:
+            compression = json.load(f)
+        scis = [getattr(dut, name) for name in compression["scan_in"]]
+        scos = [getattr(dut, name) for name in compression["scan_out"]]
+        cocotb.log.info(
+            f"Scan compression: driving {len(scis)} channel(s) for {len(compression['taps'])} internal chain(s)."
+        )
+
+    clock_period_ns = 10_000
+    test_clock = Clock(tck, clock_period_ns, units="ns")
 
     if excluded := config["DFT_BSCAN_EXCLUDE_IO"]:
         for io in excluded:
@@ -53,39 +70,176 @@ async def chain_test(dut: HierarchyObject):
             port.value = value_to_coerce
     cocotb.start_soon(test_clock.start(start_high=False))
 
+    backdoor = config["DFT_SIM_BACKDOOR"]
+    if backdoor:
+        with open(os.environ["CURRENT_CHAIN_YML"], encoding="utf8") as f:
+            chains = load_chains(yaml.load(f, Loader=yaml.SafeLoader))
+        assert len(chains) == 1, "multiple chains not supported"
+        # asserts that the chain has a single partition and scan list
+        chains[0].get_length_of_uniform_chain()
+        flop_outputs, flop_data = find_scan_flops(
+            dut,
+            chains[0],
+            config["DFT_SIM_BACKDOOR_OUTPUT_PIN"],
+            config["DFT_SIM_BACKDOOR_DATA_PIN"],
+        )
+        cocotb.log.info(
+            f"Backdoor mode: found {len(flop_outputs)} scan flip-flops; the first {config['DFT_SIM_SERIAL_VECTORS']} vector(s) will be shifted serially."
+        )
+
     step_dir = Path(os.environ["STEP_DIR"])
     diff_dir = step_dir / "diffs"
     diff_dir.mkdir(parents=True, exist_ok=True)
 
-    bad_values = 0
+    # seeded by the step, possibly from the checkpoint of an earlier run
+    checkpoint_path = step_dir / "checkpoint.json"
+    with open(checkpoint_path, encoding="utf8") as f:
+        checkpoint = json.load(f)
+    end = config["DFT_SIM_END_VECTOR"]
+    max_failures = config["DFT_SIM_MAX_FAILURES"]
+    abort_window = config["DFT_SIM_ABORT_IF_FIRST_FAIL"]
+
+    # the test runs inside the simulator process, so this measures the
+    # simulator's own memory
+    recorder = PhaseRecorder("run_tvs")
+    shift_time = 0.0
+    backdoor_time = 0.0
+    backdoor_count = 0
+
+    with open(os.environ["CURRENT_TVS"], "rb") as tvs_f:
+        vector_count = sum(1 for _ in read_patterns_bin(tvs_f))
+    if end is not None:
+        vector_count = min(vector_count, end)
+    progress = ProgressReporter(
+        "run_tvs",
+        str(step_dir / "progress.json"),
+        total=max(0, vector_count - checkpoint["next"]),
+        clock_period=clock_period_ns,
+        time_scale=1e-9,
+        interval=float(config["DFT_SIM_PROGRESS_INTERVAL"]),
+        log=cocotb.log.info,
+    )
+    progress.update(0, get_sim_time(units="ns"))
+
+    failed = list(checkpoint["failed"])
+    # only failures of this run count towards the limit, or a run aborted on
+    # it would abort again right after resuming
+    previously_failed = len(failed)
+    simulated = 0
+    aborted = None
     with open(os.environ["CURRENT_TVS"], "rb") as tvs_f, open(
         os.environ["CURRENT_AU"], "rb"
     ) as au_f:
         for i, (tv, au) in enumerate(
             zip(read_patterns_bin(tvs_f), read_patterns_bin(au_f))
         ):
-            cocotb.log.info(f"Running test vector {i}…")
+            if i < checkpoint["next"]:
+                continue
+            if end is not None and i >= end:
+                break
+            # a few vectors are always shifted serially to exercise the chain
+            # itself
+            serial = not backdoor or simulated < config["DFT_SIM_SERIAL_VECTORS"]
+            cocotb.log.info(
+                f"Running test vector {i}{'' if serial else ' (backdoor)'}…"
+            )
+            start = time.perf_counter()
             with open(diff_dir / f"tv_{i}.log", "w", encoding="utf8") as diff_f:
-                diff = await run_scan(
-                    tck,
-                    tm,
-                    sce,
-                    sci,
-                    sco,
-                    tv,
-                    au,
-                    mask,
-                    diff_file=diff_f,
-                    wait_cycle=True,
-                )
+                if serial and compression_path:
+                    diff = await run_compressed(
+                        tck,
+                        tm,
+                        sce,
+                        scis,
+                        scos,
+                        tv,
+                        au,
+                        mask,
+                        diff_file=diff_f,
+                        wait_cycle=True,
+                    )
+                elif serial:
+                    diff = await run_scan(
+                        tck,
+                        tm,
+                        sce,
+                        sci,
+                        sco,
+                        tv,
+                        au,
+                        mask,
+                        diff_file=diff_f,
+                        wait_cycle=True,
+                    )
+                else:
+                    assert len(tv) == len(
+                        flop_outputs
+                    ), f"test vector {i} has {len(tv)} bits, but the chain has {len(flop_outputs)} flip-flops"
+                    if backdoor_count == 0:
+                        # wait a couple cycles for clock multiplexers and such,
+                        # as run_scan does
+                        tm.value = 1
+                        for _ in range(4):
+                            await RisingEdge(tck)
+                    diff = await run_backdoor(
+                        tck,
+                        tm,
+                        sce,
+                        flop_outputs,
+                        flop_data,
+                        tv,
+                        au,
+                        mask,
+                        diff_file=diff_f,
+                    )
+            if serial:
+                shift_time += time.perf_counter() - start
+            else:
+                backdoor_time += time.perf_counter() - start
+                backdoor_count += 1
+            simulated += 1
 
             if diff.count(1) != 0:
-                bad_values += 1
+                failed.append(i)
                 cocotb.log.error(f"Test vector {i} failed.")
             else:
                 cocotb.log.info(f"Test vector {i} succeeded.")
 
-    assert bad_values == 0, "One or more test chains did not respond as expected."
+            checkpoint["next"] = i + 1
+            checkpoint["failed"] = failed
+            with open(f"{checkpoint_path}.tmp", "w", encoding="utf8") as f:
+                json.dump(checkpoint, f)
+            os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+            progress.update(simulated, get_sim_time(units="ns"))
+
+            if (
+                max_failures is not None
+                and len(failed) - previously_failed >= max_failures
+            ):
+                aborted = f"{len(failed) - previously_failed} vector(s) failed"
+            elif abort_window is not None and simulated == abort_window:
+                if all(index in failed for index in range(i + 1 - simulated, i + 1)):
+                    aborted = f"the first {simulated} vector(s) all failed"
+            if aborted is not None:
+                cocotb.log.error(
+                    f"Aborting: {aborted}. Resume from '{checkpoint_path}' to continue from vector {i + 1}."
+                )
+                break
+
+    recorder.record("shift", shift_time)
+    if backdoor:
+        recorder.record("backdoor", backdoor_time)
+    progress.finish(simulated, get_sim_time(units="ns"))
+    print(f"%OL_METRIC_I difetto__sim__simulated_vector_count {simulated}", flush=True)
+    print(
+        f"%OL_METRIC_I difetto__sim__backdoor_vector_count {backdoor_count}", flush=True
+    )
+    print(f"%OL_METRIC_I difetto__sim__failed_vector_count {len(failed)}", flush=True)
+    print(f"%OL_METRIC_I difetto__sim__next_vector {checkpoint['next']}", flush=True)
+
+    assert aborted is None, f"Simulation aborted early: {aborted}."
+    assert len(failed) == 0, "One or more test chains did not respond as expected."
 
 
 if __name__ == "__main__":
@@ -129,30 +283,47 @@ if __name__ == "__main__":
         required=True,
         type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
     )
+    @click.option(
+        "--chain-yml",
+        required=True,
+        type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    )
+    @click.option(
+        "--scan-compression",
+        default=None,
+        type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    )
     @click.argument("sources", nargs=-1)
-    def main(step_dir, config, au, tvs, mask, sources):
+    def main(step_dir, config, au, tvs, mask, chain_yml, scan_compression, sources):
         config_dict = json.load(open(config, encoding="utf8"))
+        # the simulator runs in child processes
+        recorder = PhaseRecorder("run_tvs", include_children=True)
         runner = get_runner(config_dict["DFT_COCOTB_SIM"])
         print("%OL_CREATE_REPORT compile.rpt")
-        runner.build(
-            sources=sources,
-            defines={"FUNCTIONAL": True},
-            hdl_toplevel=config_dict["DESIGN_NAME"],
-            always=True,
-            waves=True,
-        )
+        with recorder.phase("compile"):
+            runner.build(
+                sources=sources,
+                defines={"FUNCTIONAL": True},
+                hdl_toplevel=config_dict["DESIGN_NAME"],
+                always=True,
+                waves=True,
+            )
         print("%OL_END_REPORT")
-        runner.test(
-            hdl_toplevel=config_dict["DESIGN_NAME"],
-            test_module="run_tvs,",
-            extra_env={
-                "CURRENT_AU": au,
-                "CURRENT_TVS": tvs,
-                "CURRENT_MASK": mask,
-                "STEP_CONFIG": config,
-                "STEP_DIR": step_dir,
-            },
-            waves=True,
-        )
+        with recorder.phase("simulate"):
+            runner.test(
+                hdl_toplevel=config_dict["DESIGN_NAME"],
+                test_module="run_tvs,",
+                extra_env={
+                    "CURRENT_AU": au,
+                    "CURRENT_TVS": tvs,
+                    "CURRENT_MASK": mask,
+                    "CURRENT_CHAIN_YML": chain_yml,
+                    "CURRENT_SCAN_COMPRESSION": scan_compression or "",
+                    "STEP_CONFIG": config,
+                    "STEP_DIR": step_dir,
+                },
+                waves=True,
+            )
+        recorder.total()
 
-    main()
+    run_profiled(main, "run_tvs")
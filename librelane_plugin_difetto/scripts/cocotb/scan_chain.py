@@ -2,7 +2,7 @@ import io
 import sys
 from bitarray import bitarray
 
-from cocotb.triggers import RisingEdge
+from cocotb.triggers import FallingEdge, ReadOnly, RisingEdge
 from cocotb.binary import BinaryValue
 
 
@@ -61,3 +61,129 @@ async def run_scan(
         print("^", diff.to01(), file=diff_file)
 
     return diff
+
+
+def find_instance(dut, name: str):
+    """
+    :returns: The handle of a cell instance in the (flattened) netlist, given
+        its name as written in ``chain.yml``.
+    """
+    # chain.yml escapes brackets in the names yosys generates
+    name = name.replace("\\", "")
+    for candidate in [name, f"\\{name} "]:
+        try:
+            return dut._id(candidate, extended=False)
+        except AttributeError:
+            continue
+    raise AttributeError(f"instance '{name}' not found in '{dut._name}'")
+
+
+def find_scan_flops(dut, chain, output_pin: str = "Q", data_pin: str = "D"):
+    """
+    :returns: The output and data pin handles of every flip-flop of a chain,
+        in the order of the chain (i.e. the order of the bits of the test
+        vectors.)
+    """
+    outputs = []
+    data = []
+    for inst in chain.partitions[0].scan_lists[0].insts:
+        assert inst.bits == 1, f"multi-bit scan cell '{inst.name}' not supported"
+        instance = find_instance(dut, inst.name)
+        outputs.append(getattr(instance, output_pin))
+        data.append(getattr(instance, data_pin))
+    return outputs, data
+
+
+async def run_backdoor(
+    tck,
+    tm,
+    sce,
+    outputs,
+    data,
+    tv: bitarray,
+    au: bitarray,
+    mask: bitarray,
+    diff_file: io.TextIOWrapper = sys.stdout,
+):
+    """
+    Like :func:`run_scan`, but the vector is deposited directly onto the
+    outputs of the flip-flops and the response is sampled at their data pins,
+    so only the capture cycle is simulated.
+
+    The response is sampled at the data pins right before the capture edge,
+    as depositing onto the outputs bypasses the state held inside the cell
+    models: an output would keep its deposited value after the capture edge
+    if the captured value were the same as the flip-flop's previous state.
+    """
+    tm.value = 1
+    sce.value = 0
+    await FallingEdge(tck)
+    for output, value in zip(outputs, tv):
+        output.value = value
+    await ReadOnly()
+    out = bitarray([int(pin.value) for pin in data]) & mask
+    await RisingEdge(tck)
+
+    diff = au ^ out
+    if diff_file is not None:
+        print("&", mask.to01(), file=diff_file)
+        print("-", au.to01(), file=diff_file)
+        print("+", out.to01(), file=diff_file)
+        print("^", diff.to01(), file=diff_file)
+
+    return diff
+
+
+async def run_compressed(
+    tck,
+    tm,
+    sce,
+    scis,
+    scos,
+    tv: bitarray,
+    au: bitarray,
+    mask: bitarray,
+    diff_file: io.TextIOWrapper = sys.stdout,
+    wait_cycle=True,
+):
+    """
+    Like :func:`run_scan`, but through a scan decompressor and compactor:
+    ``tv`` is the stream to drive on the scan-in channels ``scis``, and
+    ``au`` and ``mask`` are those of the stream expected on the scan-out
+    channels ``scos``. Bit ``t * channels + k`` of a stream is the value of
+    channel ``k`` on shift cycle ``t``.
+    """
+    tm.value = 1
+    channels = len(scis)
+
+    for _ in range(0, 4):  # wait a couple cycles for clock multiplexers and such
+        await RisingEdge(tck)
+
+    await RisingEdge(tck)
+    sce.value = 1
+    for t in range(len(tv) // channels):
+        for k, sci in enumerate(scis):
+            sci.value = tv[t * channels + k]
+        await RisingEdge(tck)
+    for sci in scis:
+        sci.value = 0
+
+    if wait_cycle:
+        sce.value = 0
+        await RisingEdge(tck)
+        sce.value = 1
+
+    out = bitarray()
+    for _ in range(len(au) // channels):
+        await RisingEdge(tck)
+        out.extend(int(sco.value) for sco in scos)
+
+    out &= mask
+    diff = au ^ out
+    if diff_file is not None:
+        print("&", mask.to01(), file=diff_file)
+        print("-", au.to01(), file=diff_file)
+        print("+", out.to01(), file=diff_file)
+        print("^", diff.to01(), file=diff_file)
+
+    return diff
@@ -11,14 +11,17 @@ import cocotb
 from cocotb.clock import Clock
 from cocotb.handle import HierarchyObject
 from cocotb.runner import get_runner
+from cocotb.utils import get_sim_time
 
-from scan_chain import run_scan
+from scan_chain import run_compressed, run_scan
 
 __file_dir__ = Path(__file__).absolute().parent
 
 sys.path.append(str(__file_dir__.parent / "common"))
 
 from chain import load_chains
+from patterns import read_patterns_bin
+from instrumentation import PhaseRecorder, ProgressReporter, run_profiled
 
 
 @cocotb.test()
@@ -38,9 +41,9 @@ async def chain_test(dut: HierarchyObject):
     if len(chains) == 0:
         cocotb.log.warning("No chains found.")
         return
-    assert len(chains) == 1, "multiple chains not supported"
-    chain = chains[0]
-    chain_length = chain.get_length_of_uniform_chain()
+    compression_path = os.environ["CURRENT_SCAN_COMPRESSION"]
+    assert len(chains) == 1 or compression_path, "multiple chains not supported"
+    chain_length = sum(chain.get_length_of_uniform_chain() for chain in chains)
     if chain_length == 0:
         cocotb.log.warning("Chain is empty.")
         return
@@ -57,7 +60,8 @@ async def chain_test(dut: HierarchyObject):
     sco = getattr(dut, sco_s)
     sce = getattr(dut, sce_s)
 
-    test_clock = Clock(tck, 10, units="us")
+    clock_period_ns = 10_000
+    test_clock = Clock(tck, clock_period_ns, units="ns")
 
     if excluded := config["DFT_BSCAN_EXCLUDE_IO"]:
         for io in excluded:
@@ -72,17 +76,55 @@ async def chain_test(dut: HierarchyObject):
 
     cocotb.start_soon(test_clock.start(start_high=False))
 
-    diff = await run_scan(
-        tck,
-        tm,
-        sce,
-        sci,
-        sco,
-        pattern,
-        pattern,
-        bitarray("1" * chain_length),
-        wait_cycle=False,
+    # the test runs inside the simulator process, so this measures the
+    # simulator's own memory
+    recorder = PhaseRecorder("validate_chain")
+    progress = ProgressReporter(
+        "validate_chain",
+        os.path.join(os.environ["STEP_DIR"], "progress.json"),
+        total=1,
+        clock_period=clock_period_ns,
+        time_scale=1e-9,
+        interval=float(config["DFT_SIM_PROGRESS_INTERVAL"]),
+        log=cocotb.log.info,
     )
+    progress.update(0, get_sim_time(units="ns"))
+    with recorder.phase("shift"):
+        if compression_path:
+            with open(compression_path, encoding="utf8") as f:
+                compression = json.load(f)
+            # prepared by the step, as encoding needs the decompressor's model
+            streams = {}
+            for name in ["tvs", "au", "mask"]:
+                with open(
+                    os.path.join(os.environ["STEP_DIR"], f"chain_test.{name}.bin"),
+                    "rb",
+                ) as f:
+                    streams[name] = next(read_patterns_bin(f))
+            diff = await run_compressed(
+                tck,
+                tm,
+                sce,
+                [getattr(dut, name) for name in compression["scan_in"]],
+                [getattr(dut, name) for name in compression["scan_out"]],
+                streams["tvs"],
+                streams["au"],
+                streams["mask"],
+                wait_cycle=False,
+            )
+        else:
+            diff = await run_scan(
+                tck,
+                tm,
+                sce,
+                sci,
+                sco,
+                pattern,
+                pattern,
+                bitarray("1" * chain_length),
+                wait_cycle=False,
+            )
+    progress.finish(1, get_sim_time(units="ns"))
     assert diff.count(1) == 0, "Chain failed verification"
 
 
@@ -117,28 +159,39 @@ if __name__ == "__main__":
         required=True,
         type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
     )
+    @click.option(
+        "--scan-compression",
+        default=None,
+        type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    )
     @click.argument("sources", nargs=-1)
-    def main(step_dir, config, chain_yml, sources):
+    def main(step_dir, config, chain_yml, scan_compression, sources):
         config_dict = json.load(open(config, encoding="utf8"))
+        # the simulator runs in child processes
+        recorder = PhaseRecorder("validate_chain", include_children=True)
         runner = get_runner(config_dict["DFT_COCOTB_SIM"])
         print("%OL_CREATE_REPORT compile.rpt")
-        runner.build(
-            sources=sources,
-            defines={"FUNCTIONAL": True},
-            hdl_toplevel=config_dict["DESIGN_NAME"],
-            always=True,
-            waves=True,
-        )
+        with recorder.phase("compile"):
+            runner.build(
+                sources=sources,
+                defines={"FUNCTIONAL": True},
+                hdl_toplevel=config_dict["DESIGN_NAME"],
+                always=True,
+                waves=True,
+            )
         print("%OL_END_REPORT")
-        runner.test(
-            hdl_toplevel=config_dict["DESIGN_NAME"],
-            test_module="validate_chain,",
-            extra_env={
-                "CURRENT_CHAIN_YML": chain_yml,
-                "STEP_CONFIG": config,
-                "STEP_DIR": step_dir,
-            },
-            waves=True,
-        )
-
-    main()
+        with recorder.phase("simulate"):
+            runner.test(
+                hdl_toplevel=config_dict["DESIGN_NAME"],
+                test_module="validate_chain,",
+                extra_env={
+                    "CURRENT_CHAIN_YML": chain_yml,
+                    "CURRENT_SCAN_COMPRESSION": scan_compression or "",
+                    "STEP_CONFIG": config,
+                    "STEP_DIR": step_dir,
+                },
+                waves=True,
+            )
+        recorder.total()
+
+    run_profiled(main, "validate_chain")
@@ -0,0 +1,98 @@
+import math
+from dataclasses import dataclass
+from typing import Iterable, Optional, TextIO
+
+
+@dataclass
+class TestCost:
+    """
+    The cost of applying a set of scan test patterns on a tester, assuming
+    the scan-out of each pattern overlaps with the scan-in of the next (so the
+    chain is only ever shifted ``pattern_count + 1`` times in total) and one
+    capture cycle per pattern.
+
+    Tester memory is counted per chain, with every chain padded to the
+    longest one: each shift cycle of each chain needs one bit of stimulus, one
+    bit of expected response and one bit of mask.
+
+    :param chain_length: The total number of scan flip-flops.
+    :param pattern_count: The number of test patterns.
+    :param chains: The number of chains the flip-flops are split into.
+    :param shift_frequency: The scan shift frequency in MHz.
+    :param longest: The length of the longest chain. If unset, the chains are
+        presumed to be balanced.
+    """
+
+    chain_length: int
+    pattern_count: int
+    chains: int
+    shift_frequency: float
+    longest: Optional[int] = None
+
+    @property
+    def longest_chain(self) -> int:
+        if self.longest is not None:
+            return self.longest
+        return math.ceil(self.chain_length / max(1, self.chains))
+
+    @property
+    def shift_cycles(self) -> int:
+        if self.pattern_count == 0:
+            return 0
+        return (self.pattern_count + 1) * self.longest_chain
+
+    @property
+    def capture_cycles(self) -> int:
+        return self.pattern_count
+
+    @property
+    def data_bits(self) -> int:
+        """
+        The tester memory, in bits, for each of the stimulus, the expected
+        response and the mask.
+        """
+        return self.pattern_count * self.longest_chain * self.chains
+
+    @property
+    def test_time(self) -> float:
+        """
+        The time to apply all patterns in seconds.
+        """
+        cycles = self.shift_cycles + self.capture_cycles
+        return cycles / (self.shift_frequency * 1e6)
+
+    def print_metrics(self, suffix: str = ""):
+        for name, value in [
+            ("shift_cycles", self.shift_cycles),
+            ("capture_cycles", self.capture_cycles),
+            ("stimulus_bits", self.data_bits),
+            ("response_bits", self.data_bits),
+            ("mask_bits", self.data_bits),
+        ]:
+            print(f"%OL_METRIC_I difetto__test__{name}{suffix} {value}", flush=True)
+        print(
+            f"%OL_METRIC_F difetto__test__time{suffix} {self.test_time:.9f}", flush=True
+        )
+
+
+def print_what_if_table(
+    f: TextIO,
+    chain_length: int,
+    pattern_count: int,
+    chain_counts: Iterable[int],
+    shift_frequency: float,
+):
+    """
+    Prints a table of the test cost of the same patterns over different
+    numbers of balanced scan chains.
+    """
+    print(
+        f"{'chains':>8} {'length':>10} {'shift cycles':>14} {'memory (bits)':>14} {'time (s)':>12}",
+        file=f,
+    )
+    for chains in chain_counts:
+        cost = TestCost(chain_length, pattern_count, chains, shift_frequency)
+        print(
+            f"{chains:>8} {cost.longest_chain:>10} {cost.shift_cycles:>14} {cost.data_bits * 3:>14} {cost.test_time:>12.6f}",
+            file=f,
+        )
@@ -0,0 +1,211 @@
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+from contextlib import contextmanager
+from typing import Callable
+
+PROFILE_DIR_ENV = "_DIFETTO_PROFILE_DIR"
+PROFILE_TOP_N = 40
+
+
+def peak_rss_bytes(include_children: bool = False) -> int:
+    """
+    :returns: The high-water mark of the resident set size of this process
+        (and, optionally, of its waited-for children) in bytes.
+    """
+    usages = [resource.getrusage(resource.RUSAGE_SELF)]
+    if include_children:
+        usages.append(resource.getrusage(resource.RUSAGE_CHILDREN))
+    peak = max(usage.ru_maxrss for usage in usages)
+    # ru_maxrss is in KiB on Linux, but bytes on macOS
+    if sys.platform != "darwin":
+        peak *= 1024
+    return peak
+
+
+class PhaseRecorder:
+    """
+    Records the wall time and peak RSS of named phases of a script, and prints
+    them as LibreLane metrics so they are collected into the step's
+    ``generated_metrics``:
+
+    * ``difetto__runtime__<step>__<phase>``: wall time in seconds
+    * ``difetto__memory__<step>__<phase>``: peak RSS in bytes at the end of the
+      phase
+
+    As the peak RSS is a high-water mark, the memory metric of a phase only
+    grows past the previous phase's if that phase raised the peak.
+
+    :param step: The name of the script or step, used in the metric names.
+    :param include_children: Whether to include the resource usage of child
+        processes (e.g. simulators) in the memory metrics.
+    """
+
+    def __init__(self, step: str, include_children: bool = False):
+        self.step = self._sanitize(step)
+        self.include_children = include_children
+        self.start = time.perf_counter()
+
+    @staticmethod
+    def _sanitize(name: str) -> str:
+        return re.sub(r"\W+", "_", name).strip("_").lower()
+
+    def record(self, phase: str, runtime: float):
+        phase = self._sanitize(phase)
+        print(
+            f"%OL_METRIC_F difetto__runtime__{self.step}__{phase} {runtime:.6f}",
+            flush=True,
+        )
+        print(
+            f"%OL_METRIC_I difetto__memory__{self.step}__{phase} {peak_rss_bytes(self.include_children)}",
+            flush=True,
+        )
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def total(self):
+        """
+        Records the time since this recorder was created as the ``total``
+        phase.
+        """
+        self.record("total", time.perf_counter() - self.start)
+
+
+def run_profiled(main: Callable, name: str):
+    """
+    Runs ``main``. If the step requested profiling (by setting the
+    ``_DIFETTO_PROFILE_DIR`` environment variable,) ``main`` is run under
+    cProfile, and both the raw profile (``<name>.prof``) and a summary of the
+    hottest functions (``<name>.txt``) are written to that directory.
+
+    :param main: The script's entry point, usually a click command.
+    :param name: The base name of the profile files.
+    """
+    profile_dir = os.getenv(PROFILE_DIR_ENV)
+    if profile_dir is None:
+        return main()
+
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        # click commands exit via SystemExit, even on success
+        return main()
+    finally:
+        profiler.disable()
+        profile_path = os.path.join(profile_dir, f"{name}.prof")
+        profiler.dump_stats(profile_path)
+        with open(os.path.join(profile_dir, f"{name}.txt"), "w", encoding="utf8") as f:
+            stats = pstats.Stats(profiler, stream=f)
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_TOP_N)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_N)
+
+
+class ProgressReporter:
+    """
+    Periodically reports the progress of a simulation to the log and to a
+    JSON file, and prints its final throughput as LibreLane metrics:
+
+    * ``difetto__throughput__<step>__vectors_per_second``
+    * ``difetto__throughput__<step>__cycles_per_second``: simulated clock
+      cycles per wall second
+    * ``difetto__throughput__<step>__sim_time_ratio``: simulated time per
+      wall second
+
+    :param step: The name of the script or step, used in the metric names.
+    :param path: The path of the JSON progress file, which is replaced on
+        every report.
+    :param total: The total number of vectors.
+    :param clock_period: The period of the simulated clock, in the same units
+        as the simulation times passed to :meth:`update`.
+    :param time_scale: The length of one unit of simulation time in seconds.
+    :param interval: The minimum wall time between reports in seconds.
+    :param log: The function to report progress with.
+    """
+
+    def __init__(
+        self,
+        step: str,
+        path: str,
+        total: int,
+        clock_period: float,
+        time_scale: float,
+        interval: float = 10.0,
+        log: Callable[[str], None] = print,
+    ):
+        self.step = PhaseRecorder._sanitize(step)
+        self.path = path
+        self.total = total
+        self.clock_period = clock_period
+        self.time_scale = time_scale
+        self.interval = interval
+        self.log = log
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.start_sim_time = None
+
+    def snapshot(self, done: int, sim_time: float) -> dict:
+        if self.start_sim_time is None:
+            self.start_sim_time = sim_time
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        cycles = (sim_time - self.start_sim_time) / self.clock_period
+        vectors_per_second = done / elapsed
+        remaining = self.total - done
+        return {
+            "done": done,
+            "remaining": remaining,
+            "total": self.total,
+            "elapsed": elapsed,
+            "cycles": int(cycles),
+            "vectors_per_second": vectors_per_second,
+            "cycles_per_second": cycles / elapsed,
+            "sim_time_ratio": (sim_time - self.start_sim_time)
+            * self.time_scale
+            / elapsed,
+            "eta": remaining / vectors_per_second if done else None,
+        }
+
+    def write(self, snapshot: dict):
+        with open(f"{self.path}.tmp", "w", encoding="utf8") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def update(self, done: int, sim_time: float):
+        """
+        Reports progress if at least ``interval`` seconds have passed since
+        the last report.
+
+        :param done: The number of vectors completed so far.
+        :param sim_time: The current simulation time.
+        """
+        if self.start_sim_time is None:
+            self.start_sim_time = sim_time
+        if time.perf_counter() - self.last_report < self.interval:
+            return
+        self.last_report = time.perf_counter()
+        snapshot = self.snapshot(done, sim_time)
+        self.write(snapshot)
+        eta = "?" if snapshot["eta"] is None else f"{snapshot['eta']:.0f}s"
+        self.log(
+            f"Progress: {done}/{self.total} vectors, {snapshot['cycles_per_second']:.0f} cycles/s, {snapshot['sim_time_ratio']:.3g} simulated s/s, ETA {eta}"
+        )
+
+    def finish(self, done: int, sim_time: float):
+        snapshot = self.snapshot(done, sim_time)
+        self.write(snapshot)
+        for name in ["vectors_per_second", "cycles_per_second", "sim_time_ratio"]:
+            print(
+                f"%OL_METRIC_F difetto__throughput__{self.step}__{name} {snapshot[name]:.6g}",
+                flush=True,
+            )
@@ -1,13 +1,13 @@
 import io
 import re
-from typing import BinaryIO
+from typing import BinaryIO, List
 
 from bitarray import bitarray
 from bitarray.util import vl_encode, vl_decode
 
 
 def read_patterns_text(wrapper: io.TextIOWrapper):
-    comment_rx = re.compile(r"\*.+$")
+    comment_rx = re.compile(r"\*.*$")
     index_rx = re.compile(r"^\s*\d+\s*:\s*")
     for line in wrapper:
         line = comment_rx.sub("", line)
@@ -21,6 +21,29 @@ def write_pattern_bin(wrapper: BinaryIO, pattern: bitarray):
     wrapper.write(vl_encode(pattern))
 
 
+def assemble_patterns(
+    wrapper_in: io.TextIOWrapper,
+    wrapper_out: BinaryIO,
+    locations: List[int],
+    length: int,
+) -> int:
+    """
+    Moves bit ``i`` of every text pattern read from ``wrapper_in`` to bit
+    ``locations[i]`` of a ``length``-bit pattern (e.g. in chain order,) which
+    is written to ``wrapper_out`` in binary.
+
+    :returns: The number of patterns.
+    """
+    count = 0
+    for pattern in read_patterns_text(wrapper_in):
+        count += 1
+        assembled = bitarray("0" * length, endian="little")
+        for value, location in zip(pattern, locations):
+            assembled[location] = value
+        write_pattern_bin(wrapper_out, assembled)
+    return count
+
+
 def read_patterns_bin(wrapper: BinaryIO):
     def iter_bytes(wrapper):
         for b in iter(lambda: wrapper.read(1), b""):
@@ -1,11 +1,13 @@
 source $::env(SCRIPTS_DIR)/openroad/common/io.tcl
 read_current_odb
 
+# with scan compression, the chains are stitched between the pins of the
+# decompressor and compactor instead of the scan ports
 set_dft_config\
-    -max_chains 1\
+    -max_chains $::env(_DFT_MAX_CHAINS)\
     -scan_enable_name_pattern $::env(DFT_SCAN_ENABLE_PATTERN)\
-    -scan_in_name_pattern $::env(DFT_SCAN_IN_PATTERN)\
-    -scan_out_name_pattern $::env(DFT_SCAN_OUT_PATTERN)
+    -scan_in_name_pattern $::env(_DFT_CHAIN_SCAN_IN_PATTERN)\
+    -scan_out_name_pattern $::env(_DFT_CHAIN_SCAN_OUT_PATTERN)
 
 puts "%OL_CREATE_REPORT dft.rpt"
 report_dft_config
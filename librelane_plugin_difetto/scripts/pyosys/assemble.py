@@ -15,7 +15,9 @@ __file_dir__ = Path(__file__).absolute().parent
 sys.path.append(str(__file_dir__.parent / "common"))
 
 from chain import load_chains
-from patterns import read_patterns_text, write_pattern_bin
+from patterns import assemble_patterns, write_pattern_bin
+from instrumentation import PhaseRecorder, run_profiled
+from cost import TestCost, print_what_if_table
 
 
 @click.command()
@@ -29,28 +31,50 @@ from patterns import read_patterns_text, write_pattern_bin
 @click.option(
     "--chain-yml", type=click.Path(exists=True, dir_okay=False), required=True
 )
+@click.option(
+    "--locations-out",
+    type=click.Path(exists=False, dir_okay=False),
+    default=None,
+    help="Write the length of every chain and the chain and position of every bit of the raw test vectors and golden outputs to this JSON file. Required if there is more than one chain.",
+)
 @click.option("--config-in", type=click.Path(exists=True), required=True)
 @click.argument("input", nargs=1)
-def assemble(tvs_out, au_out, mask_out, raw_tvs, raw_au, chain_yml, config_in, input):
+def assemble(
+    tvs_out,
+    au_out,
+    mask_out,
+    raw_tvs,
+    raw_au,
+    chain_yml,
+    locations_out,
+    config_in,
+    input,
+):
     with open(config_in, encoding="utf8") as f:
         config = json.load(f)
 
+    recorder = PhaseRecorder("assemble")
+
     with open(chain_yml, encoding="utf8") as f:
         chain_list_raw = yaml.load(f, Loader=yaml.SafeLoader)
 
     chains = load_chains(chain_list_raw)
     if len(chains) == 0:
         ys.log("No chains found.")
-    assert len(chains) == 1, "multiple chains not supported"
-    chain = chains[0]
-    chain_length = chain.get_length_of_uniform_chain()
+    assert (
+        len(chains) == 1 or locations_out is not None
+    ), "multiple chains are only supported with --locations-out"
+    # with multiple chains, the assembled vectors are the chains concatenated
+    chain_lengths = [chain.get_length_of_uniform_chain() for chain in chains]
+    chain_length = sum(chain_lengths)
     if chain_length == 0:
         ys.log("Chain is empty.")
 
     d = ys.Design()
 
-    d.run_pass("read_verilog", input)
-    d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
+    with recorder.phase("read_verilog"):
+        d.run_pass("read_verilog", input)
+        d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
 
     name_by_tv_location = []
     name_by_au_location = []
@@ -75,17 +99,25 @@ def assemble(tvs_out, au_out, mask_out, raw_tvs, raw_au, chain_yml, config_in, i
                     name_by_au_location.append(bit_name)
 
     assembled_location_by_name = {}
+    chain_position_by_name = {}
 
     bsr_rx = re.compile(
         r"^(?P<name>[\w]+)\.(?P<io>[io])bsr\/(?P<edge>rising|falling)\.bits\\\[(?P<bit>\d+)\\\]\._store_"
     )
-    for loc, instance in enumerate(chain.partitions[0].scan_lists[0].insts):
-        name = instance.name
-        if bsr_match := bsr_rx.match(instance.name):
-            io_name = bsr_match.group("name")
-            bit = bsr_match.group("bit")
-            name = f"{io_name}\\[{bit}\\]"
-        assembled_location_by_name[name] = loc
+    offset = 0
+    for chain_index, chain in enumerate(chains):
+        if chain_lengths[chain_index] == 0:
+            continue
+        insts = chain.partitions[0].scan_lists[0].insts
+        for position, instance in enumerate(insts):
+            name = instance.name
+            if bsr_match := bsr_rx.match(instance.name):
+                io_name = bsr_match.group("name")
+                bit = bsr_match.group("bit")
+                name = f"{io_name}\\[{bit}\\]"
+            assembled_location_by_name[name] = offset + position
+            chain_position_by_name[name] = [chain_index, position]
+        offset += chain_lengths[chain_index]
 
     tv_assembly_locations = []
     for name in name_by_tv_location:
@@ -99,15 +131,28 @@ def assemble(tvs_out, au_out, mask_out, raw_tvs, raw_au, chain_yml, config_in, i
         mask[loc] = 1
         au_assembly_locations.append(loc)
 
-    with open(
+    if locations_out is not None:
+        with open(locations_out, "w", encoding="utf8") as f:
+            json.dump(
+                {
+                    "chain_lengths": chain_lengths,
+                    "tvs": [
+                        chain_position_by_name[name] for name in name_by_tv_location
+                    ],
+                    "au": [
+                        chain_position_by_name[name] for name in name_by_au_location
+                    ],
+                },
+                f,
+            )
+
+    with recorder.phase("assemble_tvs"), open(
         raw_tvs,
         encoding="utf8",
     ) as tv_in_f, open(tvs_out, "wb") as tv_out_f:
-        for tv in read_patterns_text(tv_in_f):
-            assembled = bitarray.bitarray("0" * chain_length, endian="little")
-            for value, location in zip(tv, tv_assembly_locations):
-                assembled[location] = value
-            write_pattern_bin(tv_out_f, assembled)
+        pattern_count = assemble_patterns(
+            tv_in_f, tv_out_f, tv_assembly_locations, chain_length
+        )
 
     # with open(tvs_out, "rb") as check:
     #     for tv in read_patterns_bin(check):
@@ -119,16 +164,39 @@ def assemble(tvs_out, au_out, mask_out, raw_tvs, raw_au, chain_yml, config_in, i
     ) as mask_out_f:
         write_pattern_bin(mask_out_f, mask)
 
-    with open(
+    with recorder.phase("assemble_au"), open(
         raw_au,
         encoding="utf8",
     ) as au_in_f, open(au_out, "wb") as au_out_f:
-        for au in read_patterns_text(au_in_f):
-            assembled = bitarray.bitarray("0" * chain_length, endian="little")
-            for value, location in zip(au, au_assembly_locations):
-                assembled[location] = value
-            write_pattern_bin(au_out_f, assembled)
+        assemble_patterns(au_in_f, au_out_f, au_assembly_locations, chain_length)
+
+    shift_frequency = float(config["DFT_SHIFT_FREQUENCY"])
+    print(f"%OL_METRIC_I difetto__test__chain_length {chain_length}")
+    print(f"%OL_METRIC_I difetto__test__pattern_count {pattern_count}")
+    TestCost(
+        chain_length,
+        pattern_count,
+        max(1, len(chain_lengths)),
+        shift_frequency,
+        max(chain_lengths, default=0),
+    ).print_metrics()
+    chain_counts = config["DFT_WHAT_IF_CHAIN_COUNTS"] or []
+    for chains in chain_counts:
+        TestCost(chain_length, pattern_count, chains, shift_frequency).print_metrics(
+            f"__chains:{chains}"
+        )
+    print("%OL_CREATE_REPORT test_cost.rpt")
+    print_what_if_table(
+        sys.stdout,
+        chain_length,
+        pattern_count,
+        sorted(set([1] + chain_counts)),
+        shift_frequency,
+    )
+    print("%OL_END_REPORT", flush=True)
+
+    recorder.total()
 
 
 if __name__ == "__main__":
-    assemble()
+    run_profiled(assemble, "assemble")
@@ -1,12 +1,20 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright (c) 2025 Mohamed Gaber
+import sys
 import json
 import os
 import shlex
 import click
+from pathlib import Path
 
 from ys_common import ys
 
+__file_dir__ = Path(__file__).absolute().parent
+
+sys.path.append(str(__file_dir__.parent / "common"))
+
+from instrumentation import PhaseRecorder, run_profiled
+
 
 @click.command()
 @click.option("--output", type=click.Path(exists=False, dir_okay=False), required=True)
@@ -16,12 +24,14 @@ def boundary_scan(output, config_in, input):
     with open(config_in, encoding="utf8") as f:
         config = json.load(f)
 
+    recorder = PhaseRecorder("boundary_scan")
     d = ys.Design()
 
     d.run_pass("plugin", "-i", "difetto")
 
-    d.run_pass("read_verilog", input)
-    d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
+    with recorder.phase("read_verilog"):
+        d.run_pass("read_verilog", input)
+        d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
 
     dft_top = config["DFT_TOP_MODULE"] or config["DESIGN_NAME"]
     d.run_pass("select", dft_top)
@@ -32,22 +42,32 @@ def boundary_scan(output, config_in, input):
             exclude_io_args.append("-exclude_io")
             exclude_io_args.append(io)
 
-    d.run_pass(
-        "boundary_scan",
-        "-test_mode",
-        config["DFT_TEST_MODE_WIRE"],
-        "-clock",
-        config["DFT_TEST_CLOCK_WIRE"],
-        *exclude_io_args,
-    )
+    cache_args = []
+    if cache_dir := config["DFT_INCREMENTAL_CACHE_DIR"]:
+        cache_args.extend(["-cache_dir", cache_dir])
+
+    with recorder.phase("boundary_scan"):
+        d.run_pass(
+            "boundary_scan",
+            "-test_mode",
+            config["DFT_TEST_MODE_WIRE"],
+            "-clock",
+            config["DFT_TEST_CLOCK_WIRE"],
+            *exclude_io_args,
+            *cache_args,
+        )
 
     dfflibmap_args = []
     for lib in shlex.split(os.environ["_libs_synth"]):
         dfflibmap_args.extend(["-liberty", lib])
-    d.run_pass("dfflibmap", *dfflibmap_args)
+    with recorder.phase("dfflibmap"):
+        d.run_pass("dfflibmap", *dfflibmap_args)
+
+    with recorder.phase("write_verilog"):
+        d.run_pass("write_verilog", output)
 
-    d.run_pass("write_verilog", output)
+    recorder.total()
 
 
 if __name__ == "__main__":
-    boundary_scan()
+    run_profiled(boundary_scan, "boundary_scan")
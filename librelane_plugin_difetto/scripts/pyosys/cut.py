@@ -1,25 +1,41 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright (c) 2025 Mohamed Gaber
+import sys
 import json
 import click
+from pathlib import Path
 
 from ys_common import ys
 
+__file_dir__ = Path(__file__).absolute().parent
+
+sys.path.append(str(__file_dir__.parent / "common"))
+
+from instrumentation import PhaseRecorder, run_profiled
+
 
 @click.command()
 @click.option("--output", type=click.Path(exists=False, dir_okay=False), required=True)
 @click.option("--config-in", type=click.Path(exists=True), required=True)
+@click.option(
+    "--instance-map", type=click.Path(exists=False, dir_okay=False), required=False
+)
+@click.option(
+    "--module-dir", type=click.Path(exists=False, file_okay=False), required=False
+)
 @click.argument("input", nargs=1)
-def cut(output, config_in, input):
+def cut(output, config_in, instance_map, module_dir, input):
     with open(config_in, encoding="utf8") as f:
         config = json.load(f)
 
+    recorder = PhaseRecorder("cut")
     d = ys.Design()
 
     d.run_pass("plugin", "-i", "difetto")
 
-    d.run_pass("read_verilog", input)
-    d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
+    with recorder.phase("read_verilog"):
+        d.run_pass("read_verilog", input)
+        d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
 
     dft_top = config["DFT_TOP_MODULE"] or config["DESIGN_NAME"]
     d.run_pass("select", dft_top)
@@ -30,20 +46,39 @@ def cut(output, config_in, input):
             exclude_io_args.append("-exclude_io")
             exclude_io_args.append(io)
 
-    d.run_pass(
-        "sdff_cut",
-        "-json_mapping",
-        config["DFT_JSON_MAPPING"],
-        "-test_mode",
-        config["DFT_TEST_MODE_WIRE"],
-        "-clock",
-        config["DFT_TEST_CLOCK_WIRE"],
-        *exclude_io_args,
-    )
-    d.run_pass("hierarchy")
-    d.run_pass("flatten")
-    d.run_pass("write_verilog", output)
+    hierarchical_args = []
+    if config["DFT_HIERARCHICAL_CUT"]:
+        hierarchical_args.append("-hierarchical")
+        if instance_map is not None:
+            hierarchical_args.extend(["-instance_map", instance_map])
+        if module_dir is not None:
+            hierarchical_args.extend(["-module_dir", module_dir])
+
+    cache_args = []
+    if cache_dir := config["DFT_INCREMENTAL_CACHE_DIR"]:
+        cache_args.extend(["-cache_dir", cache_dir])
+
+    with recorder.phase("sdff_cut"):
+        d.run_pass(
+            "sdff_cut",
+            "-json_mapping",
+            config["DFT_JSON_MAPPING"],
+            "-test_mode",
+            config["DFT_TEST_MODE_WIRE"],
+            "-clock",
+            config["DFT_TEST_CLOCK_WIRE"],
+            *exclude_io_args,
+            *hierarchical_args,
+            *cache_args,
+        )
+    # sdff_cut already flattens (if requested): this just drops the now-unused
+    # boundary scan register definitions
+    d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
+    with recorder.phase("write_verilog"):
+        d.run_pass("write_verilog", output)
+
+    recorder.total()
 
 
 if __name__ == "__main__":
-    cut()
+    run_profiled(cut, "cut")
@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+import os
+import sys
+import json
+import shlex
+import click
+from pathlib import Path
+
+from ys_common import ys
+
+__file_dir__ = Path(__file__).absolute().parent
+
+sys.path.append(str(__file_dir__.parent / "common"))
+
+from instrumentation import PhaseRecorder, run_profiled
+
+
+@click.command()
+@click.option("--report", type=click.Path(exists=False, dir_okay=False), required=True)
+@click.option("--config-in", type=click.Path(exists=True), required=True)
+@click.argument("input", nargs=1)
+def dft_drc(report, config_in, input):
+    with open(config_in, encoding="utf8") as f:
+        config = json.load(f)
+
+    recorder = PhaseRecorder("dft_drc")
+    d = ys.Design()
+
+    d.run_pass("plugin", "-i", "difetto")
+
+    libs = shlex.split(os.environ["_libs_synth"])
+    with recorder.phase("read_verilog"):
+        for lib in libs:
+            d.run_pass("read_liberty", "-lib", lib)
+        d.run_pass("read_verilog", input)
+        dft_top = config["DFT_TOP_MODULE"] or config["DESIGN_NAME"]
+        # the netlist is not written back: checking a flattened DFT top is
+        # enough, and lets clocks and resets be traced across modules
+        d.run_pass("hierarchy", "-top", dft_top)
+        # flatten drops module attributes: like scan_replace, exclude the
+        # flip-flops of no_scan modules (but not of their submodules)
+        d.run_pass("setattr", "-set", "no_scan", "1", "A:no_scan", "t:*", "%i")
+        d.run_pass("flatten")
+
+    d.run_pass("select", dft_top)
+
+    exclude_io_args = []
+    if exclude_ios := config["DFT_BSCAN_EXCLUDE_IO"]:
+        for io in exclude_ios:
+            exclude_io_args.append("-exclude_io")
+            exclude_io_args.append(io)
+
+    liberty_args = []
+    for lib in libs:
+        liberty_args.extend(["-liberty", lib])
+
+    with recorder.phase("dft_drc"):
+        d.run_pass(
+            "dft_drc",
+            "-json_mapping",
+            config["DFT_JSON_MAPPING"],
+            "-test_mode",
+            config["DFT_TEST_MODE_WIRE"],
+            "-clock",
+            config["DFT_TEST_CLOCK_WIRE"],
+            *liberty_args,
+            *exclude_io_args,
+            "-report",
+            report,
+        )
+
+    recorder.total()
+
+
+if __name__ == "__main__":
+    run_profiled(dft_drc, "dft_drc")
@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+import os
+import sys
+import json
+import shlex
+import click
+from pathlib import Path
+
+from ys_common import ys
+
+__file_dir__ = Path(__file__).absolute().parent
+
+sys.path.append(str(__file_dir__.parent / "common"))
+
+from instrumentation import PhaseRecorder, run_profiled
+
+
+def clean_str(id) -> str:
+    string_id = id.str()
+    if string_id.startswith("\\"):
+        string_id = string_id[1:]
+    return string_id
+
+
+def chunk_name(chunk) -> str:
+    # must match the net names nl2bench writes into the bench netlist
+    wire_name = clean_str(chunk.wire.name)
+    if chunk.width == chunk.wire.width:
+        return wire_name
+    if chunk.wire.upto:
+        return f"{wire_name}[{chunk.wire.width - (chunk.offset - 1) + chunk.wire.start_offset}]"
+    return f"{wire_name}[{chunk.offset + chunk.wire.start_offset}]"
+
+
+@click.command()
+@click.option("--output", type=click.Path(exists=False, dir_okay=False), required=True)
+@click.option("--config-in", type=click.Path(exists=True), required=True)
+@click.argument("input", nargs=1)
+def net_drivers(output, config_in, input):
+    """
+    Writes the cell instance, cell type and pin driving every net of the
+    cutaway netlist to a JSON file.
+    """
+    with open(config_in, encoding="utf8") as f:
+        config = json.load(f)
+
+    recorder = PhaseRecorder("net_drivers")
+    d = ys.Design()
+
+    with recorder.phase("read_verilog"):
+        # port directions are needed to tell drivers from loads
+        for lib in shlex.split(os.environ["_libs_synth"]):
+            d.run_pass("read_liberty", "-lib", lib)
+        d.run_pass("read_verilog", input)
+        d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
+        d.run_pass("flatten")
+        d.run_pass("splitnets")
+
+    drivers = {}
+    module = d.top_module()
+    for cell_id in module.cells_:
+        cell = module.cell(cell_id)
+        for port_id, spec in cell.connections_.items():
+            if not cell.output(port_id):
+                continue
+            for i in range(spec.size()):
+                chunk = spec.extract(i).as_chunk()
+                if not chunk.is_wire():
+                    continue
+                drivers[chunk_name(chunk)] = [
+                    clean_str(cell.name),
+                    clean_str(cell.type),
+                    clean_str(port_id),
+                ]
+
+    with open(output, "w", encoding="utf8") as f:
+        json.dump(drivers, f)
+
+    recorder.total()
+
+
+if __name__ == "__main__":
+    run_profiled(net_drivers, "net_drivers")
@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+import sys
+import json
+import click
+from pathlib import Path
+
+from ys_common import ys
+
+__file_dir__ = Path(__file__).absolute().parent
+
+sys.path.append(str(__file_dir__.parent / "common"))
+
+from instrumentation import PhaseRecorder, run_profiled
+
+
+@click.command()
+@click.option("--output", type=click.Path(exists=False, dir_okay=False), required=True)
+@click.option(
+    "--structure-out", type=click.Path(exists=False, dir_okay=False), required=True
+)
+@click.option("--config-in", type=click.Path(exists=True), required=True)
+@click.argument("input", nargs=1)
+def scan_compress(output, structure_out, config_in, input):
+    with open(config_in, encoding="utf8") as f:
+        config = json.load(f)
+
+    recorder = PhaseRecorder("scan_compress")
+    d = ys.Design()
+
+    d.run_pass("plugin", "-i", "difetto")
+
+    with recorder.phase("read_verilog"):
+        d.run_pass("read_verilog", input)
+        d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
+
+    d.run_pass("select", config["DESIGN_NAME"])
+
+    channel_args = []
+    for channel in range(config["DFT_SCAN_CHANNELS"]):
+        channel_args.extend(
+            [
+                "-scan_in",
+                config["DFT_SCAN_IN_PATTERN"].format(channel),
+                "-scan_out",
+                config["DFT_SCAN_OUT_PATTERN"].format(channel),
+            ]
+        )
+    if stages := config["DFT_COMPRESSION_STAGES"]:
+        channel_args.extend(["-stages", str(stages)])
+
+    with recorder.phase("scan_compress"):
+        d.run_pass(
+            "scan_compress",
+            "-json_mapping",
+            config["DFT_JSON_MAPPING"],
+            "-clock",
+            config["DFT_TEST_CLOCK_WIRE"],
+            "-chains",
+            str(config["DFT_COMPRESSION_CHAINS"]),
+            *channel_args,
+            "-structure",
+            structure_out,
+        )
+
+    with recorder.phase("write_verilog"):
+        d.run_pass("write_verilog", output)
+
+    recorder.total()
+
+
+if __name__ == "__main__":
+    run_profiled(scan_compress, "scan_compress")
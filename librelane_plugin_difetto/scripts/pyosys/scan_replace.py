@@ -1,10 +1,18 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright (c) 2025 Mohamed Gaber
+import sys
 import json
 import click
+from pathlib import Path
 
 from ys_common import ys
 
+__file_dir__ = Path(__file__).absolute().parent
+
+sys.path.append(str(__file_dir__.parent / "common"))
+
+from instrumentation import PhaseRecorder, run_profiled
+
 
 @click.command()
 @click.option("--output", type=click.Path(exists=False, dir_okay=False), required=True)
@@ -14,24 +22,35 @@ def scan_replace(output, config_in, input):
     with open(config_in, encoding="utf8") as f:
         config = json.load(f)
 
+    recorder = PhaseRecorder("scan_replace")
     d = ys.Design()
 
     d.run_pass("plugin", "-i", "difetto")
 
-    d.run_pass("read_verilog", input)
-    d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
+    with recorder.phase("read_verilog"):
+        d.run_pass("read_verilog", input)
+        d.run_pass("hierarchy", "-top", config["DESIGN_NAME"])
 
     dft_top = config["DFT_TOP_MODULE"] or config["DESIGN_NAME"]
     d.run_pass("select", dft_top, "A:hdlname=_difetto_*bsr")
 
-    d.run_pass(
-        "scan_replace",
-        "-json_mapping",
-        config["DFT_JSON_MAPPING"],
-    )
+    cache_args = []
+    if cache_dir := config["DFT_INCREMENTAL_CACHE_DIR"]:
+        cache_args.extend(["-cache_dir", cache_dir])
+
+    with recorder.phase("scan_replace"):
+        d.run_pass(
+            "scan_replace",
+            "-json_mapping",
+            config["DFT_JSON_MAPPING"],
+            *cache_args,
+        )
+
+    with recorder.phase("write_verilog"):
+        d.run_pass("write_verilog", output)
 
-    d.run_pass("write_verilog", output)
+    recorder.total()
 
 
 if __name__ == "__main__":
-    scan_replace()
+    run_profiled(scan_replace, "scan_replace")
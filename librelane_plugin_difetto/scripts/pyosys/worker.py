@@ -0,0 +1,196 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+"""
+A long-lived worker that runs the pyosys scripts of the Difetto steps as jobs,
+sparing each of them the start-up of a new Yosys process (loading libyosys,
+the Python bindings and the Difetto plugin.)
+
+``serve`` must run under Yosys (``yosys -y worker.py -- serve --socket …``)
+and listens on a Unix socket. For every connection, it forks a process that
+reads one job, a JSON object on a single line:
+
+    {"script": …, "args": […], "env": {…}, "cwd": …, "token": …}
+
+…and forks again to run the script in a fresh copy of the worker, where it
+gets its own Yosys designs. The script's output is sent back over the
+connection, followed by ``\\n<token>:<exit code>\\n``.
+
+``run`` is the client: it sends a job with its own environment and working
+directory, relays the script's output to stdout and exits with the script's
+exit code, so it can stand in for ``yosys -y script.py -- args…``.
+
+An empty line in place of a job only checks that the worker is alive.
+"""
+
+import os
+import sys
+import json
+import runpy
+import signal
+import socket
+import secrets
+import click
+
+STATUS_LENGTH_MAX = 8
+
+
+@click.group()
+def cli():
+    pass
+
+
+def run_job(connection: socket.socket, job: dict):
+    # runs in the job process, never returns
+    code = 1
+    try:
+        os.chdir(job["cwd"])
+        os.environ.clear()
+        os.environ.update(job["env"])
+        sys.path[0:0] = [os.path.dirname(os.path.abspath(job["script"]))] + [
+            path for path in job["env"].get("PYTHONPATH", "").split(os.pathsep) if path
+        ]
+
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.close(null_fd)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(connection.fileno(), 1)
+        os.dup2(connection.fileno(), 2)
+
+        sys.argv = [job["script"]] + job["args"]
+        try:
+            runpy.run_path(job["script"], run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+    except BaseException:
+        import traceback
+
+        traceback.print_exc()
+        code = 1
+    finally:
+        from ys_common import ys
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        ys.log_flush()
+        os._exit(code)
+
+
+def handle(connection: socket.socket):
+    # runs in the connection process, never returns
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    with connection.makefile("rb") as f:
+        line = f.readline()
+    if line.strip() == b"":
+        os._exit(0)
+    job = json.loads(line)
+
+    pid = os.fork()
+    if pid == 0:
+        run_job(connection, job)
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        code = 128 + os.WTERMSIG(status)
+    else:
+        code = os.WEXITSTATUS(status)
+
+    connection.sendall(f"\n{job['token']}:{code}\n".encode("utf8"))
+    connection.close()
+    os._exit(0)
+
+
+@cli.command()
+@click.option("--socket", "socket_path", type=click.Path(), required=True)
+@click.option(
+    "--plugin",
+    default="difetto",
+    help="The Yosys plugin to load ahead of the jobs.",
+)
+def serve(socket_path, plugin):
+    """
+    Serves jobs on a Unix socket until interrupted.
+    """
+    # only the worker needs libyosys: the client should start quickly
+    from ys_common import ys
+
+    # loaded once here, so loading it again in a job is a no-op
+    ys.Design().run_pass("plugin", "-i", plugin)
+    ys.log_flush()
+
+    # the connection processes are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(64)
+    print(f"Serving pyosys jobs on '{socket_path}'…", flush=True)
+
+    try:
+        while True:
+            connection, _ = server.accept()
+            if os.fork() == 0:
+                server.close()
+                handle(connection)
+            connection.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+@cli.command()
+@click.option("--socket", "socket_path", type=click.Path(), required=True)
+@click.argument("script", type=click.Path(exists=True, dir_okay=False))
+@click.argument("args", nargs=-1)
+def run(socket_path, script, args):
+    """
+    Runs SCRIPT with ARGS in the worker.
+    """
+    token = secrets.token_hex(8)
+    job = {
+        "script": os.path.abspath(script),
+        "args": list(args),
+        "env": dict(os.environ),
+        "cwd": os.getcwd(),
+        "token": token,
+    }
+
+    status_prefix = f"\n{token}:".encode("utf8")
+    # enough to hold the status line back until it is complete
+    held_back = len(status_prefix) + STATUS_LENGTH_MAX
+    out = sys.stdout.buffer
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(job).encode("utf8") + b"\n")
+        buffer = b""
+        while chunk := connection.recv(65536):
+            buffer += chunk
+            if len(buffer) > held_back:
+                out.write(buffer[:-held_back])
+                out.flush()
+                buffer = buffer[-held_back:]
+
+    status_at = buffer.rfind(status_prefix)
+    if status_at == -1:
+        out.write(buffer)
+        out.flush()
+        print("The pyosys worker exited before the job finished.", file=sys.stderr)
+        sys.exit(1)
+    out.write(buffer[:status_at])
+    out.flush()
+    sys.exit(int(buffer[status_at + len(status_prefix) :].strip()))
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,22 +1,81 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright (c) 2025 Mohamed Gaber
 import os
+import re
+import sys
+import json
+import time
+import shlex
+import random
+import shutil
 import subprocess
+from collections import Counter
+from decimal import Decimal
+from concurrent.futures import Future, ThreadPoolExecutor
 from abc import abstractmethod
-from librelane.steps import Step, StepException
+from librelane.steps import (
+    DefaultOutputProcessor,
+    OutputProcessor,
+    Step,
+    StepError,
+    StepException,
+)
 from librelane.steps.tclstep import TclStep
 from librelane.steps.pyosys import PyosysStep
 from librelane.steps.openroad import OpenROADStep
-from librelane.state import DesignFormat
+from librelane.state import DesignFormat, State
 from librelane.config import Variable
-from librelane.common import Path, get_script_dir, process_list_file
-from librelane.logging import warn
-
-from typing import ClassVar, List, Literal, Optional, Set
+from librelane.common import (
+    Path,
+    get_script_dir,
+    mkdirp,
+    process_list_file,
+)
+from librelane.logging import info, warn
+
+from typing import Any, ClassVar, Dict, Iterable, List, Literal, Optional, Set, Tuple
+
+from bitarray import bitarray
+
+from .bench import (
+    Bench,
+    Fault,
+    FaultSimulator,
+    merge_patterns,
+    random_patterns,
+    read_patterns,
+    remap_patterns,
+    select_patterns,
+    write_patterns,
+)
+from .cache import CachedStep, cached_run, dft_cache_vars, hash_file
+from .compression import (
+    PatternEncoder,
+    ScanCompression,
+    compress_patterns,
+    read_chain_lengths,
+    read_streams,
+    write_streams,
+)
+from .diagnosis import FaultDictionary, ResponseLayout, describe, diagnose, read_diffs
+from .worker import worker_available, worker_command
 
 __file_dir__ = os.path.dirname(os.path.abspath(__file__))
 
 
+def get_script_files(script_path: str) -> List[str]:
+    """
+    :returns: A script and the shared modules in ``scripts/common`` it may
+        import, for use as cache dependencies.
+    """
+    common_dir = os.path.join(__file_dir__, "scripts", "common")
+    return [script_path] + [
+        os.path.join(common_dir, file)
+        for file in sorted(os.listdir(common_dir))
+        if file.endswith(".py")
+    ]
+
+
 @Step.factory.register()
 class Synthesis(Step.factory.get("Yosys.Synthesis")):
     """
@@ -83,12 +142,12 @@ dft_pin_vars = [
     Variable(
         "DFT_SCAN_IN_PATTERN",
         str,
-        "Formatting pattern for scan-in signals to be found/created. Can either be the name of a top-level pin for the ENTIRE DESIGN (not necessarily the DFT top module) or an instance pin in the format instance/pin. You may include up to one set of braces {} which will be replaced with the chain number. Currently, only one chain is supported, so there's no good reason to do that.",
+        "Formatting pattern for scan-in signals to be found/created. Can either be the name of a top-level pin for the ENTIRE DESIGN (not necessarily the DFT top module) or an instance pin in the format instance/pin. You may include up to one set of braces {} which will be replaced with the chain number, or with the channel number if 'DFT_SCAN_COMPRESSION' is set. Without scan compression, only one chain is supported, so there's no good reason to do that.",
     ),
     Variable(
         "DFT_SCAN_OUT_PATTERN",
         str,
-        "Formatting pattern for scan-out signals to be found/created. Can either be the name of a top-level pin for the ENTIRE DESIGN (not necessarily the DFT top module) or an instance pin in the format instance/pin. You may include up to one set of braces {} which will be replaced with the chain number. Currently, only one chain is supported, so there's no good reason to do that.",
+        "Formatting pattern for scan-out signals to be found/created. Can either be the name of a top-level pin for the ENTIRE DESIGN (not necessarily the DFT top module) or an instance pin in the format instance/pin. You may include up to one set of braces {} which will be replaced with the chain number, or with the channel number if 'DFT_SCAN_COMPRESSION' is set. Without scan compression, only one chain is supported, so there's no good reason to do that.",
     ),
     Variable(
         "DFT_BSCAN_EXCLUDE_IO",
@@ -98,11 +157,101 @@ dft_pin_vars = [
 ]
 
 
-class DFTCommon(PyosysStep):
+dft_profile_vars = [
+    Variable(
+        "DFT_PROFILE",
+        bool,
+        "Runs the step's script under cProfile, saving the profile and a summary of the hottest functions into the 'profile' directory of the step. For Cocotb-based steps, the simulation is also sampled with py-spy if it is installed. Can also be enabled for all steps by setting the environment variable DIFETTO_PROFILE to 1.",
+        default=False,
+    ),
+]
+
+
+def profiling_requested(config) -> bool:
+    return config["DFT_PROFILE"] or os.getenv("DIFETTO_PROFILE", "0") not in ["", "0"]
+
+
+def add_profile_env(step: Step, env: dict):
+    """
+    Asks the scripts of the step (see ``scripts/common/instrumentation.py``)
+    to run under cProfile if profiling was requested.
+    """
+    if profiling_requested(step.config):
+        env["_DIFETTO_PROFILE_DIR"] = os.path.join(step.step_dir, "profile")
+
+
+dft_worker_vars = [
+    Variable(
+        "DFT_PYOSYS_WORKER",
+        Optional[Path],
+        "The Unix socket of a pyosys worker started with 'python3 -m librelane_plugin_difetto.worker'. If the worker is reachable, the step's script is run by it instead of a new Yosys process, which skips loading Yosys and the Difetto plugin; otherwise, the step falls back to starting Yosys. The worker must run the same Yosys and plugin as the flow. Can also be set for all steps with the environment variable DIFETTO_PYOSYS_WORKER.",
+    ),
+]
+
+
+class PyosysWorkerStep(PyosysStep):
+    """
+    A :class:`PyosysStep` whose script is dispatched to a pyosys worker if one
+    is configured and reachable.
+    """
+
+    def get_worker_socket(self) -> Optional[str]:
+        socket_path = self.config["DFT_PYOSYS_WORKER"] or os.getenv(
+            "DIFETTO_PYOSYS_WORKER"
+        )
+        if not socket_path:
+            return None
+        if not worker_available(str(socket_path)):
+            warn(
+                f"No pyosys worker is listening on '{socket_path}': starting Yosys instead."
+            )
+            return None
+        return str(socket_path)
+
+    def run(self, state_in, **kwargs):
+        cmd = self.get_command(state_in)
+        if socket_path := self.get_worker_socket():
+            cmd = worker_command(socket_path, cmd, sys.executable)
+        kwargs, env = self.extract_env(kwargs)
+        subprocess_result = self.run_subprocess(cmd, env=env, **kwargs)
+        return {}, subprocess_result["generated_metrics"]
+
+
+def get_synth_libs(step: Step) -> str:
+    """
+    :returns: The liberty files of the synthesis corner, without excluded
+        cells, as a Tcl list for the ``_libs_synth`` environment variable.
+    """
+    scl_lib_list = step.toolbox.filter_views(
+        step.config, step.config["LIB"], step.config.get("SYNTH_CORNER")
+    )
+    excluded_cells: Set[str] = set(step.config["EXTRA_EXCLUDED_CELLS"] or [])
+    excluded_cells.update(process_list_file(step.config["SYNTH_EXCLUDED_CELL_FILE"]))
+    excluded_cells.update(process_list_file(step.config["PNR_EXCLUDED_CELL_FILE"]))
+    libs_synth = step.toolbox.remove_cells_from_lib(
+        frozenset([str(lib) for lib in scl_lib_list]),
+        excluded_cells=frozenset(excluded_cells),
+    )
+    return TclStep.value_to_tcl(libs_synth)
+
+
+class DFTCommon(PyosysWorkerStep):
     inputs = [DesignFormat.nl]
     outputs = [DesignFormat.nl]
 
-    config_vars = PyosysStep.config_vars + dft_common_vars
+    config_vars = (
+        PyosysStep.config_vars
+        + dft_common_vars
+        + dft_profile_vars
+        + dft_worker_vars
+        + [
+            Variable(
+                "DFT_INCREMENTAL_CACHE_DIR",
+                Optional[Path],
+                "An optional directory in which modules transformed by the DFT passes are cached, keyed by a hash of their structure and the pass's arguments. On subsequent runs, modules that have not changed are restored from the cache instead of being transformed again. The directory may be shared between runs of the same design.",
+            ),
+        ]
+    )
 
     def get_command(self, state_in) -> List[str]:
         out_type = self.outputs[0]
@@ -116,19 +265,8 @@ class DFTCommon(PyosysStep):
     def run(self, state_in, **kwargs):
         kwargs, env = self.extract_env(kwargs)
         env["PYTHONPATH"] = os.path.join(get_script_dir(), "pyosys")
-        scl_lib_list = self.toolbox.filter_views(
-            self.config, self.config["LIB"], self.config.get("SYNTH_CORNER")
-        )
-        excluded_cells: Set[str] = set(self.config["EXTRA_EXCLUDED_CELLS"] or [])
-        excluded_cells.update(
-            process_list_file(self.config["SYNTH_EXCLUDED_CELL_FILE"])
-        )
-        excluded_cells.update(process_list_file(self.config["PNR_EXCLUDED_CELL_FILE"]))
-        libs_synth = self.toolbox.remove_cells_from_lib(
-            frozenset([str(lib) for lib in scl_lib_list]),
-            excluded_cells=frozenset(excluded_cells),
-        )
-        env["_libs_synth"] = TclStep.value_to_tcl(libs_synth)
+        env["_libs_synth"] = get_synth_libs(self)
+        add_profile_env(self, env)
         state_out, metrics = super().run(state_in, env=env, **kwargs)
         out_type = self.outputs[0]
         state_out[out_type] = Path(
@@ -173,6 +311,211 @@ class ScanReplace(DFTCommon):
         return os.path.join(__file_dir__, "scripts", "pyosys", "scan_replace.py")
 
 
+@Step.factory.register()
+class DRC(PyosysWorkerStep):
+    """
+    Uses Yosys with the Difetto plugin to run design-for-testability rule
+    checks on the netlist with scannable flip-flops, so problems that would
+    otherwise only show up once the chain is stitched, validated or used
+    (after placement and routing) are found right after
+    ``Difetto.ScanReplace``:
+
+    - ``unscanned_flop``: flip-flops that were not replaced by scannable ones,
+      e.g. for lack of an entry in ``DFT_JSON_MAPPING``
+    - ``no_scan_flop`` (warning): flip-flops excluded by ``no_scan``
+    - ``uncontrollable_clock``: scannable flip-flops not clocked by
+      ``DFT_TEST_CLOCK_WIRE`` through combinational logic and clock gates
+    - ``uncontrollable_async``: asynchronous sets or resets of scannable
+      flip-flops that depend on the state of a flip-flop
+    - ``missing_pin``: a test clock, test mode select or entry of
+      ``DFT_BSCAN_EXCLUDE_IO`` that does not exist
+
+    The violations are written to ``dft_drc.json`` in the step directory and
+    counted per rule in metrics, which also list the first offending
+    instances.
+    """
+
+    id = "Difetto.DRC"
+    name = "DFT Rule Checks"
+
+    inputs = [DesignFormat.nl]
+    outputs = []
+
+    config_vars = (
+        PyosysStep.config_vars
+        + dft_common_vars
+        + dft_pin_vars
+        + dft_profile_vars
+        + dft_worker_vars
+        + [
+            Variable(
+                "DFT_DRC_WAIVED_RULES",
+                Optional[List[str]],
+                "DFT rules whose violations are reported, but never fail the step.",
+            ),
+            Variable(
+                "ERROR_ON_DFT_DRC",
+                bool,
+                "Fail the step (before placement starts) if any DFT rule of severity 'error' is violated and not waived.",
+                default=True,
+            ),
+        ]
+    )
+
+    rules: ClassVar[List[str]] = [
+        "unscanned_flop",
+        "no_scan_flop",
+        "uncontrollable_clock",
+        "uncontrollable_async",
+        "missing_pin",
+    ]
+
+    # instances listed per rule in the metrics
+    metric_instances_max: ClassVar[int] = 10
+
+    def get_script_path(self):
+        return os.path.join(__file_dir__, "scripts", "pyosys", "dft_drc.py")
+
+    def get_report_path(self) -> str:
+        return os.path.join(self.step_dir, "dft_drc.json")
+
+    def get_command(self, state_in) -> List[str]:
+        return super().get_command(state_in) + [
+            "--report",
+            self.get_report_path(),
+            str(state_in[DesignFormat.nl]),
+        ]
+
+    def run(self, state_in, **kwargs):
+        kwargs, env = self.extract_env(kwargs)
+        env["PYTHONPATH"] = os.path.join(get_script_dir(), "pyosys")
+        env["_libs_synth"] = get_synth_libs(self)
+        add_profile_env(self, env)
+        state_out, metrics = super().run(state_in, env=env, **kwargs)
+
+        with open(self.get_report_path(), encoding="utf8") as f:
+            report = json.load(f)
+
+        waived = set(self.config["DFT_DRC_WAIVED_RULES"] or [])
+        for rule in waived - set(self.rules):
+            warn(f"Unknown DFT rule '{rule}' in 'DFT_DRC_WAIVED_RULES'.")
+
+        by_rule: Dict[str, List[dict]] = {rule: [] for rule in self.rules}
+        for violation in report["violations"]:
+            by_rule.setdefault(violation["rule"], []).append(violation)
+
+        errors = []
+        for rule, violations in by_rule.items():
+            metrics[f"difetto__drc__{rule}__count"] = len(violations)
+            if len(violations) == 0:
+                continue
+            metrics[f"difetto__drc__{rule}__instances"] = ", ".join(
+                violation["instance"]
+                for violation in violations[: self.metric_instances_max]
+            )
+            if rule not in waived and violations[0]["severity"] == "error":
+                errors.append(f"{rule} ({len(violations)})")
+        metrics["difetto__drc__flop_count"] = report["flop_count"]
+        metrics["difetto__drc__violation_count"] = len(report["violations"])
+
+        if len(errors):
+            error_msg = f"DFT rule violations found: {', '.join(errors)}. See '{os.path.relpath(self.get_report_path())}'."
+            if self.config["ERROR_ON_DFT_DRC"]:
+                raise StepError(error_msg)
+            warn(error_msg)
+        elif len(report["violations"]):
+            info(
+                f"{len(report['violations'])} DFT rule warning(s) or waived violation(s) found."
+            )
+        else:
+            info(
+                f"No DFT rule violations found in {report['flop_count']} flip-flop(s)."
+            )
+
+        return state_out, metrics
+
+
+DesignFormat(
+    "scan_compression",
+    "scan_compression.json",
+    "Scan Compression Structure",
+).register()
+
+
+@Step.factory.register()
+class ScanCompress(DFTCommon):
+    """
+    Uses Yosys with the Difetto plugin to insert a scan decompressor between
+    ``DFT_SCAN_CHANNELS`` scan-in channels and ``DFT_COMPRESSION_CHAINS``
+    internal scan chains, and an XOR compactor between the internal chains
+    and as many scan-out channels.
+
+    The internal chains are stitched later on by ``Difetto.Chain``. The
+    structure of the decompressor and compactor is written to a JSON file,
+    which ``Difetto.AssemblePatterns`` uses to encode the test patterns.
+
+    Only runs in the Difetto flows if ``DFT_SCAN_COMPRESSION`` is set.
+    """
+
+    id = "Difetto.ScanCompress"
+    name = "Insert Scan Decompressor and Compactor"
+
+    outputs = [DesignFormat.nl, DesignFormat.scan_compression]
+
+    config_vars = (
+        DFTCommon.config_vars
+        + dft_pin_vars
+        + [
+            Variable(
+                "DFT_SCAN_CHANNELS",
+                int,
+                "The number of scan-in (and scan-out) channels of the decompressor (and compactor.) The names of their ports are formatted from 'DFT_SCAN_IN_PATTERN' and 'DFT_SCAN_OUT_PATTERN' with the channel number, and the ports must exist on the design's top module.",
+                default=1,
+            ),
+            Variable(
+                "DFT_COMPRESSION_CHAINS",
+                int,
+                "The number of internal scan chains behind the decompressor and compactor.",
+                default=16,
+            ),
+            Variable(
+                "DFT_COMPRESSION_STAGES",
+                Optional[int],
+                "The number of stages of the decompressor's shift register. Defaults to the greater of 8 and 'DFT_SCAN_CHANNELS'.",
+            ),
+        ]
+    )
+
+    def get_script_path(self):
+        return os.path.join(__file_dir__, "scripts", "pyosys", "scan_compress.py")
+
+    def get_command(self, state_in) -> List[str]:
+        cmd = super().get_command(state_in)
+        cmd[-1:-1] = [
+            "--structure-out",
+            os.path.join(
+                self.step_dir,
+                f"{self.config['DESIGN_NAME']}.{DesignFormat.scan_compression.extension}",
+            ),
+        ]
+        return cmd
+
+    def run(self, state_in, **kwargs):
+        dft_top = self.config["DFT_TOP_MODULE"]
+        if dft_top is not None and dft_top != self.config["DESIGN_NAME"]:
+            raise StepException(
+                "Scan compression is only supported if the DFT top module is the design's top module."
+            )
+        state_out, metrics = super().run(state_in, **kwargs)
+        state_out[DesignFormat.scan_compression] = Path(
+            os.path.join(
+                self.step_dir,
+                f"{self.config['DESIGN_NAME']}.{DesignFormat.scan_compression.extension}",
+            )
+        )
+        return state_out, metrics
+
+
 DesignFormat(
     "cut_nl",
     "cut_nl.v",
@@ -180,6 +523,13 @@ DesignFormat(
 ).register()
 
 
+DesignFormat(
+    "cut_map",
+    "cut_map.json",
+    "Cutaway Netlist Instance Map",
+).register()
+
+
 @Step.factory.register()
 class Cut(DFTCommon):
     """
@@ -188,25 +538,66 @@ class Cut(DFTCommon):
     tools.
 
     Excluded IOs are coerced to high (or low if prefixed with !.)
+
+    If ``DFT_HIERARCHICAL_CUT`` is set, the design is not flattened: each
+    unique module is cut once, and alongside the hierarchical cut netlist, a
+    netlist per cut module and a JSON instance map are emitted.
     """
 
     id = "Difetto.Cut"
     name = "Create Cutaway Netlist"
 
     inputs = [DesignFormat.nl]
-    outputs = [DesignFormat.cut_nl]
-
-    config_vars = DFTCommon.config_vars + dft_pin_vars
+    # only produced with DFT_HIERARCHICAL_CUT
+    outputs = [DesignFormat.cut_nl, DesignFormat.cut_map.mkOptional()]
+
+    config_vars = (
+        DFTCommon.config_vars
+        + dft_pin_vars
+        + [
+            Variable(
+                "DFT_HIERARCHICAL_CUT",
+                bool,
+                "Cut each unique module once and keep the cut netlist hierarchical instead of flattening the entire design. Flip-flop pseudo-ports are punched up through the hierarchy so the top-level ports match those of a flat cut.",
+                default=False,
+            ),
+        ]
+    )
 
     def get_script_path(self):
         return os.path.join(__file_dir__, "scripts", "pyosys", "cut.py")
 
+    def get_command(self, state_in) -> List[str]:
+        cmd = super().get_command(state_in)
+        if self.config["DFT_HIERARCHICAL_CUT"]:
+            cmd[-1:-1] = [
+                "--instance-map",
+                os.path.join(
+                    self.step_dir,
+                    f"{self.config['DESIGN_NAME']}.{DesignFormat.cut_map.extension}",
+                ),
+                "--module-dir",
+                os.path.join(self.step_dir, "modules"),
+            ]
+        return cmd
+
+    def run(self, state_in, **kwargs):
+        state_out, metrics = super().run(state_in, **kwargs)
+        if self.config["DFT_HIERARCHICAL_CUT"]:
+            state_out[DesignFormat.cut_map] = Path(
+                os.path.join(
+                    self.step_dir,
+                    f"{self.config['DESIGN_NAME']}.{DesignFormat.cut_map.extension}",
+                )
+            )
+        return state_out, metrics
+
 
 DesignFormat("bench", "bench", "DFT Bench Format").register()
 
 
 @Step.factory.register()
-class WriteBench(Step):
+class WriteBench(CachedStep, Step):
     """
     Converts cutaway combinational netlists into the BENCH format popular with
     academic ATPG utilities using a tool named nl2bench.
@@ -218,6 +609,14 @@ class WriteBench(Step):
     inputs = [DesignFormat.cut_nl]
     outputs = [DesignFormat.bench]
 
+    config_vars = dft_cache_vars
+
+    cache_tools = ["nl2bench"]
+
+    def get_cache_files(self, state_in) -> Iterable[str]:
+        return self.toolbox.filter_views(self.config, self.config["LIB"])
+
+    @cached_run
     def run(self, state_in, **kwargs):
         lib_list = self.toolbox.filter_views(self.config, self.config["LIB"])
         out_path = os.path.join(
@@ -244,10 +643,50 @@ DesignFormat(
 ).register()
 
 
-class QuaighATPG(Step):
+class QuaighOutputProcessor(OutputProcessor[Dict[str, Any]]):
+    """
+    Collects the statistics Quaigh prints at the end of a run, e.g. the
+    coverage in ``quaigh atpg``'s ``<percentage>% coverage`` and the fault
+    counts in its ``<detected>/<total> faults``.
+    """
+
+    key = "quaigh_metrics"
+
+    coverage_rx = re.compile(r"([\d.]+)% coverage")
+    fault_count_rx = re.compile(r"(\d+)\s*/\s*(\d+) faults")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics: Dict[str, Any] = {}
+
+    def process_line(self, line: str) -> bool:
+        if match := self.coverage_rx.search(line):
+            self.metrics["coverage"] = Decimal(match[1])
+        if match := self.fault_count_rx.search(line):
+            self.metrics["detected_fault_count"] = int(match[1])
+            self.metrics["fault_count"] = int(match[2])
+        return False
+
+    def result(self) -> Dict[str, Any]:
+        return self.metrics
+
+
+class QuaighATPG(CachedStep, Step):
     """
     Performs analytic automatic test pattern generation using Quaigh to produce
     test vectors in the port order of inputs in cutaway netlists.
+
+    If ``DFT_ATPG_PARTITIONS`` is greater than one, the outputs of the netlist
+    are split into groups with mostly independent fan-in cones, and Quaigh is
+    run on each group's sub-netlist concurrently. The resulting patterns are
+    then merged (and compacted) into one set in the port order of the full
+    netlist, which is fault-simulated to report the merged coverage.
+
+    If ``DFT_ATPG_PREVIOUS_PATTERNS`` is set, ATPG is incremental: the patterns
+    of a previous run are remapped to the current netlist's ports and
+    fault-simulated first, and Quaigh is only run on the cones of the outputs
+    at which the faults they leave undetected may be observed. After small
+    changes to a design, this is usually a small fraction of the netlist.
     """
 
     id = "Difetto.QuaighATPG"
@@ -256,20 +695,364 @@ class QuaighATPG(Step):
     inputs = [DesignFormat.bench]
     outputs = [DesignFormat.raw_tvs]
 
+    config_vars = dft_cache_vars + [
+        Variable(
+            "DFT_ATPG_PARTITIONS",
+            int,
+            "The number of partitions to split the cutaway netlist into for ATPG. Partitions are generated concurrently and their patterns are merged. Set to 1 to run ATPG on the entire netlist at once.",
+            default=1,
+        ),
+        Variable(
+            "DFT_ATPG_THREADS",
+            Optional[int],
+            "The maximum number of ATPG processes to run at once when the netlist is partitioned. Defaults to the number of available cores.",
+        ),
+        Variable(
+            "DFT_ATPG_PORTFOLIO",
+            Optional[List[str]],
+            "A list of alternative sets of arguments for 'quaigh atpg' (e.g. '--seed 1', '--seed 2', …). If set, ATPG is run once per entry concurrently, and the run with the fewest patterns that reaches 'DFT_ATPG_TARGET_COVERAGE' is kept.",
+        ),
+        Variable(
+            "DFT_ATPG_TARGET_COVERAGE",
+            Optional[Decimal],
+            "The stuck-at fault coverage an ATPG run in 'DFT_ATPG_PORTFOLIO' must reach to be considered. If unset, only runs reaching the highest coverage of the portfolio are considered.",
+            units="%",
+        ),
+        Variable(
+            "DFT_ATPG_RANDOM_PATTERNS",
+            int,
+            "The maximum number of pseudo-random patterns to fault-simulate before deterministic ATPG. Only patterns that detect new faults are kept, and ATPG is only run for the faults they leave undetected. Set to 0 to disable.",
+            default=0,
+        ),
+        Variable(
+            "DFT_ATPG_RANDOM_BATCH_SIZE",
+            int,
+            "The number of pseudo-random patterns fault-simulated at once. Random pattern generation stops early once a batch detects no new faults.",
+            default=256,
+        ),
+        Variable(
+            "DFT_ATPG_RANDOM_SEED",
+            int,
+            "The seed for pseudo-random pattern generation.",
+            default=0,
+        ),
+        Variable(
+            "DFT_ATPG_PREVIOUS_PATTERNS",
+            Optional[Path],
+            "Test vectors from a previous ATPG run of this design (i.e. a 'raw_tvs' file) to seed ATPG with. Patterns that still detect faults in the current netlist are kept, and new patterns are only generated for the faults they miss.",
+        ),
+        Variable(
+            "DFT_ATPG_PREVIOUS_BENCH",
+            Optional[Path],
+            "The BENCH netlist that 'DFT_ATPG_PREVIOUS_PATTERNS' were generated for, used to remap the patterns to the ports of the current netlist by name. If unset, the ports are assumed to be unchanged.",
+        ),
+    ]
+
+    cache_tools = ["quaigh"]
+
+    output_processors = [QuaighOutputProcessor, DefaultOutputProcessor]
+
+    def get_cache_files(self, state_in) -> Iterable[str]:
+        return [os.path.join(__file_dir__, "bench.py")]
+
+    def run_partition(
+        self, bench_path: str, run_dir: str, arguments: List[str]
+    ) -> List[str]:
+        out_path = os.path.join(run_dir, DesignFormat.raw_tvs.extension)
+        self.run_subprocess(
+            ["quaigh", "atpg"] + arguments + ["--output", out_path, bench_path],
+            log_to=os.path.join(run_dir, "quaigh.log"),
+            silent=True,
+        )
+        return read_patterns(out_path)
+
+    def pick_candidate(self, partition: Bench, candidates: List[List[str]]) -> int:
+        """
+        :returns: The index of the candidate pattern set with the fewest
+            patterns among those reaching ``DFT_ATPG_TARGET_COVERAGE`` (or the
+            highest coverage of all candidates if it is unset.)
+        """
+        scores: List[Tuple[float, int]] = []
+        for patterns in candidates:
+            detections = FaultSimulator(partition, patterns).simulate()
+            detected = sum(1 for mask in detections.values() if mask != 0)
+            scores.append((100 * detected / max(1, len(detections)), len(patterns)))
+        best_coverage = max(coverage for coverage, _ in scores)
+        target = self.config["DFT_ATPG_TARGET_COVERAGE"]
+        if target is None:
+            target = best_coverage
+        elif best_coverage < target:
+            warn(
+                f"No ATPG run reached the target coverage of {target}% (best: {best_coverage:.2f}%)."
+            )
+            target = best_coverage
+        return min(
+            (j for j, (coverage, _) in enumerate(scores) if coverage >= target),
+            key=lambda j: scores[j][1],
+        )
+
+    def generate(
+        self, bench: Bench
+    ) -> Tuple[List[Tuple[List[str], List[str]]], Dict[str, Any]]:
+        """
+        Runs Quaigh on each partition of a netlist concurrently. If
+        ``DFT_ATPG_PORTFOLIO`` is set, every partition is run once per entry,
+        and the smallest pattern set that reaches the target coverage is kept.
+
+        :returns: The inputs and generated patterns of each partition, and
+            metrics.
+        """
+        groups = bench.partition(self.config["DFT_ATPG_PARTITIONS"])
+        portfolio = [
+            shlex.split(arguments)
+            for arguments in (self.config["DFT_ATPG_PORTFOLIO"] or [""])
+        ]
+        thread_count = self.config["DFT_ATPG_THREADS"] or os.cpu_count() or 1
+        info(
+            f"Running ATPG on {len(groups)} partitions ({len(portfolio)} runs each) with {thread_count} threads…"
+        )
+
+        tpe = ThreadPoolExecutor(max_workers=thread_count)
+        futures: List[Tuple[Bench, List[Future[List[str]]]]] = []
+        for i, outputs in enumerate(groups):
+            partition = bench.subset(outputs)
+            partition_dir = os.path.join(self.step_dir, f"partition_{i}")
+            mkdirp(partition_dir)
+            partition_path = os.path.join(
+                partition_dir, f"partition_{i}.{DesignFormat.bench.extension}"
+            )
+            with open(partition_path, "w", encoding="utf8") as f:
+                partition.dump(f, header=f"partition {i} of {len(groups)}")
+            runs = []
+            for j, arguments in enumerate(portfolio):
+                run_dir = partition_dir
+                if len(portfolio) > 1:
+                    run_dir = os.path.join(partition_dir, f"run_{j}")
+                    mkdirp(run_dir)
+                runs.append(
+                    tpe.submit(self.run_partition, partition_path, run_dir, arguments)
+                )
+            futures.append((partition, runs))
+
+        pattern_sets: List[Tuple[List[str], List[str]]] = []
+        run_totals = [0] * len(portfolio)
+        for i, (partition, runs) in enumerate(futures):
+            candidates = [run.result() for run in runs]
+            for j, patterns in enumerate(candidates):
+                run_totals[j] += len(patterns)
+            chosen = 0
+            if len(candidates) > 1:
+                chosen = self.pick_candidate(partition, candidates)
+                info(
+                    f"Partition {i}: kept run {chosen} with {len(candidates[chosen])} patterns (of {', '.join(str(len(c)) for c in candidates)})."
+                )
+            pattern_sets.append((partition.inputs, candidates[chosen]))
+        tpe.shutdown()
+
+        metrics: Dict[str, Any] = {}
+        if len(portfolio) > 1:
+            for j, total in enumerate(run_totals):
+                metrics[f"difetto__atpg__portfolio__pattern_count__run:{j}"] = total
+            metrics["difetto__atpg__portfolio__pattern_count__min"] = min(run_totals)
+            metrics["difetto__atpg__portfolio__pattern_count__max"] = max(run_totals)
+        return pattern_sets, metrics
+
+    def seed(self, bench: Bench, faults: List[Fault]) -> Tuple[List[str], List[Fault]]:
+        """
+        Fault-simulates the patterns of a previous run against the netlist.
+
+        :returns: The patterns worth keeping and the faults they leave
+            undetected.
+        """
+        previous_patterns = read_patterns(self.config["DFT_ATPG_PREVIOUS_PATTERNS"])
+        old_inputs = bench.inputs
+        if previous_bench := self.config["DFT_ATPG_PREVIOUS_BENCH"]:
+            old_inputs = Bench.load(previous_bench).inputs
+        try:
+            seeded = remap_patterns(previous_patterns, old_inputs, bench.inputs)
+        except ValueError as e:
+            raise StepException(
+                f"Previous patterns do not match the previous netlist: {e}"
+            )
+
+        detections = FaultSimulator(bench, seeded).simulate(faults)
+        kept = [seeded[i] for i in select_patterns(detections)]
+        undetected = [fault for fault, mask in detections.items() if mask == 0]
+        info(
+            f"{len(kept)}/{len(seeded)} previous patterns still detect {len(faults) - len(undetected)}/{len(faults)} faults."
+        )
+        return kept, undetected
+
+    def random_fill(
+        self, bench: Bench, faults: List[Fault]
+    ) -> Tuple[List[str], List[Fault]]:
+        """
+        Fault-simulates batches of pseudo-random patterns, dropping detected
+        faults as it goes, until ``DFT_ATPG_RANDOM_PATTERNS`` have been tried
+        or a batch detects no new faults.
+
+        :returns: The patterns that detected new faults and the faults left
+            undetected.
+        """
+        rng = random.Random(self.config["DFT_ATPG_RANDOM_SEED"])
+        budget = self.config["DFT_ATPG_RANDOM_PATTERNS"]
+        batch_size = self.config["DFT_ATPG_RANDOM_BATCH_SIZE"]
+        kept: List[str] = []
+        undetected = faults
+        tried = 0
+        while tried < budget and len(undetected):
+            batch = random_patterns(
+                rng, min(batch_size, budget - tried), len(bench.inputs)
+            )
+            tried += len(batch)
+            detections = FaultSimulator(bench, batch).simulate(undetected)
+            useful = select_patterns(detections)
+            if len(useful) == 0:
+                break
+            kept += [batch[i] for i in useful]
+            undetected = [fault for fault, mask in detections.items() if mask == 0]
+        info(
+            f"{len(kept)}/{tried} random patterns detect {len(faults) - len(undetected)}/{len(faults)} remaining faults."
+        )
+        return kept, undetected
+
+    def generate_patterns(self, bench_path: str, out_path: str) -> Dict[str, Any]:
+        """
+        Runs the configured ATPG phases and writes the merged patterns to
+        ``out_path``.
+
+        :returns: Metrics of the individual phases and the fault counts of
+            the merged patterns.
+        """
+        if (
+            self.config["DFT_ATPG_PARTITIONS"] <= 1
+            and self.config["DFT_ATPG_PORTFOLIO"] is None
+            and self.config["DFT_ATPG_PREVIOUS_PATTERNS"] is None
+            and self.config["DFT_ATPG_RANDOM_PATTERNS"] == 0
+        ):
+            cmd = [
+                "quaigh",
+                "atpg",
+                "--output",
+                out_path,
+                bench_path,
+            ]
+            # Quaigh grades its own patterns: re-grading them here would cost
+            # far more than generating them on large netlists
+            quaigh_metrics = self.run_subprocess(cmd)["quaigh_metrics"]
+            metrics: Dict[str, Any] = {}
+            if (coverage := quaigh_metrics.get("coverage")) is not None:
+                metrics["difetto__atpg__coverage__tool:quaigh"] = coverage
+                metrics["difetto__atpg__coverage"] = coverage
+            if (fault_count := quaigh_metrics.get("fault_count")) is not None:
+                detected = quaigh_metrics["detected_fault_count"]
+                metrics["difetto__atpg__fault_count"] = fault_count
+                metrics["difetto__atpg__detected_fault_count"] = detected
+                metrics["difetto__atpg__undetected_fault_count"] = (
+                    fault_count - detected
+                )
+            return metrics
+
+        bench = Bench.load(bench_path)
+        metrics = {}
+        pattern_sets: List[Tuple[List[str], List[str]]] = []
+        undetected = bench.faults()
+        fault_count = len(undetected)
+
+        def record_phase(phase: str, patterns: List[str]):
+            coverage = 100 * (fault_count - len(undetected)) / max(1, fault_count)
+            metrics[f"difetto__atpg__pattern_count__phase:{phase}"] = len(patterns)
+            metrics[f"difetto__atpg__coverage__phase:{phase}"] = round(coverage, 4)
+
+        for phase, enabled, generate in [
+            (
+                "seed",
+                self.config["DFT_ATPG_PREVIOUS_PATTERNS"] is not None,
+                self.seed,
+            ),
+            (
+                "random",
+                self.config["DFT_ATPG_RANDOM_PATTERNS"] > 0,
+                self.random_fill,
+            ),
+        ]:
+            if not enabled:
+                continue
+            kept, undetected = generate(bench, undetected)
+            pattern_sets.append((bench.inputs, kept))
+            record_phase(phase, kept)
+
+        target = bench
+        if len(pattern_sets):
+            observers = bench.observers({net for net, _ in undetected})
+            info(
+                f"Faults left undetected are observable at {len(observers)}/{len(bench.outputs)} outputs."
+            )
+            target = bench.subset(observers)
+        if len(target.outputs):
+            generated, generation_metrics = self.generate(target)
+            pattern_sets += generated
+            metrics.update(generation_metrics)
+            metrics["difetto__atpg__partition_count"] = len(generated)
+            metrics["difetto__atpg__pattern_count__phase:deterministic"] = sum(
+                len(patterns) for _, patterns in generated
+            )
+
+        patterns = merge_patterns(bench.inputs, pattern_sets)
+        with open(out_path, "w", encoding="utf8") as f:
+            write_patterns(f, patterns, header=f"merged from {len(pattern_sets)} sets")
+        info(
+            f"Merged {sum(len(p) for _, p in pattern_sets)} patterns into {len(patterns)}."
+        )
+
+        # graded independently of the ATPG engine, as the sub-netlists Quaigh
+        # ran on each only hold some of the faults. Merging keeps the fully
+        # specified patterns of the seed and random phases as they are, so
+        # only the faults those phases left undetected need grading.
+        detections = FaultSimulator(bench, patterns).simulate(undetected)
+        detected = fault_count - sum(1 for mask in detections.values() if mask == 0)
+        metrics.update(
+            {
+                "difetto__atpg__fault_count": fault_count,
+                "difetto__atpg__detected_fault_count": detected,
+                "difetto__atpg__undetected_fault_count": fault_count - detected,
+                "difetto__atpg__coverage": round(
+                    100 * detected / max(1, fault_count), 4
+                ),
+            }
+        )
+        return metrics
+
+    @cached_run
     def run(self, state_in, **kwargs):
         out_path = os.path.join(
             self.step_dir,
             f"{self.config['DESIGN_NAME']}.{DesignFormat.raw_tvs.extension}",
         )
-        cmd = [
-            "quaigh",
-            "atpg",
-            "--output",
-            out_path,
-            str(state_in[DesignFormat.bench]),
-        ]
-        self.run_subprocess(cmd)
-        return {DesignFormat.raw_tvs: Path(out_path)}, {}
+        bench_path = str(state_in[DesignFormat.bench])
+
+        start = time.perf_counter()
+        metrics = self.generate_patterns(bench_path, out_path)
+        runtime = time.perf_counter() - start
+
+        pattern_count = len(read_patterns(out_path))
+        if {
+            "difetto__atpg__coverage",
+            "difetto__atpg__detected_fault_count",
+        } <= metrics.keys():
+            info(
+                f"{pattern_count} patterns detect {metrics['difetto__atpg__detected_fault_count']}/{metrics['difetto__atpg__fault_count']} faults ({metrics['difetto__atpg__coverage']:.2f}% coverage)."
+            )
+        metrics.update(
+            {
+                "difetto__atpg__pattern_count": pattern_count,
+                "difetto__atpg__runtime": round(runtime, 6),
+                "difetto__atpg__patterns_per_second": round(
+                    pattern_count / max(runtime, 1e-9), 4
+                ),
+            }
+        )
+        return {DesignFormat.raw_tvs: Path(out_path)}, metrics
 
 
 DesignFormat(
@@ -279,7 +1062,7 @@ DesignFormat(
 ).register()
 
 
-class QuaighSim(Step):
+class QuaighSim(CachedStep, Step):
     """
     Analytically simulates test patterns using Quaigh to generate expected
     "golden" outputs in the port order of inputs in cutaway netlists.
@@ -293,6 +1076,11 @@ class QuaighSim(Step):
     inputs = [DesignFormat.bench, DesignFormat.raw_tvs]
     outputs = [DesignFormat.raw_au]
 
+    config_vars = dft_cache_vars
+
+    cache_tools = ["quaigh"]
+
+    @cached_run
     def run(self, state_in, **kwargs):
         out_path = os.path.join(
             self.step_dir,
@@ -307,8 +1095,17 @@ class QuaighSim(Step):
             str(state_in[DesignFormat.raw_tvs]),
             str(state_in[DesignFormat.bench]),
         ]
+        start = time.perf_counter()
         self.run_subprocess(cmd)
-        return {DesignFormat.raw_au: Path(out_path)}, {}
+        runtime = time.perf_counter() - start
+        pattern_count = len(read_patterns(str(state_in[DesignFormat.raw_tvs])))
+        return {DesignFormat.raw_au: Path(out_path)}, {
+            "difetto__sim__pattern_count": pattern_count,
+            "difetto__sim__runtime": round(runtime, 6),
+            "difetto__sim__patterns_per_second": round(
+                pattern_count / max(runtime, 1e-9), 4
+            ),
+        }
 
 
 DesignFormat(
@@ -323,14 +1120,18 @@ class Chain(OpenROADStep):
     """
     Uses OpenROAD to create scan chain(s) between registers.
 
-    Currently only one scan chain is supported.
+    Without scan compression, a single scan chain is created between the scan
+    ports. If ``Difetto.ScanCompress`` inserted a decompressor and compactor,
+    one internal chain is created for each of their outputs and inputs
+    instead.
 
-    The chain's instance order is dumped into a YAML file.
+    The chains' instance order is dumped into a YAML file.
     """
 
     id = "Difetto.Chain"
     name = "Create Scan Chain(s)"
 
+    inputs = OpenROADStep.inputs + [DesignFormat.scan_compression.mkOptional()]
     outputs = OpenROADStep.outputs + [DesignFormat.chain_yml]
 
     config_vars = OpenROADStep.config_vars + dft_common_vars + dft_pin_vars
@@ -338,6 +1139,19 @@ class Chain(OpenROADStep):
     def get_script_path(self):
         return os.path.join(__file_dir__, "scripts", "openroad", "chain.tcl")
 
+    def prepare_env(self, env: dict, state: State) -> dict:
+        env = super().prepare_env(env, state)
+        env["_DFT_MAX_CHAINS"] = "1"
+        env["_DFT_CHAIN_SCAN_IN_PATTERN"] = self.config["DFT_SCAN_IN_PATTERN"]
+        env["_DFT_CHAIN_SCAN_OUT_PATTERN"] = self.config["DFT_SCAN_OUT_PATTERN"]
+        if structure_path := state.get(DesignFormat.scan_compression.id):
+            with open(structure_path, encoding="utf8") as f:
+                structure = json.load(f)
+            env["_DFT_MAX_CHAINS"] = str(len(structure["taps"]))
+            env["_DFT_CHAIN_SCAN_IN_PATTERN"] = structure["chain_scan_in_pattern"]
+            env["_DFT_CHAIN_SCAN_OUT_PATTERN"] = structure["chain_scan_out_pattern"]
+        return env
+
     def run(self, state_in, **kwargs):
         views, metrics = super().run(state_in, **kwargs)
         views[DesignFormat.chain_yml] = Path(
@@ -349,20 +1163,31 @@ class Chain(OpenROADStep):
         return views, metrics
 
 
-class CocotbStep(Step):
+class CocotbStep(CachedStep, Step):
     inputs = [DesignFormat.nl]
     outputs = []
 
     _cocotb_python_bin: ClassVar[Optional[str]] = None
 
-    config_vars = [
-        Variable(
-            "DFT_COCOTB_SIM",
-            Literal["icarus"],
-            "The simulator to use for Cocotb.",
-            default="icarus",
-        )
-    ]
+    config_vars = (
+        [
+            Variable(
+                "DFT_COCOTB_SIM",
+                Literal["icarus"],
+                "The simulator to use for Cocotb.",
+                default="icarus",
+            ),
+            Variable(
+                "DFT_SIM_PROGRESS_INTERVAL",
+                Decimal,
+                "The minimum time between progress reports (vectors done and remaining, cycles per second, simulated time per second and ETA) of simulations. Each report is logged and written to 'progress.json' in the step directory.",
+                default=Decimal(10),
+                units="s",
+            ),
+        ]
+        + dft_profile_vars
+        + dft_cache_vars
+    )
 
     @classmethod
     def get_cocotb_python_bin(Self):
@@ -400,41 +1225,132 @@ class CocotbStep(Step):
     def get_script_path(self):
         pass
 
+    def get_cache_tools(self) -> List[str]:
+        simulator_tools = {"icarus": ["iverilog", "vvp"]}
+        return [
+            self.get_cocotb_python_bin(),
+            "cocotb-config",
+        ] + simulator_tools[self.config["DFT_COCOTB_SIM"]]
+
+    def get_cache_files(self, state_in) -> Iterable[str]:
+        return (
+            get_script_files(self.get_script_path())
+            + [os.path.join(__file_dir__, "scripts", "cocotb", "scan_chain.py")]
+            + [str(model) for model in self.config["CELL_VERILOG_MODELS"]]
+        )
+
+    @cached_run
     def run(self, state_in, **kwargs):
         command = self.get_command(state_in)
         kwargs, env = self.extract_env(kwargs)
+        add_profile_env(self, env)
+        samples_path = None
+        if profiling_requested(self.config):
+            # py-spy samples the simulator's embedded interpreter as well
+            if py_spy := shutil.which("py-spy"):
+                samples_path = os.path.join(self.step_dir, "profile", "sampled.raw")
+                os.makedirs(os.path.dirname(samples_path), exist_ok=True)
+                command = [
+                    py_spy,
+                    "record",
+                    "--subprocesses",
+                    "--format",
+                    "raw",
+                    "--output",
+                    samples_path,
+                    "--",
+                ] + command
+            else:
+                warn("py-spy not found: only the cocotb runner will be profiled")
         subprocess_result = self.run_subprocess(
             command,
             **kwargs,
             env=env,
         )
+        if samples_path is not None and os.path.exists(samples_path):
+            self.summarize_samples(samples_path)
         generated_metrics = subprocess_result["generated_metrics"]
         return {}, generated_metrics
 
+    @staticmethod
+    def summarize_samples(samples_path: str, top_n: int = 40):
+        """
+        Writes the functions with the most samples of their own (i.e., not
+        counting their callees) next to a py-spy raw (collapsed stacks) file.
+        """
+        own_samples: Counter = Counter()
+        total = 0
+        with open(samples_path, encoding="utf8") as f:
+            for line in f:
+                stack, _, count_str = line.rstrip("\n").rpartition(" ")
+                if not stack or not count_str.isdigit():
+                    continue
+                count = int(count_str)
+                own_samples[stack.split(";")[-1]] += count
+                total += count
+        summary_path = os.path.splitext(samples_path)[0] + ".txt"
+        with open(summary_path, "w", encoding="utf8") as f:
+            print(f"{total} samples", file=f)
+            for frame, count in own_samples.most_common(top_n):
+                print(f"{count:>10} {count / total:>7.2%}  {frame}", file=f)
+
 
 @Step.factory.register()
 class ValidateChain(CocotbStep):
     """
     Uses Cocotb to validate a netlist with a scan-chain.
+
+    With scan compression, a random stream is shifted in through the
+    decompressor and the contents of the internal chains it loads are
+    checked as they are shifted out through the compactor.
     """
 
     name = "Validate Scan Chain (with Cocotb)"
     id = "Difetto.ValidateChain"
 
-    inputs = CocotbStep.inputs + [DesignFormat.chain_yml]
+    inputs = CocotbStep.inputs + [
+        DesignFormat.chain_yml,
+        DesignFormat.scan_compression.mkOptional(),
+    ]
 
     config_vars = CocotbStep.config_vars + dft_pin_vars
 
     def get_command(self, state_in):
-        return super().get_command(state_in) + [
+        cmd = super().get_command(state_in) + [
             "--chain-yml",
             str(state_in[DesignFormat.chain_yml]),
-            str(state_in[DesignFormat.nl]),
         ]
+        if structure := state_in.get(DesignFormat.scan_compression.id):
+            cmd.extend(["--scan-compression", str(structure)])
+        return cmd + [str(state_in[DesignFormat.nl])]
 
     def get_script_path(self):
         return os.path.join(__file_dir__, "scripts", "cocotb", "validate_chain.py")
 
+    def run(self, state_in, **kwargs):
+        if structure := state_in.get(DesignFormat.scan_compression.id):
+            # the encoder is not available in the cocotb environment, so the
+            # test stream is prepared here
+            encoder = PatternEncoder(
+                ScanCompression.load(str(structure)),
+                read_chain_lengths(str(state_in[DesignFormat.chain_yml])),
+            )
+            length = encoder.stream_length
+            stream = bitarray(
+                format(random.getrandbits(length), f"0{length}b"), endian="little"
+            )
+            expected, mask = encoder.unload(encoder.decompress(stream))
+            for name, pattern in [
+                ("tvs", stream),
+                ("au", expected),
+                ("mask", mask),
+            ]:
+                with open(
+                    os.path.join(self.step_dir, f"chain_test.{name}.bin"), "wb"
+                ) as f:
+                    write_streams(f, [pattern])
+        return super().run(state_in, **kwargs)
+
 
 DesignFormat(
     "tvs",
@@ -455,8 +1371,15 @@ DesignFormat(
 ).register()
 
 
+DesignFormat(
+    "scan_locations",
+    "scan_locations.json",
+    "Scan Chain Locations of Cut Netlist Ports",
+).register()
+
+
 @Step.factory.register()
-class AssemblePatterns(PyosysStep):
+class AssemblePatterns(CachedStep, PyosysWorkerStep):
     """
     Uses Yosys, the chain YAML file, the cutaway netlist, and raw test vectors
     to generate:
@@ -466,22 +1389,73 @@ class AssemblePatterns(PyosysStep):
 
     …all based on the order of the chain. The mask excludes uncontrollable bits
     such as input boundary scan registers.
+
+    If ``Difetto.ScanCompress`` inserted a decompressor and compactor, the
+    test vectors are instead the streams to drive on the scan-in channels,
+    solved for from the bits each pattern needs to detect its faults (as
+    found by fault simulation of the bench netlist,) and the golden outputs
+    and mask are those of the scan-out channels. The assembled, uncompressed
+    chain contents are kept alongside them.
+
+    The chain and position of every input and output of the cutaway netlist
+    are written to a JSON file, which maps test vectors and responses back to
+    the netlist (e.g. for ``Difetto.Diagnose``.)
+
+    The cost of applying the test on a tester (shift and capture cycles,
+    tester memory and test time at ``DFT_SHIFT_FREQUENCY``) is also reported,
+    both for the current chain and for ``DFT_WHAT_IF_CHAIN_COUNTS`` balanced
+    chains.
     """
 
     id = "Difetto.AssemblePatterns"
     name = "Test Pattern Assembly"
 
+    config_vars = (
+        PyosysStep.config_vars
+        + dft_profile_vars
+        + dft_worker_vars
+        + dft_cache_vars
+        + [
+            Variable(
+                "DFT_SHIFT_FREQUENCY",
+                Decimal,
+                "The scan shift frequency of the tester, used to estimate the time it takes to apply the test patterns.",
+                default=Decimal(10),
+                units="MHz",
+            ),
+            Variable(
+                "DFT_WHAT_IF_CHAIN_COUNTS",
+                Optional[List[int]],
+                "Numbers of balanced scan chains to also estimate the test application cost for, reported as metrics suffixed with '__chains:<count>' and in the 'test_cost.rpt' report.",
+                default=[2, 4, 8, 16],
+            ),
+        ]
+    )
+
     inputs = [
         DesignFormat.cut_nl,
         DesignFormat.chain_yml,
         DesignFormat.raw_au,
         DesignFormat.raw_tvs,
+        DesignFormat.bench.mkOptional(),
+        DesignFormat.scan_compression.mkOptional(),
     ]
-    outputs = [DesignFormat.au, DesignFormat.tvs, DesignFormat.mask]
+    outputs = [
+        DesignFormat.au,
+        DesignFormat.tvs,
+        DesignFormat.mask,
+        DesignFormat.scan_locations,
+    ]
+
+    # consumed by the step itself rather than the script
+    step_inputs = [DesignFormat.bench.id, DesignFormat.scan_compression.id]
 
     def get_script_path(self):
         return os.path.join(__file_dir__, "scripts", "pyosys", "assemble.py")
 
+    def compressing(self, state_in) -> bool:
+        return state_in.get(DesignFormat.scan_compression.id) is not None
+
     def get_command(self, state_in) -> List[str]:
         out_pfx = os.path.join(
             self.step_dir,
@@ -490,8 +1464,19 @@ class AssemblePatterns(PyosysStep):
 
         cmd = super().get_command(state_in)
         for input in self.inputs:
+            if input.id in self.step_inputs:
+                continue
             cmd.extend(["--" + input.id.replace("_", "-"), str(state_in[input])])
-        for output in self.outputs:
+        cmd.extend(
+            [
+                "--locations-out",
+                f"{out_pfx}.{DesignFormat.scan_locations.extension}",
+            ]
+        )
+        if self.compressing(state_in):
+            # the script assembles the uncompressed chain contents
+            out_pfx += ".uncompressed"
+        for output in [DesignFormat.au, DesignFormat.tvs, DesignFormat.mask]:
             cmd.extend(
                 [
                     "--" + output.id.replace("_", "-") + "-out",
@@ -503,19 +1488,108 @@ class AssemblePatterns(PyosysStep):
 
         return cmd
 
+    def get_cache_tools(self) -> List[str]:
+        return [self.get_yosys_path()]
+
+    def get_cache_files(self, state_in) -> Iterable[str]:
+        return get_script_files(self.get_script_path()) + [
+            os.path.join(__file_dir__, "bench.py"),
+            os.path.join(__file_dir__, "compression.py"),
+        ]
+
+    @cached_run
     def run(self, state_in, **kwargs):
+        if self.compressing(state_in) and state_in.get(DesignFormat.bench.id) is None:
+            raise StepException(
+                "The bench netlist is required to encode test patterns for scan compression."
+            )
         kwargs, env = self.extract_env(kwargs)
         env["PYTHONPATH"] = os.path.join(get_script_dir(), "pyosys")
+        add_profile_env(self, env)
         state_out, metrics = super().run(state_in, env=env, **kwargs)
         out_pfx = os.path.join(
             self.step_dir,
             f"{self.config['DESIGN_NAME']}",
         )
+        if self.compressing(state_in):
+            metrics.update(self.compress(state_in, out_pfx))
         state_out[DesignFormat.au] = Path(f"{out_pfx}.{DesignFormat.au.extension}")
         state_out[DesignFormat.tvs] = Path(f"{out_pfx}.{DesignFormat.tvs.extension}")
         state_out[DesignFormat.mask] = Path(f"{out_pfx}.{DesignFormat.mask.extension}")
+        state_out[DesignFormat.scan_locations] = Path(
+            f"{out_pfx}.{DesignFormat.scan_locations.extension}"
+        )
         return state_out, metrics
 
+    def compress(self, state_in, out_pfx: str) -> Dict[str, Any]:
+        """
+        Encodes the raw test vectors for the decompressor, and writes the
+        scan-in streams, expected scan-out streams and their mask as the
+        step's outputs.
+
+        :returns: The compression metrics.
+        """
+        compression = ScanCompression.load(str(state_in[DesignFormat.scan_compression]))
+        with open(
+            f"{out_pfx}.{DesignFormat.scan_locations.extension}", encoding="utf8"
+        ) as f:
+            locations = json.load(f)
+        encoder = PatternEncoder(compression, locations["chain_lengths"])
+        bench = Bench.load(str(state_in[DesignFormat.bench]))
+        patterns = read_patterns(str(state_in[DesignFormat.raw_tvs]))
+
+        info(f"Encoding {len(patterns)} pattern(s) for scan compression…")
+        compressed = compress_patterns(
+            encoder,
+            bench,
+            patterns,
+            [tuple(location) for location in locations["tvs"]],
+            [tuple(location) for location in locations["au"]],
+        )
+        with open(f"{out_pfx}.{DesignFormat.tvs.extension}", "wb") as f:
+            write_streams(f, compressed.stimuli)
+        with open(f"{out_pfx}.{DesignFormat.au.extension}", "wb") as f:
+            write_streams(f, compressed.responses)
+        with open(f"{out_pfx}.{DesignFormat.mask.extension}", "wb") as f:
+            write_streams(f, [compressed.mask])
+
+        # the unload of each pattern overlaps the load of the next
+        pattern_count = len(patterns)
+        shift_cycles = 0
+        if pattern_count != 0:
+            shift_cycles = pattern_count * encoder.load_cycles + encoder.unload_cycles
+        stimulus_bits = pattern_count * encoder.stream_length
+        response_bits = pattern_count * encoder.response_length
+        test_time = (shift_cycles + pattern_count) / (
+            float(self.config["DFT_SHIFT_FREQUENCY"]) * 1e6
+        )
+        uncompressed_bits = pattern_count * sum(locations["chain_lengths"])
+        ratio = uncompressed_bits / stimulus_bits if stimulus_bits else 1.0
+        coverage = 1.0
+        if compressed.fault_count != 0:
+            coverage = compressed.detected_fault_count / compressed.fault_count
+        if compressed.dropped_care_bits:
+            warn(
+                f"{compressed.dropped_care_bits}/{compressed.care_bits} care bit(s) of {compressed.unencodable_pattern_count} pattern(s) could not be encoded: consider more scan channels or decompressor stages."
+            )
+        info(
+            f"Compressed the test stimulus {ratio:.1f}× ({uncompressed_bits} → {stimulus_bits} bits) with a fault coverage of {coverage:.2%}."
+        )
+        return {
+            "difetto__compression__channels": compression.channels,
+            "difetto__compression__chains": compression.chains,
+            "difetto__compression__ratio": ratio,
+            "difetto__compression__care_bits": compressed.care_bits,
+            "difetto__compression__dropped_care_bits": compressed.dropped_care_bits,
+            "difetto__compression__unencodable_pattern_count": compressed.unencodable_pattern_count,
+            "difetto__compression__fault_coverage": coverage,
+            "difetto__compression__shift_cycles": shift_cycles,
+            "difetto__compression__stimulus_bits": stimulus_bits,
+            "difetto__compression__response_bits": response_bits,
+            "difetto__compression__mask_bits": response_bits,
+            "difetto__compression__test_time": test_time,
+        }
+
 
 @Step.factory.register()
 class SimulateTestVectors(CocotbStep):
@@ -526,25 +1600,341 @@ class SimulateTestVectors(CocotbStep):
     - Wait one cycle
     - Scan out
     - Compare the output with the expected output
+
+    With ``DFT_SIM_BACKDOOR``, all but the first few vectors are instead
+    loaded into and unloaded from the scan flip-flops directly.
+
+    With scan compression, the vectors are driven on the scan-in channels of
+    the decompressor and compared on the scan-out channels of the compactor.
     """
 
     id = "Difetto.SimulateTestVectors"
     name = "Simulate Test Vectors"
 
-    inputs = CocotbStep.inputs + [DesignFormat.au, DesignFormat.tvs, DesignFormat.mask]
+    inputs = CocotbStep.inputs + [
+        DesignFormat.au,
+        DesignFormat.tvs,
+        DesignFormat.mask,
+        DesignFormat.chain_yml,
+        DesignFormat.scan_compression.mkOptional(),
+    ]
 
-    config_vars = CocotbStep.config_vars + dft_pin_vars
+    config_vars = (
+        CocotbStep.config_vars
+        + dft_pin_vars
+        + [
+            Variable(
+                "DFT_SIM_MAX_FAILURES",
+                Optional[int],
+                "If set, the simulation is aborted once this many test vectors have failed. When resuming from 'DFT_SIM_RESUME_CHECKPOINT', only the vectors that fail after resuming count towards the limit, though the earlier failures are still reported.",
+            ),
+            Variable(
+                "DFT_SIM_ABORT_IF_FIRST_FAIL",
+                Optional[int],
+                "If set, the simulation is aborted if this many test vectors are simulated and all of them fail, which usually indicates a broken chain or mask rather than a defect.",
+            ),
+            Variable(
+                "DFT_SIM_START_VECTOR",
+                int,
+                "The index of the first test vector to simulate.",
+                default=0,
+            ),
+            Variable(
+                "DFT_SIM_END_VECTOR",
+                Optional[int],
+                "If set, the index of the test vector to stop before.",
+            ),
+            Variable(
+                "DFT_SIM_RESUME_CHECKPOINT",
+                Optional[Path],
+                "The 'checkpoint.json' file of an earlier (e.g. aborted or interrupted) run of this step. Simulation resumes after the last vector completed by that run, and vectors that failed in it are still reported as failed.",
+            ),
+            Variable(
+                "DFT_SIM_BACKDOOR",
+                bool,
+                "Instead of shifting each test vector in and out of the chain, deposit it directly onto the scan flip-flops (by their instance names in the chain YAML file), pulse a single capture clock and read the captured values back from the flip-flops. Only the capture cycle is simulated, so the cost of a vector no longer grows with the length of the chain.",
+                default=False,
+            ),
+            Variable(
+                "DFT_SIM_SERIAL_VECTORS",
+                int,
+                "In backdoor mode, the number of test vectors, starting with the first one simulated, that are still shifted through the chain serially as a sanity check of the chain itself.",
+                default=2,
+            ),
+            Variable(
+                "DFT_SIM_BACKDOOR_OUTPUT_PIN",
+                str,
+                "In backdoor mode, the output pin of the scan flip-flop cells that test vectors are deposited onto.",
+                default="Q",
+            ),
+            Variable(
+                "DFT_SIM_BACKDOOR_DATA_PIN",
+                str,
+                "In backdoor mode, the functional data pin of the scan flip-flop cells, from which the captured values are read.",
+                default="D",
+            ),
+        ]
+    )
 
     def get_command(self, state_in):
-        return super().get_command(state_in) + [
+        cmd = super().get_command(state_in) + [
             "--tvs",
             str(state_in[DesignFormat.tvs]),
             "--mask",
             str(state_in[DesignFormat.mask]),
             "--au",
             str(state_in[DesignFormat.au]),
-            str(state_in[DesignFormat.nl]),
+            "--chain-yml",
+            str(state_in[DesignFormat.chain_yml]),
         ]
+        if structure := state_in.get(DesignFormat.scan_compression.id):
+            cmd.extend(["--scan-compression", str(structure)])
+        return cmd + [str(state_in[DesignFormat.nl])]
 
     def get_script_path(self):
         return os.path.join(__file_dir__, "scripts", "cocotb", "run_tvs.py")
+
+    def run(self, state_in, **kwargs):
+        if (
+            self.config["DFT_SIM_BACKDOOR"]
+            and state_in.get(DesignFormat.scan_compression.id) is not None
+        ):
+            raise StepException(
+                "'DFT_SIM_BACKDOOR' is not supported with scan compression."
+            )
+        # the simulation updates this file after every vector, so an
+        # interrupted run can be resumed from it
+        checkpoint = {
+            "tvs": hash_file(str(state_in[DesignFormat.tvs])),
+            "next": self.config["DFT_SIM_START_VECTOR"],
+            "failed": [],
+        }
+        if resume_path := self.config["DFT_SIM_RESUME_CHECKPOINT"]:
+            with open(resume_path, encoding="utf8") as f:
+                previous = json.load(f)
+            if previous.get("tvs") != checkpoint["tvs"]:
+                raise StepException(
+                    f"Checkpoint '{resume_path}' was created for different test vectors."
+                )
+            checkpoint["next"] = max(checkpoint["next"], previous["next"])
+            checkpoint["failed"] = previous["failed"]
+            info(f"Resuming simulation from test vector {checkpoint['next']}…")
+        with open(
+            os.path.join(self.step_dir, "checkpoint.json"), "w", encoding="utf8"
+        ) as f:
+            json.dump(checkpoint, f)
+        return super().run(state_in, **kwargs)
+
+
+@Step.factory.register()
+class Diagnose(CachedStep, PyosysWorkerStep):
+    """
+    Diagnoses the test vectors that failed in a run of
+    ``Difetto.SimulateTestVectors``.
+
+    A fault dictionary of every single stuck-at fault of the bench netlist is
+    built by fault-simulating the assembled test vectors (as loaded into the
+    chains, if scan compression is used.) Candidate faults are then ranked by
+    how well the responses they predict match the failing bits in the diff
+    files of the simulation, and named by the cell instance driving the
+    faulty net, as found by reading the cutaway netlist with Yosys.
+
+    The ranking is written to ``diagnosis.rpt`` and ``diagnosis.json`` in the
+    step directory.
+
+    This step is not part of any flow, as the flows stop once a simulation
+    fails: run it on the state of that flow instead.
+    """
+
+    id = "Difetto.Diagnose"
+    name = "Diagnose Failing Test Vectors"
+
+    inputs = [
+        DesignFormat.cut_nl,
+        DesignFormat.bench,
+        DesignFormat.tvs,
+        DesignFormat.scan_locations,
+        DesignFormat.scan_compression.mkOptional(),
+    ]
+    outputs = []
+
+    config_vars = (
+        PyosysStep.config_vars
+        + dft_profile_vars
+        + dft_worker_vars
+        + dft_cache_vars
+        + [
+            Variable(
+                "DFT_DIAGNOSIS_SIM_DIR",
+                Path,
+                "The step directory of the run of 'Difetto.SimulateTestVectors' to diagnose. Every vector with a diff file in its 'diffs' directory is taken into account, whether it passed or failed.",
+            ),
+            Variable(
+                "DFT_DIAGNOSIS_MAX_CANDIDATES",
+                int,
+                "The maximum number of candidate fault classes to report.",
+                default=10,
+            ),
+        ]
+    )
+
+    def get_script_path(self):
+        return os.path.join(__file_dir__, "scripts", "pyosys", "net_drivers.py")
+
+    def get_drivers_path(self) -> str:
+        return os.path.join(self.step_dir, "net_drivers.json")
+
+    def get_command(self, state_in) -> List[str]:
+        return super().get_command(state_in) + [
+            "--output",
+            self.get_drivers_path(),
+            str(state_in[DesignFormat.cut_nl]),
+        ]
+
+    def get_diff_dir(self) -> str:
+        return os.path.join(self.config["DFT_DIAGNOSIS_SIM_DIR"], "diffs")
+
+    def get_cache_tools(self) -> List[str]:
+        return [self.get_yosys_path()]
+
+    def get_cache_files(self, state_in) -> Iterable[str]:
+        diff_dir = self.get_diff_dir()
+        diff_files = []
+        if os.path.isdir(diff_dir):
+            diff_files = [
+                os.path.join(diff_dir, file) for file in sorted(os.listdir(diff_dir))
+            ]
+        return (
+            get_script_files(self.get_script_path())
+            + [
+                os.path.join(__file_dir__, "bench.py"),
+                os.path.join(__file_dir__, "compression.py"),
+                os.path.join(__file_dir__, "diagnosis.py"),
+            ]
+            + self.toolbox.filter_views(self.config, self.config["LIB"])
+            + diff_files
+        )
+
+    @cached_run
+    def run(self, state_in, **kwargs):
+        diffs = read_diffs(self.get_diff_dir())
+        if len(diffs) == 0:
+            raise StepException(f"No diff files found in '{self.get_diff_dir()}'.")
+        kwargs, env = self.extract_env(kwargs)
+        env["PYTHONPATH"] = os.path.join(get_script_dir(), "pyosys")
+        env["_libs_synth"] = get_synth_libs(self)
+        add_profile_env(self, env)
+        state_out, metrics = super().run(state_in, env=env, **kwargs)
+
+        start = time.perf_counter()
+        with open(str(state_in[DesignFormat.scan_locations]), encoding="utf8") as f:
+            locations = json.load(f)
+        chain_lengths = locations["chain_lengths"]
+        encoder = None
+        if structure := state_in.get(DesignFormat.scan_compression.id):
+            encoder = PatternEncoder(
+                ScanCompression.load(str(structure)), chain_lengths
+            )
+        layout = ResponseLayout(
+            chain_lengths,
+            [tuple(location) for location in locations["au"]],
+            encoder,
+        )
+
+        # the patterns as loaded into the chains by each simulated vector
+        vectors = sorted(diffs)
+        with open(str(state_in[DesignFormat.tvs]), "rb") as f:
+            streams = list(read_streams(f))
+        if vectors[-1] >= len(streams):
+            raise StepException(
+                f"The simulation has a diff for vector {vectors[-1]}, but there are only {len(streams)} test vectors."
+            )
+        patterns = []
+        for vector in vectors:
+            if encoder is None:
+                tv = streams[vector]
+                contents = [
+                    tv[layout.offsets[chain] : layout.offsets[chain + 1]].tolist()
+                    for chain in range(len(chain_lengths))
+                ]
+            else:
+                contents = encoder.decompress(streams[vector])
+            patterns.append(
+                "".join(
+                    str(contents[chain][position])
+                    for chain, position in locations["tvs"]
+                )
+            )
+
+        info(f"Building a fault dictionary for {len(patterns)} simulated vector(s)…")
+        bench = Bench.load(str(state_in[DesignFormat.bench]))
+        dictionary = FaultDictionary(bench, patterns)
+        observed = [diffs[vector] for vector in vectors]
+        candidates = diagnose(dictionary, layout, observed)
+        runtime = time.perf_counter() - start
+
+        with open(self.get_drivers_path(), encoding="utf8") as f:
+            drivers = json.load(f)
+        failing = [vector for vector in vectors if len(diffs[vector])]
+        reported = candidates[: self.config["DFT_DIAGNOSIS_MAX_CANDIDATES"]]
+        with open(
+            os.path.join(self.step_dir, "diagnosis.json"), "w", encoding="utf8"
+        ) as f:
+            json.dump(
+                {
+                    "failing_vectors": failing,
+                    "candidates": [
+                        {
+                            "score": candidate.score,
+                            "explained": candidate.explained,
+                            "unobserved": candidate.unobserved,
+                            "unexplained": candidate.unexplained,
+                            "faults": [
+                                {
+                                    "net": net,
+                                    "stuck_at": stuck,
+                                    "site": describe(net, drivers),
+                                }
+                                for net, stuck in candidate.faults
+                            ],
+                        }
+                        for candidate in reported
+                    ],
+                },
+                f,
+            )
+        with open(
+            os.path.join(self.step_dir, "diagnosis.rpt"), "w", encoding="utf8"
+        ) as f:
+            print(
+                f"{len(failing)}/{len(vectors)} simulated vector(s) failed; {len(dictionary.classes)} fault class(es) in the dictionary, {len(candidates)} candidate(s).",
+                file=f,
+            )
+            for rank, candidate in enumerate(reported):
+                print(
+                    f"#{rank + 1}: score {candidate.score:.3f} (explained {candidate.explained}, unobserved {candidate.unobserved}, unexplained {candidate.unexplained})",
+                    file=f,
+                )
+                for net, stuck in candidate.faults:
+                    print(f"    {describe(net, drivers)} stuck-at-{stuck}", file=f)
+
+        if len(reported):
+            best = reported[0]
+            info(
+                f"Best candidate (score {best.score:.3f}): "
+                + ", ".join(
+                    f"{describe(net, drivers)} stuck-at-{stuck}"
+                    for net, stuck in best.faults
+                )
+            )
+        else:
+            warn("No stuck-at fault explains the failing bits.")
+        info(f"Diagnosed in {runtime:.2f}s.")
+
+        metrics["difetto__diagnosis__failing_vector_count"] = len(failing)
+        metrics["difetto__diagnosis__candidate_count"] = len(candidates)
+        metrics["difetto__diagnosis__top_score"] = (
+            reported[0].score if len(reported) else 0.0
+        )
+        metrics["difetto__runtime__diagnose__diagnosis"] = runtime
+        return state_out, metrics
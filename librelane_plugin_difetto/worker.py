@@ -0,0 +1,100 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright (c) 2025 Mohamed Gaber
+"""
+Starts a pyosys worker, which runs the scripts of the Difetto steps without
+starting a new Yosys process for each (see ``scripts/pyosys/worker.py``):
+
+    python3 -m librelane_plugin_difetto.worker --socket /tmp/difetto.sock
+
+Steps use the worker if ``DFT_PYOSYS_WORKER`` (or the environment variable
+``DIFETTO_PYOSYS_WORKER``) is set to its socket.
+"""
+
+import os
+import socket
+from typing import List
+
+import click
+from librelane.common import get_script_dir
+
+__file_dir__ = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_worker_script() -> str:
+    return os.path.join(__file_dir__, "scripts", "pyosys", "worker.py")
+
+
+def worker_available(socket_path: str) -> bool:
+    """
+    :returns: Whether a worker is listening on ``socket_path``.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+            # an empty job: the worker hangs up
+            connection.sendall(b"\n")
+        except OSError:
+            return False
+    return True
+
+
+def worker_command(socket_path: str, pyosys_cmd: List[str], python: str) -> List[str]:
+    """
+    Rewrites a ``yosys -y script.py [flags] -- args…`` command into one that
+    runs the script in the worker listening on ``socket_path``.
+
+    Yosys's log level flags are dropped: jobs log like the worker.
+    """
+    script = pyosys_cmd[pyosys_cmd.index("-y") + 1]
+    args = pyosys_cmd[pyosys_cmd.index("--") + 1 :]
+    return [
+        python,
+        get_worker_script(),
+        "run",
+        "--socket",
+        socket_path,
+        script,
+        "--",
+        *args,
+    ]
+
+
+@click.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    required=True,
+    help="The Unix socket to listen on.",
+)
+@click.option(
+    "--plugin",
+    default="difetto",
+    help="The Yosys plugin to load ahead of the jobs.",
+)
+def main(socket_path, plugin):
+    """
+    Runs a pyosys worker under the Yosys used by LibreLane until interrupted.
+    """
+    yosys = os.getenv("_LLN_OVERRIDE_YOSYS", "yosys")
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.path.join(get_script_dir(), "pyosys")
+    os.execvpe(
+        yosys,
+        [
+            yosys,
+            "-y",
+            get_worker_script(),
+            "--",
+            "serve",
+            "--socket",
+            os.path.abspath(socket_path),
+            "--plugin",
+            plugin,
+        ],
+        env,
+    )
+
+
+if __name__ == "__main__":
+    main()
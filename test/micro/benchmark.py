@@ -0,0 +1,495 @@
+"""
+Micro-benchmarks of the Python paths the Difetto steps run on every pattern:
+reading Quaigh's text patterns, writing and reading binary patterns,
+assembling patterns into chain order, loading chains and shifting vectors
+through a scan chain, none of which need Yosys.
+
+Synthetic patterns are generated for every combination of chain length and
+vector count, up to ``--max-total-bits``, into ``out/data``. Each benchmark
+then runs once per combination in a new Python process, recording its wall
+time and how much its peak RSS grew. The results are written to
+``out/micro.json`` and ``out/micro.csv``, and a summary of how time and
+memory scale with the number of bits (the exponent of a power-law fit: 1 is
+linear) is printed.
+
+    python3 benchmark.py [--bits 1k,10k,100k,1M] [--vectors 10,100,1k,10k,100k] [benchmark …]
+
+``run_scan`` runs against a stand-in for the simulator: a Python model of
+the scan chain, clocked by every ``await RisingEdge(tck)``. It still needs
+cocotb for ``BinaryValue``, and is skipped without it.
+"""
+
+import os
+import csv
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import resource
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+cwd = Path(__file__).resolve().parent
+scripts_dir = cwd.parent.parent / "librelane_plugin_difetto" / "scripts"
+
+sys.path.append(str(scripts_dir / "common"))
+sys.path.append(str(scripts_dir / "cocotb"))
+
+
+@dataclass
+class Case:
+    bits: int
+    vectors: int
+    data_dir: Path
+
+    @property
+    def text_path(self) -> Path:
+        return self.data_dir / f"{self.bits}x{self.vectors}.txt"
+
+    @property
+    def bin_path(self) -> Path:
+        return self.data_dir / f"{self.bits}x{self.vectors}.bin"
+
+    @property
+    def scratch_path(self) -> Path:
+        return self.data_dir / f"{self.bits}x{self.vectors}.{os.getpid()}.tmp"
+
+
+def random_bits(rng: random.Random, bits: int) -> str:
+    return format(rng.getrandbits(bits), f"0{bits}b")
+
+
+def generate_patterns(case: Case, seed: int):
+    """
+    Writes ``case.vectors`` random patterns of ``case.bits`` bits in Quaigh's
+    text format, and again in Difetto's binary format.
+    """
+    from patterns import read_patterns_text, write_pattern_bin
+
+    if case.text_path.exists() and case.bin_path.exists():
+        return
+    case.data_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(f"{seed}:{case.bits}:{case.vectors}")
+    with open(case.text_path, "w", encoding="utf8") as f:
+        print("* synthetic patterns", file=f)
+        for i in range(case.vectors):
+            print(f"{i + 1}: {random_bits(rng, case.bits)}", file=f)
+    with open(case.text_path, encoding="utf8") as f_in, open(
+        case.bin_path, "wb"
+    ) as f_out:
+        for pattern in read_patterns_text(f_in):
+            write_pattern_bin(f_out, pattern)
+
+
+def synthetic_chain(bits: int) -> List[Dict[str, Any]]:
+    """
+    :returns: A single chain of ``bits`` flip-flops, as loaded from
+        ``chain.yml``.
+    """
+    insts: List[Any] = [{"name": "ff[0]", "clk": "clk", "edge": "rising"}]
+    insts += [f"ff[{i}]" for i in range(1, bits)]
+    return [
+        {
+            "name": "chain0",
+            "partitions": [{"name": "p0", "scan_lists": [{"insts": insts}]}],
+        }
+    ]
+
+
+# Every benchmark takes a case and returns the function to time: setting up
+# its inputs is neither timed nor counted in the growth of the peak RSS
+
+
+def bench_read_patterns_text(case: Case) -> Callable[[], int]:
+    from patterns import read_patterns_text
+
+    def run():
+        count = 0
+        with open(case.text_path, encoding="utf8") as f:
+            for _ in read_patterns_text(f):
+                count += 1
+        return count
+
+    return run
+
+
+def bench_read_patterns_bin(case: Case) -> Callable[[], int]:
+    from patterns import read_patterns_bin
+
+    def run():
+        count = 0
+        with open(case.bin_path, "rb") as f:
+            for _ in read_patterns_bin(f):
+                count += 1
+        return count
+
+    return run
+
+
+def bench_write_pattern_bin(case: Case) -> Callable[[], int]:
+    from patterns import read_patterns_text, write_pattern_bin
+
+    with open(case.text_path, encoding="utf8") as f:
+        patterns = list(read_patterns_text(f))
+
+    def run():
+        try:
+            with open(case.scratch_path, "wb") as f:
+                for pattern in patterns:
+                    write_pattern_bin(f, pattern)
+        finally:
+            case.scratch_path.unlink(missing_ok=True)
+        return len(patterns)
+
+    return run
+
+
+def bench_assemble_patterns(case: Case) -> Callable[[], int]:
+    from patterns import assemble_patterns
+
+    locations = list(range(case.bits))
+    random.Random(case.bits).shuffle(locations)
+
+    def run():
+        try:
+            with open(case.text_path, encoding="utf8") as f_in, open(
+                case.scratch_path, "wb"
+            ) as f_out:
+                return assemble_patterns(f_in, f_out, locations, case.bits)
+        finally:
+            case.scratch_path.unlink(missing_ok=True)
+
+    return run
+
+
+def bench_load_chains(case: Case) -> Callable[[], int]:
+    from chain import load_chains
+
+    raw = synthetic_chain(case.bits)
+
+    def run():
+        chains = load_chains(raw)
+        assert chains[0].get_length_of_uniform_chain() == case.bits
+        return len(chains)
+
+    return run
+
+
+class Signal:
+    def __init__(self, value: int = 0):
+        self.value = value
+
+
+class ScanChainModel:
+    """
+    A scan chain of flip-flops capturing their own state, i.e. the response
+    to a vector is the vector itself.
+
+    Awaiting it clocks it once, without ever suspending the coroutine.
+    """
+
+    def __init__(self, length: int, sce: Signal, sci: Signal, sco: Signal):
+        from bitarray import bitarray
+
+        self.sce = sce
+        self.sci = sci
+        self.sco = sco
+        # a ring buffer: shifting moves the head instead of every bit, so the
+        # model itself shifts in constant time
+        self.state = bitarray(length)
+        self.state.setall(0)
+        self.head = 0
+
+    def __await__(self):
+        if int(self.sce.value):
+            length = len(self.state)
+            # sampled right after the edge, the output is still that of the
+            # last flip-flop before it
+            self.sco.value = self.state[(self.head - 1) % length]
+            self.head = (self.head - 1) % length
+            self.state[self.head] = int(self.sci.value)
+        return
+        yield
+
+
+def bench_run_scan(case: Case) -> Callable[[], int]:
+    import scan_chain
+    from bitarray import bitarray
+    from patterns import read_patterns_bin
+
+    with open(case.bin_path, "rb") as f:
+        patterns = list(read_patterns_bin(f))
+    sce, sci, sco, tm = Signal(), Signal(), Signal(), Signal()
+    tck = ScanChainModel(case.bits, sce, sci, sco)
+    mask = bitarray(case.bits)
+    mask.setall(1)
+
+    scan_chain.RisingEdge = lambda clock: clock
+
+    def run():
+        mismatches = 0
+        for pattern in patterns:
+            coroutine = scan_chain.run_scan(
+                tck, tm, sce, sci, sco, pattern, pattern, mask, diff_file=None
+            )
+            try:
+                coroutine.send(None)
+            except StopIteration as e:
+                mismatches += e.value.any()
+        assert mismatches == 0, f"{mismatches} vectors shifted out incorrectly"
+        return len(patterns)
+
+    return run
+
+
+@dataclass
+class Benchmark:
+    setup: Callable[[Case], Callable[[], int]]
+    # whether it processes every vector or only the chain
+    per_vector: bool = True
+    requires: Optional[str] = None
+
+
+BENCHMARKS = {
+    "read_patterns_text": Benchmark(bench_read_patterns_text),
+    "read_patterns_bin": Benchmark(bench_read_patterns_bin),
+    "write_pattern_bin": Benchmark(bench_write_pattern_bin),
+    "assemble_patterns": Benchmark(bench_assemble_patterns),
+    "load_chains": Benchmark(bench_load_chains, per_vector=False),
+    "run_scan": Benchmark(bench_run_scan, requires="cocotb"),
+}
+
+
+def peak_rss() -> int:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_case(name: str, case: Case) -> Dict[str, Any]:
+    """
+    Runs a benchmark in this process: meant to be called in a new one, so its
+    peak RSS is not that of a previous case.
+    """
+    run = BENCHMARKS[name].setup(case)
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    items = run()
+    wall_time = time.perf_counter() - start
+    return {
+        "wall_time": wall_time,
+        "items": items,
+        "peak_rss": peak_rss(),
+        "rss_growth": peak_rss() - rss_before,
+    }
+
+
+def run_case_process(name: str, case: Case) -> Dict[str, Any]:
+    """
+    :raises subprocess.CalledProcessError: If the benchmark fails.
+    """
+    process = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--run-case",
+            name,
+            str(case.bits),
+            str(case.vectors),
+            "--data",
+            str(case.data_dir),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        encoding="utf8",
+    )
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode, process.args, process.stdout, process.stderr
+        )
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def fit_exponent(points: List[tuple]) -> Optional[float]:
+    """
+    :returns: The exponent ``k`` of ``y = a * x ** k`` best fitting the points
+        (a least-squares fit of ``log y`` against ``log x``,) or ``None`` if
+        there are not enough points.
+    """
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y > 0]
+    if len({x for x, _ in points}) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return covariance / variance
+
+
+def parse_count(value: str) -> int:
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    value = value.strip().lower()
+    multiplier = multipliers.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid count '{value}'")
+
+
+def parse_counts(value: str) -> List[int]:
+    return [parse_count(e) for e in value.split(",") if e.strip() != ""]
+
+
+def format_rate(value: float) -> str:
+    for unit in ["", "k", "M", "G"]:
+        if abs(value) < 1000:
+            return f"{value:.1f}{unit}"
+        value /= 1000
+    return f"{value:.1f}T"
+
+
+def write_report(results: List[Dict[str, Any]], json_path: Path, csv_path: Path):
+    with open(json_path, "w", encoding="utf8") as f:
+        json.dump({"results": results}, f, indent=2, sort_keys=True)
+    columns = [
+        "benchmark",
+        "bits",
+        "vectors",
+        "wall_time",
+        "bits_per_second",
+        "vectors_per_second",
+        "peak_rss",
+        "rss_growth",
+        "error",
+    ]
+    with open(csv_path, "w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for result in results:
+            writer.writerow([result.get(column, "") for column in columns])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})",
+    )
+    parser.add_argument(
+        "--bits",
+        type=parse_counts,
+        default=parse_counts("1k,10k,100k,1M"),
+        help="Chain lengths, comma-separated",
+    )
+    parser.add_argument(
+        "--vectors",
+        type=parse_counts,
+        default=parse_counts("10,100,1k,10k,100k"),
+        help="Vector counts, comma-separated",
+    )
+    parser.add_argument(
+        "--max-total-bits",
+        type=parse_count,
+        default=parse_count("10M"),
+        help="Skips combinations with more bits in total (bits × vectors)",
+    )
+    parser.add_argument(
+        "--max-scan-bits",
+        type=parse_count,
+        default=parse_count("100k"),
+        help="Like --max-total-bits for run_scan, which simulates every shift",
+    )
+    parser.add_argument(
+        "--data",
+        type=Path,
+        default=cwd / "out" / "data",
+        help="Where synthetic patterns are generated (and reused from)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run-case", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        name, bits, vectors = args.run_case
+        case = Case(int(bits), int(vectors), args.data)
+        print(json.dumps(run_case(name, case)))
+        return
+
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark '{name}'")
+
+    import importlib.util
+
+    results: List[Dict[str, Any]] = []
+    for name in names:
+        benchmark = BENCHMARKS[name]
+        if (
+            benchmark.requires is not None
+            and importlib.util.find_spec(benchmark.requires) is None
+        ):
+            print(f"{name}: {benchmark.requires} not installed, skipped.")
+            continue
+        limit = args.max_scan_bits if name == "run_scan" else args.max_total_bits
+        vector_counts = args.vectors if benchmark.per_vector else [1]
+        for bits in args.bits:
+            for vectors in vector_counts:
+                if bits * vectors > limit:
+                    continue
+                case = Case(bits, vectors, args.data)
+                generate_patterns(case, args.seed)
+                result: Dict[str, Any] = {
+                    "benchmark": name,
+                    "bits": bits,
+                    "vectors": vectors,
+                }
+                try:
+                    result.update(run_case_process(name, case))
+                except subprocess.CalledProcessError as e:
+                    result["error"] = e.stderr.strip().splitlines()[-1]
+                    print(f"{name} {bits}×{vectors}: {result['error']}")
+                    results.append(result)
+                    continue
+                wall_time = max(result["wall_time"], 1e-9)
+                result["bits_per_second"] = bits * vectors / wall_time
+                result["vectors_per_second"] = vectors / wall_time
+                results.append(result)
+                print(
+                    f"{name} {bits}×{vectors}: {result['wall_time']:.3f}s, "
+                    f"{format_rate(result['bits_per_second'])}bit/s, "
+                    f"peak RSS +{result['rss_growth'] / 1024 / 1024:.1f}MiB"
+                )
+
+    out_dir = cwd / "out"
+    out_dir.mkdir(exist_ok=True)
+    write_report(results, out_dir / "micro.json", out_dir / "micro.csv")
+
+    print("Scaling with the total number of bits (1 is linear):")
+    for name in names:
+        ok = [r for r in results if r["benchmark"] == name and "error" not in r]
+        time_exponent = fit_exponent(
+            [(r["bits"] * r["vectors"], r["wall_time"]) for r in ok]
+        )
+        memory_exponent = fit_exponent(
+            [(r["bits"] * r["vectors"], r["rss_growth"]) for r in ok]
+        )
+        if time_exponent is None:
+            continue
+        memory = "n/a" if memory_exponent is None else f"{memory_exponent:.2f}"
+        print(f"  {name}: time {time_exponent:.2f}, memory {memory}")
+
+    if any("error" in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
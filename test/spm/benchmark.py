@@ -0,0 +1,280 @@
+"""
+Runs ``DifettoPNR``, ``DifettoATPG`` and ``DifettoTest`` on this design (as
+in ``commands.sh``) and reports how long every Difetto step took, read from
+the ``runtime.txt`` LibreLane writes in each step directory.
+
+The report is written to ``out/timing.json`` and ``out/timing.csv``, and
+if ``budgets.json`` exists (or budgets are given with ``--budgets``, which
+must), every step is checked against its budget: the script exits with a
+non-zero status if any step took longer or has no budget.
+
+    python3 test/spm/benchmark.py [--no-run] [-- librelane arguments…]
+    python3 test/spm/benchmark.py --update-budgets [--margin 1.5] [--slack 5]
+
+With ``--update-budgets``, each step's budget is set to its runtime times the
+margin, or its runtime plus the slack in seconds, whichever is more.
+"""
+
+import csv
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+cwd = Path(__file__).resolve().parent
+repo_root = cwd.parent.parent
+
+FLOWS = ["DifettoPNR", "DifettoATPG", "DifettoTest"]
+
+
+def parse_runtime(runtime: str) -> float:
+    # format_elapsed_time: HH:MM:SS.mmm
+    hours, minutes, seconds = runtime.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def get_run_dir(tag: str) -> Path:
+    return cwd / "runs" / tag
+
+
+def find_state_out(run_dir: Path, step_slug: str) -> Path:
+    """
+    :returns: The ``state_out.json`` of the step of a run, e.g.
+        ``difetto-cut``.
+    """
+    candidates = sorted(run_dir.glob(f"*-{step_slug}/state_out.json"))
+    if len(candidates) == 0:
+        raise FileNotFoundError(f"no '{step_slug}' step in '{run_dir}'")
+    return candidates[-1]
+
+
+def run_flow(
+    flow: str,
+    tag: str,
+    initial_states: List[Path],
+    librelane_args: List[str],
+) -> float:
+    """
+    Runs a flow on this design, logging to ``out/<tag>.log``.
+
+    :returns: The wall time of the flow.
+    :raises subprocess.CalledProcessError: If the flow fails.
+    """
+    cmd = [
+        sys.executable,
+        "-m",
+        "librelane",
+        str(cwd / "config.yaml"),
+        "--run-tag",
+        tag,
+        "--flow",
+        flow,
+        "--overwrite",
+    ]
+    for state in initial_states:
+        cmd += ["--with-initial-state", str(state)]
+    cmd += librelane_args
+    (cwd / "out").mkdir(exist_ok=True)
+    with open(cwd / "out" / f"{tag}.log", "w", encoding="utf8") as log:
+        start = time.perf_counter()
+        subprocess.run(
+            cmd, cwd=repo_root, stdout=log, stderr=subprocess.STDOUT, check=True
+        )
+        return time.perf_counter() - start
+
+
+def run_flows(tags: Dict[str, str], librelane_args: List[str]) -> Dict[str, float]:
+    """
+    :returns: The wall time of every flow.
+    """
+    wall_times = {}
+    wall_times["DifettoPNR"] = run_flow(
+        "DifettoPNR", tags["DifettoPNR"], [], librelane_args
+    )
+    pnr_dir = get_run_dir(tags["DifettoPNR"])
+    wall_times["DifettoATPG"] = run_flow(
+        "DifettoATPG",
+        tags["DifettoATPG"],
+        [find_state_out(pnr_dir, "difetto-cut")],
+        librelane_args,
+    )
+    atpg_dir = get_run_dir(tags["DifettoATPG"])
+    wall_times["DifettoTest"] = run_flow(
+        "DifettoTest",
+        tags["DifettoTest"],
+        [
+            find_state_out(atpg_dir, "difetto-quaighsim"),
+            find_state_out(pnr_dir, "difetto-chain"),
+        ],
+        librelane_args,
+    )
+    return wall_times
+
+
+def collect_step_times(run_dir: Path) -> Dict[str, float]:
+    """
+    :returns: The runtime of every Difetto step of a run that finished, in
+        the order they ran.
+    """
+    step_times = {}
+    for step_dir in sorted(run_dir.iterdir()):
+        config_path = step_dir / "config.json"
+        runtime_path = step_dir / "runtime.txt"
+        if not (config_path.is_file() and runtime_path.is_file()):
+            continue
+        with open(config_path, encoding="utf8") as f:
+            step_id = json.load(f).get("meta", {}).get("step", "")
+        if not step_id.startswith("Difetto."):
+            continue
+        step_times[step_id] = parse_runtime(runtime_path.read_text(encoding="utf8"))
+    return step_times
+
+
+def write_report(report: Dict[str, Dict], json_path: Path, csv_path: Path):
+    with open(json_path, "w", encoding="utf8") as f:
+        json.dump({"flows": report}, f, indent=2)
+    with open(csv_path, "w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["flow", "step", "runtime"])
+        for flow, result in report.items():
+            for step, runtime in result["steps"].items():
+                writer.writerow([flow, step, round(runtime, 3)])
+            if result.get("wall_time") is not None:
+                writer.writerow([flow, "", round(result["wall_time"], 3)])
+
+
+def check_budgets(report: Dict[str, Dict], budgets: Dict[str, float]) -> List[str]:
+    """
+    :returns: A description of every step over its budget or without one.
+    """
+    over = []
+    for result in report.values():
+        for step, runtime in result["steps"].items():
+            budget = budgets.get(step)
+            if budget is None:
+                over.append(f"{step} has no budget")
+            elif runtime > budget:
+                over.append(f"{step} took {runtime:.3f}s (budget: {budget:g}s)")
+    return over
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "librelane_args",
+        nargs="*",
+        help="Passed on to every LibreLane invocation (after --)",
+    )
+    parser.add_argument(
+        "--tag-prefix",
+        default="benchmark",
+        help="Runs are tagged <prefix>_pnr, <prefix>_atpg and <prefix>_test",
+    )
+    parser.add_argument(
+        "--no-run",
+        action="store_true",
+        help="Only collects the step runtimes of existing runs",
+    )
+    parser.add_argument(
+        "--budgets",
+        type=Path,
+        help="The step budgets to check against (default: budgets.json, if it exists)",
+    )
+    parser.add_argument(
+        "--update-budgets",
+        action="store_true",
+        help="Writes new budgets from the runtimes instead of checking them",
+    )
+    parser.add_argument(
+        "--margin",
+        type=float,
+        default=1.5,
+        help="The budget of a step relative to its runtime",
+    )
+    parser.add_argument(
+        "--slack",
+        type=float,
+        default=5.0,
+        help="The minimum budget of a step beyond its runtime, in seconds",
+    )
+    args = parser.parse_args()
+
+    budgets_given = args.budgets is not None
+    if not budgets_given:
+        args.budgets = cwd / "budgets.json"
+    elif not (args.update_budgets or args.budgets.exists()):
+        print(
+            f"No budgets at '{args.budgets}': create them with --update-budgets.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    tags = {
+        flow: f"{args.tag_prefix}_{suffix}"
+        for flow, suffix in zip(FLOWS, ["pnr", "atpg", "test"])
+    }
+
+    wall_times: Dict[str, Optional[float]] = {flow: None for flow in FLOWS}
+    if not args.no_run:
+        try:
+            wall_times.update(run_flows(tags, args.librelane_args))
+        except subprocess.CalledProcessError as e:
+            print(
+                f"{e.cmd[e.cmd.index('--flow') + 1]} failed, see '{cwd / 'out'}'.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+    report = {}
+    for flow in FLOWS:
+        run_dir = get_run_dir(tags[flow])
+        if not run_dir.is_dir():
+            print(f"No run of {flow} at '{run_dir}'.", file=sys.stderr)
+            sys.exit(1)
+        report[flow] = {
+            "run_dir": str(run_dir),
+            "wall_time": wall_times[flow],
+            "steps": collect_step_times(run_dir),
+        }
+        for step, runtime in report[flow]["steps"].items():
+            print(f"{flow}: {step}: {runtime:.3f}s")
+
+    (cwd / "out").mkdir(exist_ok=True)
+    write_report(report, cwd / "out" / "timing.json", cwd / "out" / "timing.csv")
+
+    if args.update_budgets:
+        budgets = {}
+        for result in report.values():
+            for step, runtime in result["steps"].items():
+                budgets[step] = round(
+                    max(runtime * args.margin, runtime + args.slack), 1
+                )
+        with open(args.budgets, "w", encoding="utf8") as f:
+            json.dump({"steps": budgets}, f, indent=2)
+            f.write("\n")
+        print(f"Updated '{args.budgets}'.")
+        return
+
+    if not args.budgets.exists():
+        print(
+            f"No budgets at '{args.budgets}': not checking (record them with --update-budgets).",
+            file=sys.stderr,
+        )
+        return
+    with open(args.budgets, encoding="utf8") as f:
+        budgets = json.load(f)["steps"]
+    over = check_budgets(report, budgets)
+    for description in over:
+        print(description, file=sys.stderr)
+    if over:
+        sys.exit(1)
+    print("All steps within budget.")
+
+
+if __name__ == "__main__":
+    main()
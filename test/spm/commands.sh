@@ -4,3 +4,5 @@ python3 -m librelane ./test/spm/config.yaml --run-tag atpg --flow DifettoATPG --
 python3 -m librelane ./test/spm/config.yaml --run-tag test --flow DifettoTest --overwrite\
     --with-initial-state test/spm/runs/atpg/*-difetto-quaighsim/state_out.json\
     --with-initial-state test/spm/runs/new_pnr/*-difetto-chain/state_out.json
+# or, in one invocation, with ATPG running in parallel with PnR:
+# python3 -m librelane ./test/spm/config.yaml --run-tag full --flow DifettoFull --overwrite
@@ -4,6 +4,7 @@
 
 #include "kernel/yosys.h"
 #include <filesystem>
+#include <functional>
 #include <optional>
 
 struct DifettoPass : public Yosys::Pass {
@@ -21,6 +22,11 @@ struct DifettoPass : public Yosys::Pass {
 	Yosys::dict<Yosys::RTLIL::IdString, bool> process_exclusions(const Yosys::pool<std::string> &raw_exclusions);
 	void load_ibsr_definitions(Yosys::RTLIL::Design *design);
 
+	std::string module_hash(Yosys::RTLIL::Module *module, const std::string &salt);
+	Yosys::RTLIL::Module *transform_cached(Yosys::RTLIL::Design *design, Yosys::RTLIL::Module *module, const std::string &cache_dir,
+					       const std::string &salt, const std::function<void(Yosys::RTLIL::Module *)> &transform,
+					       bool &reused);
+
 	virtual const Yosys::dict<std::string, Arg> &get_args() = 0;
 	virtual std::string_view get_description() = 0;
 	virtual void help() override;
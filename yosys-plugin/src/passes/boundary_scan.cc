@@ -22,6 +22,9 @@ struct BoundaryScanPass : public DifettoPass {
 	  // ignore certain ports, pass them as \"-exclude_io
 	  // instance_name/port_name\"", "instance", true}},
 	  {"exclude_io", Arg{"Top-level pins to ignore.", "io", false, true}},
+	  {"cache_dir", Arg{"Directory of modules transformed by previous runs, keyed by a hash of their structure and "
+			    "this pass's arguments. Unchanged modules are restored from it instead of being processed again.",
+			    "directory"}},
 	};
 
 	const std::string description = "Creates boundary scan unmapped Yosys "
@@ -127,8 +130,22 @@ struct BoundaryScanPass : public DifettoPass {
 			load_ibsr_definitions(design);
 		}
 
+		std::string cache_dir = parsed_args.count("cache_dir") ? parsed_args["cache_dir"].at(0) : "";
+		std::string salt = stringf("%s %s", test_mode_wire_name.c_str(), clock_wire_name.c_str());
+		for (auto &[id, inverted] : exclusions) {
+			salt += stringf(" %s%s", inverted ? "!" : "", id.c_str());
+		}
+
+		int reused_count = 0;
 		for (auto module : design->selected_modules()) {
-			boundary_scan(module, test_mode_wire_name, clock_wire_name, exclusions);
+			bool reused;
+			transform_cached(
+			  design, module, cache_dir, salt,
+			  [&](Module *module) { boundary_scan(module, test_mode_wire_name, clock_wire_name, exclusions); }, reused);
+			reused_count += reused;
+		}
+		if (!cache_dir.empty()) {
+			log("Reused %d cached module(s).\n", reused_count);
 		}
 
 		Pass::call(design, "hierarchy");
@@ -0,0 +1,404 @@
+// SPDX-License-Identifier: Apache-2.0
+// Copyright (c) 2025 Mohamed Gaber
+#include "difetto_pass.h"
+#include "json11.hpp"
+#include "kernel/celltypes.h"
+#include "kernel/sigtools.h"
+#include "passes/techmap/libparse.h"
+#include <chrono>
+#include <fstream>
+#include <regex>
+#include <sys/resource.h>
+
+USING_YOSYS_NAMESPACE
+
+struct DFTDRCPass : public DifettoPass {
+	DFTDRCPass() : DifettoPass("dft_drc", "checks a netlist with scannable flip-flops for DFT rule violations") {}
+
+	const dict<std::string, Arg> args = {
+	  {"liberty", Arg{"Liberty files with the flip-flops of the netlist. Their clock and asynchronous set/reset pins "
+			  "are found from the ff groups.",
+			  "filename", true, true}},
+	  {"json_mapping", Arg{"The JSON mapping file.", "filename", true}},
+	  {"clock", Arg{"Name of the wire used as the test clock. Prefix with ! for negative edge.", "wire", true}},
+	  {"test_mode", Arg{"Name of the wire used as the test mode select. Prefix with ! to invert.", "wire"}},
+	  {"exclude_io", Arg{"Top-level pins excluded from boundary scan, which must exist.", "io", false, true}},
+	  {"report", Arg{"Write the violations to this JSON file.", "filename"}},
+	};
+	const std::string description = "Runs structural design-for-testability rule "
+					"checks on a netlist after scan_replace, so problems that would "
+					"otherwise only surface after placement and routing (when the chain "
+					"is stitched, validated or used to apply test vectors) are found "
+					"early. Every check takes time linear in the size of the netlist.\n \n"
+					"The following rules are checked (severity in brackets):\n \n"
+					"- unscanned_flop [error]: A flip-flop was not replaced by a "
+					"scannable one, e.g. because it has no entry in the JSON mapping.\n \n"
+					"- no_scan_flop [warning]: A flip-flop was kept out of the chain by "
+					"a no_scan attribute (on the cell, its module or a wire it drives.) "
+					"flatten drops the attributes of submodules: copy them onto their "
+					"cells first, e.g. with 'setattr -set no_scan 1 A:no_scan t:* %i'.\n \n"
+					"- uncontrollable_clock [error]: The clock of a scannable flip-flop "
+					"is not driven by the test clock through combinational logic (and "
+					"integrated clock gates,) e.g. a divided or internally generated "
+					"clock.\n \n"
+					"- uncontrollable_async [error]: An asynchronous set or reset of a "
+					"scannable flip-flop depends on the state of a flip-flop, so it may "
+					"fire while shifting.\n \n"
+					"- missing_pin [error]: The test clock, the test mode select or an "
+					"excluded IO does not exist.\n \n"
+					"Hierarchical netlists should be flattened first: instances of other "
+					"modules are treated as combinational logic.";
+
+	virtual const dict<std::string, Arg> &get_args() override { return args; }
+	virtual std::string_view get_description() override { return description; }
+
+	struct SequentialCell {
+		pool<IdString> clocks;
+		pool<IdString> asyncs;
+		bool clock_gate = false;
+	};
+
+	struct Violation {
+		std::string rule;
+		std::string severity;
+		std::string instance;
+		std::string message;
+	};
+
+	vector<Violation> violations;
+
+	void report(const std::string &rule, const std::string &severity, const std::string &instance, const std::string &message)
+	{
+		if (severity == "error") {
+			log_warning("[%s] %s: %s\n", rule.c_str(), instance.c_str(), message.c_str());
+		} else {
+			log("[%s] %s: %s\n", rule.c_str(), instance.c_str(), message.c_str());
+		}
+		violations.push_back({rule, severity, instance, message});
+	}
+
+	static pool<IdString> expression_pins(const LibertyAst *group, const char *attribute)
+	{
+		pool<IdString> pins;
+		auto found = group->find(attribute);
+		if (found == nullptr) {
+			return pins;
+		}
+		static const std::regex identifier("[A-Za-z_][A-Za-z0-9_]*");
+		auto &value = found->value;
+		for (auto it = std::sregex_iterator(value.begin(), value.end(), identifier); it != std::sregex_iterator(); ++it) {
+			pins.insert(RTLIL::escape_id(it->str()));
+		}
+		return pins;
+	}
+
+	void load_sequential_cells(const std::string &liberty_file, dict<IdString, SequentialCell> &sequential)
+	{
+		std::ifstream f(liberty_file.c_str());
+		if (f.fail()) {
+			log_cmd_error("Can't open liberty file `%s': %s\n", liberty_file.c_str(), strerror(errno));
+		}
+		LibertyParser parser(f);
+		for (auto cell : parser.ast->children) {
+			if (cell->id != "cell" || cell->args.size() != 1) {
+				continue;
+			}
+			SequentialCell info;
+			bool is_sequential = false;
+			if (auto ff = cell->find("ff")) {
+				is_sequential = true;
+				info.clocks = expression_pins(ff, "clocked_on");
+				for (auto attribute : {"clear", "preset"}) {
+					for (auto pin : expression_pins(ff, attribute)) {
+						info.asyncs.insert(pin);
+					}
+				}
+			} else if (cell->find("latch") || cell->find("statetable")) {
+				is_sequential = true;
+			}
+			if (auto icg = cell->find("clock_gating_integrated_cell")) {
+				is_sequential = true;
+				info.clock_gate = !icg->value.empty();
+			}
+			if (is_sequential) {
+				sequential[RTLIL::escape_id(cell->args[0])] = info;
+			}
+		}
+	}
+
+	static bool has_no_scan(Module *module, Cell *cell, const CellTypes &ct)
+	{
+		if (module->get_bool_attribute(ID(no_scan)) || cell->get_bool_attribute(ID(no_scan))) {
+			return true;
+		}
+		for (auto &[port, sig] : cell->connections()) {
+			if (!ct.cell_output(cell->type, port)) {
+				continue;
+			}
+			for (auto bit : sig) {
+				if (bit.wire != nullptr && bit.wire->get_bool_attribute(ID(no_scan))) {
+					return true;
+				}
+			}
+		}
+		return false;
+	}
+
+	static bool is_input(const CellTypes &ct, Cell *cell, IdString port)
+	{
+		// ports of unknown cells are assumed to be inputs unless known to
+		// be outputs
+		return ct.cell_known(cell->type) ? ct.cell_input(cell->type, port) : !ct.cell_output(cell->type, port);
+	}
+
+	// Marks every bit reachable from the seeds through cells that pass
+	// values on (all but the sequential ones, unless they are clock gates
+	// and pass_clock_gates is set.)
+	pool<SigBit> propagate(const vector<SigBit> &seeds, const dict<SigBit, vector<Cell *>> &loads,
+			       const dict<IdString, SequentialCell> &sequential, const CellTypes &ct, const SigMap &sigmap, bool pass_clock_gates)
+	{
+		pool<SigBit> reached;
+		pool<Cell *> visited;
+		vector<SigBit> queue;
+		for (auto bit : seeds) {
+			if (reached.insert(bit).second) {
+				queue.push_back(bit);
+			}
+		}
+		while (!queue.empty()) {
+			auto bit = queue.back();
+			queue.pop_back();
+			auto found = loads.find(bit);
+			if (found == loads.end()) {
+				continue;
+			}
+			for (auto cell : found->second) {
+				auto seq = sequential.find(cell->type);
+				if (seq != sequential.end() && !(pass_clock_gates && seq->second.clock_gate)) {
+					continue;
+				}
+				if (RTLIL::builtin_ff_cell_types().count(cell->type)) {
+					continue;
+				}
+				if (!visited.insert(cell).second) {
+					continue;
+				}
+				for (auto &[port, sig] : cell->connections()) {
+					if (!ct.cell_output(cell->type, port)) {
+						continue;
+					}
+					for (auto out : sigmap(sig)) {
+						if (out.wire != nullptr && reached.insert(out).second) {
+							queue.push_back(out);
+						}
+					}
+				}
+			}
+		}
+		return reached;
+	}
+
+	void dft_drc(Module *module, const pool<IdString> &mapped, const pool<IdString> &scan_flops, const dict<IdString, SequentialCell> &sequential,
+		     const CellTypes &ct, const std::string &clock_wire_name_raw, const std::string &test_mode_wire_name_raw,
+		     const pool<std::string> &exclusions, int &flop_count)
+	{
+		SigMap sigmap(module);
+		std::string module_name = RTLIL::unescape_id(module->name);
+
+		auto find_wire = [&](const std::string &raw, const std::string &role) -> Wire * {
+			auto name = raw[0] == '!' ? raw.substr(1) : raw;
+			auto wire = module->wire(RTLIL::escape_id(name));
+			if (wire == nullptr) {
+				report("missing_pin", "error", name,
+				       stringf("The %s does not exist in module %s.", role.c_str(), module_name.c_str()));
+			}
+			return wire;
+		};
+
+		auto clock_wire = find_wire(clock_wire_name_raw, "test clock");
+		if (!test_mode_wire_name_raw.empty()) {
+			find_wire(test_mode_wire_name_raw, "test mode select");
+		}
+		for (auto &io : exclusions) {
+			auto wire = find_wire(io, "excluded IO");
+			if (wire != nullptr && !wire->port_input && !wire->port_output) {
+				report("missing_pin", "error", RTLIL::unescape_id(wire->name),
+				       stringf("The excluded IO is not a port of module %s.", module_name.c_str()));
+			}
+		}
+
+		// One pass over the connections: the loads of every net, and the
+		// outputs of every sequential cell
+		dict<SigBit, vector<Cell *>> loads;
+		vector<SigBit> state_bits;
+		vector<Cell *> flops;
+		for (auto cell : module->cells()) {
+			bool is_sequential = sequential.count(cell->type) || RTLIL::builtin_ff_cell_types().count(cell->type);
+			bool is_clock_gate = is_sequential && sequential.count(cell->type) && sequential.at(cell->type).clock_gate;
+			for (auto &[port, sig] : cell->connections()) {
+				if (is_input(ct, cell, port)) {
+					for (auto bit : sigmap(sig)) {
+						if (bit.wire != nullptr) {
+							loads[bit].push_back(cell);
+						}
+					}
+				} else if (is_sequential && !is_clock_gate) {
+					for (auto bit : sigmap(sig)) {
+						if (bit.wire != nullptr) {
+							state_bits.push_back(bit);
+						}
+					}
+				}
+			}
+			if (is_sequential && !is_clock_gate) {
+				flops.push_back(cell);
+			}
+		}
+
+		vector<SigBit> clock_bits;
+		if (clock_wire != nullptr) {
+			for (auto bit : sigmap(clock_wire)) {
+				clock_bits.push_back(bit);
+			}
+		}
+		auto clocked = propagate(clock_bits, loads, sequential, ct, sigmap, true);
+		auto state_dependent = propagate(state_bits, loads, sequential, ct, sigmap, false);
+
+		for (auto cell : flops) {
+			auto instance = RTLIL::unescape_id(cell->name);
+			auto type = RTLIL::unescape_id(cell->type);
+			if (!scan_flops.count(cell->type)) {
+				auto seq = sequential.find(cell->type);
+				if (seq != sequential.end() && seq->second.clocks.empty()) {
+					// latches and the like are not flip-flops
+					continue;
+				}
+				flop_count += 1;
+				if (has_no_scan(module, cell, ct)) {
+					report("no_scan_flop", "warning", instance,
+					       stringf("Flip-flop of type %s is excluded from the scan chain by no_scan.", type.c_str()));
+				} else if (mapped.count(cell->type)) {
+					report("unscanned_flop", "error", instance,
+					       stringf("Flip-flop of type %s was not replaced by a scannable flip-flop.", type.c_str()));
+				} else {
+					report("unscanned_flop", "error", instance,
+					       stringf("Flip-flop of type %s has no scannable replacement in the JSON mapping.", type.c_str()));
+				}
+				continue;
+			}
+			flop_count += 1;
+			auto &info = sequential.at(cell->type);
+			for (auto &[port, sig] : cell->connections()) {
+				// a missing test clock is already reported
+				if (clock_wire != nullptr && info.clocks.count(port)) {
+					for (auto bit : sigmap(sig)) {
+						if (bit.wire == nullptr || !clocked.count(bit)) {
+							report("uncontrollable_clock", "error", instance,
+							       stringf("Clock pin %s (%s) is not driven by the test clock.", log_id(port),
+								       log_signal(bit)));
+							break;
+						}
+					}
+				}
+				if (info.asyncs.count(port)) {
+					for (auto bit : sigmap(sig)) {
+						if (state_dependent.count(bit)) {
+							report("uncontrollable_async", "error", instance,
+							       stringf("Asynchronous set/reset pin %s (%s) depends on the state of a flip-flop.",
+								       log_id(port), log_signal(bit)));
+							break;
+						}
+					}
+				}
+			}
+		}
+	}
+
+	void write_report(const std::string &filename, int flop_count)
+	{
+		json11::Json::array entries;
+		for (auto &violation : violations) {
+			entries.push_back(json11::Json::object{
+			  {"rule", violation.rule},
+			  {"severity", violation.severity},
+			  {"instance", violation.instance},
+			  {"message", violation.message},
+			});
+		}
+		json11::Json report = json11::Json::object{
+		  {"flop_count", flop_count},
+		  {"violations", entries},
+		};
+		std::ofstream f(filename);
+		if (f.fail()) {
+			log_error("Could not open `%s' for writing.\n", filename.c_str());
+		}
+		f << report.dump() << std::endl;
+	}
+
+	virtual void execute(std::vector<std::string> args, Design *design) override
+	{
+		log_header(design, "Executing DFT_DRC pass.\n");
+		log_push();
+		auto parsed_args = parse_args(args, design);
+
+		std::string mapping_json = parsed_args["json_mapping"].at(0);
+		std::ifstream f(mapping_json.c_str());
+		if (f.fail())
+			log_error("Cannot open file `%s`\n", mapping_json.c_str());
+		std::stringstream buf;
+		buf << f.rdbuf();
+		std::string err;
+		json11::Json json = json11::Json::parse(buf.str(), err);
+		if (!err.empty())
+			log_error("Failed to parse `%s`: %s\n", mapping_json.c_str(), err.c_str());
+
+		pool<IdString> mapped, scan_flops;
+		for (auto &pair : json["mapping"].object_items()) {
+			mapped.insert(IdString(std::string("\\") + pair.first));
+			scan_flops.insert(IdString(std::string("\\") + pair.second.string_value()));
+		}
+
+		auto start = std::chrono::steady_clock::now();
+
+		dict<IdString, SequentialCell> sequential;
+		for (auto &liberty_file : parsed_args["liberty"]) {
+			load_sequential_cells(liberty_file, sequential);
+		}
+		for (auto type : scan_flops) {
+			if (!sequential.count(type) || sequential.at(type).clocks.empty()) {
+				log_error("Scannable flip-flop %s has no ff group in the liberty files.\n", log_id(type));
+			}
+		}
+
+		std::string clock_wire_name = parsed_args["clock"].at(0);
+		std::string test_mode_wire_name = parsed_args.count("test_mode") ? parsed_args["test_mode"].at(0) : "";
+		pool<std::string> exclusions;
+		for (auto &el : parsed_args["exclude_io"]) {
+			exclusions.insert(el);
+		}
+
+		CellTypes ct(design);
+
+		violations.clear();
+		int flop_count = 0;
+		for (auto module : design->selected_modules()) {
+			dft_drc(module, mapped, scan_flops, sequential, ct, clock_wire_name, test_mode_wire_name, exclusions, flop_count);
+		}
+
+		int errors = 0;
+		for (auto &violation : violations) {
+			errors += violation.severity == "error";
+		}
+		std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+		struct rusage usage;
+		getrusage(RUSAGE_SELF, &usage);
+		log("Checked %d flip-flop(s) in %.3fs (peak RSS: %.1f MiB): %d error(s), %zu warning(s).\n", flop_count, elapsed.count(),
+		    usage.ru_maxrss / 1024.0, errors, violations.size() - errors);
+
+		if (parsed_args.count("report")) {
+			write_report(parsed_args["report"].at(0), flop_count);
+		}
+		log_pop();
+	}
+} DFTDRCPass;
@@ -3,6 +3,10 @@
 #include "difetto_pass.h"
 #include "TextFlow.hpp"
 #include "bsr_info.h"
+#include "backends/rtlil/rtlil_backend.h"
+#include "libs/sha1/sha1.h"
+#include <fstream>
+#include <unistd.h>
 
 USING_YOSYS_NAMESPACE
 
@@ -155,3 +159,91 @@ void DifettoPass::load_ibsr_definitions(Yosys::RTLIL::Design *design)
 	Pass::call(design, {"read_verilog", "-icells", bsr_temp});
 	remove(bsr_temp);
 }
+
+// Bump whenever a pass changes what it does to a module, so stale cache
+// entries stop matching.
+static const char *cache_version = "difetto-cache-2";
+
+std::string DifettoPass::module_hash(Yosys::RTLIL::Module *module, const std::string &salt)
+{
+	// Only attributes the Difetto passes act upon: src attributes would
+	// change every time anything above the module in the netlist changes.
+	static const pool<IdString> structural_attributes = {ID(no_scan), ID(no_boundary_scan), ID(hdlname), ID(keep), ID(keep_hierarchy), ID(top)};
+
+	SHA1 sha;
+	auto update_attributes = [&](const RTLIL::AttrObject *object) {
+		for (auto &[id, value] : object->attributes) {
+			if (structural_attributes.count(id)) {
+				sha.update(stringf(" %s=%s", id.c_str(), value.as_string().c_str()));
+			}
+		}
+	};
+
+	sha.update(stringf("%s\n%s\n%s\n%s", cache_version, yosys_version_str, salt.c_str(), module->name.c_str()));
+	update_attributes(module);
+	for (auto wire : module->wires()) {
+		sha.update(stringf("\nwire %s %d %d %d %d %d %d", wire->name.c_str(), wire->width, wire->start_offset, wire->upto, wire->port_id,
+				   wire->port_input, wire->port_output));
+		update_attributes(wire);
+	}
+	for (auto cell : module->cells()) {
+		sha.update(stringf("\ncell %s %s", cell->name.c_str(), cell->type.c_str()));
+		update_attributes(cell);
+		for (auto &[id, value] : cell->parameters) {
+			sha.update(stringf(" %s=%s", id.c_str(), value.as_string().c_str()));
+		}
+		for (auto &[port, sig] : cell->connections()) {
+			sha.update(stringf(" %s=%s", port.c_str(), log_signal(sig)));
+		}
+	}
+	for (auto &[lhs, rhs] : module->connections()) {
+		sha.update(stringf("\nconnect %s %s", log_signal(lhs), log_signal(rhs)));
+	}
+	return sha.final();
+}
+
+Module *DifettoPass::transform_cached(Design *design, Module *module, const std::string &cache_dir, const std::string &salt,
+				      const std::function<void(Module *)> &transform, bool &reused)
+{
+	using namespace std::filesystem;
+	reused = false;
+	// parametric modules are still backed by their AST, which RTLIL cannot
+	// round-trip
+	if (cache_dir.empty() || !module->avail_parameters.empty()) {
+		transform(module);
+		return module;
+	}
+
+	auto hash = module_hash(module, salt);
+	path pass_cache = path(cache_dir) / pass_name;
+	path entry = pass_cache / (hash + ".il");
+	if (exists(entry)) {
+		log("Module %s is unchanged (%s), reusing cached result.\n", log_id(module), hash.c_str());
+		IdString name = module->name;
+		design->remove(module);
+		Pass::call(design, {"read_rtlil", entry.string()});
+		module = design->module(name);
+		if (module == nullptr) {
+			log_error("Cache entry %s does not contain module %s.\n", entry.c_str(), log_id(name));
+		}
+		reused = true;
+		return module;
+	}
+
+	transform(module);
+
+	if (!exists(pass_cache) && !create_directories(pass_cache)) {
+		log_error("Could not create cache directory: %s\n", pass_cache.c_str());
+	}
+	// write then rename, so concurrent runs never see a partial entry
+	path temporary = pass_cache / (hash + ".il." + std::to_string(getpid()));
+	std::ofstream f(temporary);
+	if (f.fail()) {
+		log_error("Could not open cache entry for writing: %s\n", temporary.c_str());
+	}
+	f << "autoidx " << autoidx << "\n";
+	RTLIL_BACKEND::dump_module(f, "", module, design, false);
+	f.close();
+	rename(temporary, entry);
+	return module;
+}
@@ -0,0 +1,306 @@
+// SPDX-License-Identifier: Apache-2.0
+// Copyright (c) 2025 Mohamed Gaber
+#include "difetto_pass.h"
+#include "json11.hpp"
+#include <fstream>
+#include <random>
+
+USING_YOSYS_NAMESPACE
+
+struct ScanCompressPass : public DifettoPass {
+	ScanCompressPass() : DifettoPass("scan_compress", "inserts a scan decompressor and compactor") {}
+
+	const dict<std::string, Arg> args = {
+	  {"json_mapping", Arg{"The JSON mapping file. Its \"compression\" object names the buffer, two-input XOR and "
+			       "flip-flop cells to build the decompressor and compactor from, and their pins.",
+			       "filename", true}},
+	  {"clock", Arg{"Name of wire (port or otherwise) to be used as the clock for the decompressor.", "wire", true}},
+	  {"scan_in", Arg{"Top-level input driving a scan-in channel of the decompressor.", "wire", true, true}},
+	  {"scan_out", Arg{"Top-level output driven by a scan-out channel of the compactor. There must be as many scan-out "
+			   "channels as scan-in channels.",
+			   "wire", true, true}},
+	  {"chains", Arg{"The number of internal scan chains.", "count", true}},
+	  {"stages", Arg{"The number of stages of the decompressor's shift register. Defaults to the greater of 8 and the "
+			 "number of channels.",
+			 "count"}},
+	  {"structure", Arg{"Write a JSON description of the inserted decompressor and compactor to this file, for use when "
+			    "encoding test patterns.",
+			    "filename"}},
+	};
+	const std::string description = "Inserts a sequential linear decompressor between a small number of scan-in "
+					"channels and a larger number of internal scan chains, and an XOR compactor "
+					"between the internal chains and as many scan-out channels.\n \n"
+					"The decompressor is a shift register clocked by the test clock. Each channel "
+					"is XORed into one of its stages, and the scan-in of each internal chain is the "
+					"XOR of a few stages. The compactor drives each scan-out channel with the XOR of "
+					"the scan-outs of every chain assigned to that channel.\n \n"
+					"The internal chains are not stitched: for each chain, a buffer named "
+					"difetto_decompressor_si_<n> drives its scan-in and a buffer named "
+					"difetto_compactor_so_<n> takes its scan-out, so the chains can be stitched "
+					"between their pins later on (e.g. by OpenROAD.) All inserted cells have the "
+					"difetto_compression attribute, and are dropped by sdff_cut.\n \n"
+					"Intended to be run on a single module after scan_replace.";
+
+	virtual const dict<std::string, Arg> &get_args() override { return args; }
+	virtual std::string_view get_description() override { return description; }
+
+	struct CellSpec {
+		IdString type;
+		vector<IdString> inputs;
+		IdString output;
+	};
+
+	static CellSpec cell_spec(const json11::Json &json, const std::string &name, const vector<std::string> &input_keys,
+				  const std::string &output_key)
+	{
+		auto &object = json[name];
+		if (!object.is_object()) {
+			log_error("The mapping file has no compression cell \"%s\".\n", name.c_str());
+		}
+		CellSpec spec;
+		spec.type = IdString(std::string("\\") + object["cell"].string_value());
+		for (auto &key : input_keys) {
+			if (object[key].is_array()) {
+				for (auto &pin : object[key].array_items()) {
+					spec.inputs.push_back(IdString(std::string("\\") + pin.string_value()));
+				}
+			} else {
+				spec.inputs.push_back(IdString(std::string("\\") + object[key].string_value()));
+			}
+		}
+		spec.output = IdString(std::string("\\") + object[output_key].string_value());
+		return spec;
+	}
+
+	Cell *add_cell(Module *module, const std::string &name, const CellSpec &spec)
+	{
+		auto cell = module->addCell(IdString(std::string("\\") + name), spec.type);
+		cell->set_bool_attribute(ID(difetto_compression), true);
+		cell->set_bool_attribute(ID(keep), true);
+		return cell;
+	}
+
+	// Returns the XOR of the bits using a balanced tree of two-input XOR cells.
+	SigBit add_xor_tree(Module *module, const std::string &prefix, int &counter, vector<SigBit> bits, const CellSpec &xor_spec)
+	{
+		log_assert(!bits.empty());
+		while (bits.size() > 1) {
+			vector<SigBit> next;
+			for (size_t i = 0; i + 1 < bits.size(); i += 2) {
+				auto cell = add_cell(module, stringf("%s_xor_%d", prefix.c_str(), counter++), xor_spec);
+				auto output = module->addWire(NEW_ID);
+				cell->setPort(xor_spec.inputs[0], bits[i]);
+				cell->setPort(xor_spec.inputs[1], bits[i + 1]);
+				cell->setPort(xor_spec.output, output);
+				next.push_back(output);
+			}
+			if (bits.size() % 2) {
+				next.push_back(bits.back());
+			}
+			bits = next;
+		}
+		return bits[0];
+	}
+
+	SigBit resolve_port(Module *module, const std::string &name, bool output)
+	{
+		IdString id;
+		Wire *wire = nullptr;
+		bool inverted;
+		resolve_wire(name, module, id, wire, inverted);
+		if (inverted) {
+			log_error("Scan channel %s cannot be inverted.\n", name.c_str());
+		}
+		if (wire->width != 1) {
+			log_error("Scan channel %s must be one bit wide.\n", log_id(id));
+		}
+		if (output ? !wire->port_output : !wire->port_input) {
+			log_error("Scan channel %s must be an %s port of %s.\n", log_id(id), output ? "output" : "input", log_id(module));
+		}
+		return SigBit(wire);
+	}
+
+	virtual void execute(std::vector<std::string> args, Design *design) override
+	{
+		log_header(design, "Executing SCAN_COMPRESS pass.\n");
+		log_push();
+		auto parsed_args = parse_args(args, design);
+
+		std::string mapping_json = parsed_args["json_mapping"].at(0);
+		std::ifstream f(mapping_json.c_str());
+		if (f.fail())
+			log_error("Cannot open file `%s`\n", mapping_json.c_str());
+		std::stringstream buf;
+		buf << f.rdbuf();
+		std::string err;
+		json11::Json json = json11::Json::parse(buf.str(), err);
+		if (!err.empty())
+			log_error("Failed to parse `%s`: %s\n", mapping_json.c_str(), err.c_str());
+		auto &cells = json["compression"];
+		auto buffer_spec = cell_spec(cells, "buffer", {"input"}, "output");
+		auto xor_spec = cell_spec(cells, "xor", {"inputs"}, "output");
+		auto flipflop_spec = cell_spec(cells, "flipflop", {"clock", "data"}, "output");
+		if (xor_spec.inputs.size() != 2) {
+			log_error("The compression XOR cell must have exactly two inputs.\n");
+		}
+
+		auto modules = design->selected_modules();
+		if (modules.size() != 1) {
+			log_cmd_error("Exactly one module must be selected, %zu are.\n", modules.size());
+		}
+		auto module = modules[0];
+
+		auto &scan_ins = parsed_args["scan_in"];
+		auto &scan_outs = parsed_args["scan_out"];
+		if (scan_ins.size() != scan_outs.size()) {
+			log_cmd_error("%zu scan-in channels were given, but %zu scan-out channels.\n", scan_ins.size(), scan_outs.size());
+		}
+		int channels = GetSize(scan_ins);
+		int chains = std::stoi(parsed_args["chains"].at(0));
+		int stages = std::max(8, channels);
+		if (parsed_args.count("stages")) {
+			stages = std::stoi(parsed_args["stages"].at(0));
+		}
+		if (chains < channels) {
+			log_cmd_error("There must be at least as many chains (%d) as channels (%d).\n", chains, channels);
+		}
+		if (stages < channels) {
+			log_cmd_error("There must be at least as many stages (%d) as channels (%d).\n", stages, channels);
+		}
+
+		IdString clock_id;
+		Wire *clock_wire = nullptr;
+		bool clock_negedge = false;
+		resolve_wire(parsed_args["clock"].at(0), module, clock_id, clock_wire, clock_negedge);
+		if (clock_negedge) {
+			log_error("Negative-edge test clocks are not supported by the decompressor.\n");
+		}
+
+		vector<SigBit> channel_ins, channel_outs;
+		for (auto &name : scan_ins) {
+			channel_ins.push_back(resolve_port(module, name, false));
+		}
+		for (auto &name : scan_outs) {
+			channel_outs.push_back(resolve_port(module, name, true));
+		}
+
+		// Each channel is injected into one stage, spread evenly over the
+		// register
+		vector<int> injectors;
+		dict<int, vector<SigBit>> injected;
+		for (int k = 0; k < channels; k++) {
+			int stage = k * stages / channels;
+			injectors.push_back(stage);
+			injected[stage].push_back(channel_ins[k]);
+		}
+
+		// Each chain is fed by the XOR of (up to) three distinct stages, with
+		// no two chains fed by the same stages where avoidable. A fixed seed
+		// keeps the structure reproducible.
+		std::mt19937 rng(1);
+		int tap_count = std::min(3, stages);
+		vector<vector<int>> taps;
+		std::set<vector<int>> used;
+		for (int j = 0; j < chains; j++) {
+			vector<int> selected;
+			for (int attempt = 0; attempt < 100; attempt++) {
+				std::set<int> stage_set;
+				while (GetSize(stage_set) < tap_count) {
+					stage_set.insert(int(rng() % stages));
+				}
+				selected = vector<int>(stage_set.begin(), stage_set.end());
+				if (!used.count(selected)) {
+					break;
+				}
+			}
+			used.insert(selected);
+			taps.push_back(selected);
+		}
+
+		int decompressor_xors = 0;
+		vector<SigBit> register_outputs;
+		vector<Cell *> flipflops;
+		for (int s = 0; s < stages; s++) {
+			auto flipflop = add_cell(module, stringf("difetto_decompressor_r_%d", s), flipflop_spec);
+			flipflop->set_bool_attribute(ID(no_scan), true);
+			auto output = module->addWire(NEW_ID);
+			flipflop->setPort(flipflop_spec.inputs[0], clock_wire);
+			flipflop->setPort(flipflop_spec.output, output);
+			flipflops.push_back(flipflop);
+			register_outputs.push_back(output);
+		}
+		for (int s = 0; s < stages; s++) {
+			vector<SigBit> sources;
+			if (s > 0) {
+				sources.push_back(register_outputs[s - 1]);
+			}
+			for (auto bit : injected[s]) {
+				sources.push_back(bit);
+			}
+			flipflops[s]->setPort(flipflop_spec.inputs[1],
+					      add_xor_tree(module, "difetto_decompressor", decompressor_xors, sources, xor_spec));
+		}
+
+		for (int j = 0; j < chains; j++) {
+			vector<SigBit> sources;
+			for (auto stage : taps[j]) {
+				sources.push_back(register_outputs[stage]);
+			}
+			auto anchor = add_cell(module, stringf("difetto_decompressor_si_%d", j), buffer_spec);
+			anchor->setPort(buffer_spec.inputs[0], add_xor_tree(module, "difetto_decompressor", decompressor_xors, sources, xor_spec));
+			anchor->setPort(buffer_spec.output, module->addWire(stringf("\\difetto_si_%d", j)));
+		}
+
+		// Chains are assigned to scan-out channels round-robin
+		int compactor_xors = 0;
+		vector<vector<int>> compactor(channels);
+		vector<vector<SigBit>> compacted(channels);
+		for (int j = 0; j < chains; j++) {
+			auto anchor = add_cell(module, stringf("difetto_compactor_so_%d", j), buffer_spec);
+			auto output = module->addWire(NEW_ID);
+			anchor->setPort(buffer_spec.inputs[0], module->addWire(stringf("\\difetto_so_%d", j)));
+			anchor->setPort(buffer_spec.output, output);
+			compactor[j % channels].push_back(j);
+			compacted[j % channels].push_back(output);
+		}
+		for (int k = 0; k < channels; k++) {
+			module->connect(channel_outs[k], add_xor_tree(module, "difetto_compactor", compactor_xors, compacted[k], xor_spec));
+		}
+
+		log("Inserted a %d-stage decompressor and a compactor for %d chain(s) over %d channel(s).\n", stages, chains, channels);
+
+		if (parsed_args.count("structure")) {
+			json11::Json::array injector_list, tap_list, compactor_list;
+			for (auto stage : injectors) {
+				injector_list.push_back(json11::Json::array{stage});
+			}
+			for (auto &chain_taps : taps) {
+				tap_list.push_back(json11::Json::array(chain_taps.begin(), chain_taps.end()));
+			}
+			for (auto &channel_chains : compactor) {
+				compactor_list.push_back(json11::Json::array(channel_chains.begin(), channel_chains.end()));
+			}
+			auto buffer_input = buffer_spec.inputs[0].str().substr(1);
+			auto buffer_output = buffer_spec.output.str().substr(1);
+			json11::Json structure = json11::Json::object{
+			  {"channels", channels},
+			  {"stages", stages},
+			  {"injectors", injector_list},
+			  {"taps", tap_list},
+			  {"compactor", compactor_list},
+			  {"scan_in", json11::Json::array(scan_ins.begin(), scan_ins.end())},
+			  {"scan_out", json11::Json::array(scan_outs.begin(), scan_outs.end())},
+			  {"chain_scan_in_pattern", "difetto_decompressor_si_{}/" + buffer_output},
+			  {"chain_scan_out_pattern", "difetto_compactor_so_{}/" + buffer_input},
+			};
+			auto structure_path = parsed_args["structure"].at(0);
+			std::ofstream out(structure_path);
+			if (out.fail()) {
+				log_error("Could not open %s for writing.\n", structure_path.c_str());
+			}
+			out << structure.dump() << "\n";
+		}
+
+		log_pop();
+	}
+} ScanCompressPass;
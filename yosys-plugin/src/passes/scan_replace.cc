@@ -2,8 +2,11 @@
 // Copyright (c) 2025 Mohamed Gaber
 #include "difetto_pass.h"
 #include "json11.hpp"
-#include "kernel/modtools.h"
+#include "kernel/celltypes.h"
+#include "kernel/sigtools.h"
+#include <chrono>
 #include <fstream>
+#include <sys/resource.h>
 
 USING_YOSYS_NAMESPACE
 
@@ -11,7 +14,11 @@ struct ScanReplacePass : public DifettoPass {
 	ScanReplacePass() : DifettoPass("scan_replace", "replaces flip-flops with scannable flip-flops") {}
 
 	const dict<std::string, Arg> args = {{"liberty", Arg{"Liberty files containing replacement scan cells.", "filename", false, true}},
-					     {"json_mapping", Arg{"The JSON mapping file.", "filename"}}};
+					     {"json_mapping", Arg{"The JSON mapping file.", "filename"}},
+					     {"cache_dir", Arg{"Directory of modules transformed by previous runs, keyed by a hash of their "
+							       "structure and this pass's arguments. Unchanged modules are restored from it "
+							       "instead of being processed again.",
+							       "directory"}}};
 	const std::string description = "Replaces standard flip-flops with scannable"
 					"flip-flops. The scannable flip-flops can either be obtained from a "
 					"liberty "
@@ -27,52 +34,85 @@ struct ScanReplacePass : public DifettoPass {
 	virtual const dict<std::string, Arg> &get_args() override { return args; }
 	virtual std::string_view get_description() override { return description; }
 
-	void scan_replace(Module *module, dict<IdString, IdString> &mapping)
+	// Returns the number of flip-flops replaced.
+	int scan_replace(Module *module, const dict<IdString, IdString> &mapping, const CellTypes &ct)
 	{
 		if (module->has_attribute(ID(no_scan))) {
 			if (module->get_bool_attribute(ID(no_scan))) {
-				return;
+				return 0;
 			}
 		}
 
-		ModWalker mw(module->design, module);
-
-		for (auto pair : module->cells_) {
-			auto cell = pair.second;
-			auto counterpart = mapping[cell->type];
-			if (counterpart.empty()) {
-				continue;
+		// Index candidate flip-flops by type first: most cells in a mapped
+		// netlist are combinational and need no further inspection.
+		dict<IdString, vector<Cell *>> candidates;
+		for (auto cell : module->cells()) {
+			if (mapping.count(cell->type)) {
+				candidates[cell->type].push_back(cell);
 			}
+		}
+		if (candidates.empty()) {
+			log_debug("Skipping %s (no mappable flip-flops)...\n", log_id(module));
+			return 0;
+		}
 
-			// check if cell proper (if declared) has no_scan
-			if (cell->get_bool_attribute(ID(no_scan))) {
-				log("Skipping %s (cell has no_scan "
-				    "attribute)...\n",
-				    pair.first.c_str());
+		// no_scan wires by net, so a wire aliasing a flip-flop's output (e.g.
+		// through an assign) counts as much as the wire on the port itself
+		SigMap sigmap;
+		pool<SigBit> no_scan_bits;
+		for (auto wire : module->wires()) {
+			if (!wire->get_bool_attribute(ID(no_scan))) {
 				continue;
 			}
-
-			// check if any outputs have no_scan
-			auto output_bits = mw.cell_outputs[cell];
-			bool no_scan_found = false;
-			for (auto bit : output_bits) {
-				auto wire = bit.wire;
-				if (wire->get_bool_attribute(ID(no_scan))) {
-					no_scan_found = true;
-					break;
-				}
+			if (no_scan_bits.empty()) {
+				sigmap.set(module);
 			}
-			if (no_scan_found) {
-				log("Skipping %s (connected to no_scan "
-				    "output)...\n",
-				    pair.first.c_str());
-				continue;
+			for (auto bit : sigmap(wire)) {
+				no_scan_bits.insert(bit);
 			}
+		}
+
+		int replaced = 0;
+		for (auto &[type, cells] : candidates) {
+			auto scannable = mapping.at(type);
+			for (auto cell : cells) {
+				// check if cell proper (if declared) has no_scan
+				if (cell->get_bool_attribute(ID(no_scan))) {
+					log("Skipping %s (cell has no_scan "
+					    "attribute)...\n",
+					    cell->name.c_str());
+					continue;
+				}
 
-			auto scannable = mapping[cell->type];
-			log("%s: %s -> %s\n", pair.first.c_str(), cell->type.c_str(), scannable.c_str());
-			cell->type = scannable;
+				// check if any outputs have no_scan
+				bool no_scan_found = false;
+				for (auto &[port, sig] : cell->connections()) {
+					if (no_scan_bits.empty() || !ct.cell_output(type, port)) {
+						continue;
+					}
+					for (auto bit : sigmap(sig)) {
+						if (no_scan_bits.count(bit)) {
+							no_scan_found = true;
+							break;
+						}
+					}
+					if (no_scan_found) {
+						break;
+					}
+				}
+				if (no_scan_found) {
+					log("Skipping %s (connected to no_scan "
+					    "output)...\n",
+					    cell->name.c_str());
+					continue;
+				}
+
+				log("%s: %s -> %s\n", cell->name.c_str(), type.c_str(), scannable.c_str());
+				cell->type = scannable;
+				replaced += 1;
+			}
 		}
+		return replaced;
 	}
 
 	virtual void execute(std::vector<std::string> args, Design *design) override
@@ -117,8 +157,34 @@ struct ScanReplacePass : public DifettoPass {
 			mapping[IdString(std::string("\\") + pair.first)] = IdString(std::string("\\") + pair.second.string_value());
 		}
 
+		auto start = std::chrono::steady_clock::now();
+
+		// Same cell port directions ModWalker would use, built once for the
+		// whole design rather than per module
+		CellTypes ct(design);
+
+		std::string cache_dir = parsed_args.count("cache_dir") ? parsed_args["cache_dir"].at(0) : "";
+		int reused_count = 0;
+		int replaced_count = 0;
 		for (auto module : design->selected_modules()) {
-			scan_replace(module, mapping);
+			bool reused;
+			transform_cached(
+			  design, module, cache_dir, buf.str(), [&](Module *module) { replaced_count += scan_replace(module, mapping, ct); },
+			  reused);
+			reused_count += reused;
 		}
+		if (!cache_dir.empty()) {
+			log("Reused %d cached module(s).\n", reused_count);
+		}
+
+		std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+		struct rusage usage;
+		getrusage(RUSAGE_SELF, &usage);
+		log("Replaced %d flip-flop(s) in %.3fs (peak RSS: %.1f MiB).\n", replaced_count, elapsed.count(), usage.ru_maxrss / 1024.0);
+		// in the same form as the metrics of the Python scripts, which collect
+		// them from the log
+		log("%%OL_METRIC_F difetto__runtime__scan_replace__pass %.6f\n", elapsed.count());
+		log("%%OL_METRIC_I difetto__memory__scan_replace__pass %lld\n", (long long)usage.ru_maxrss * 1024);
+		log("%%OL_METRIC_I difetto__scan_replace__replaced_count %d\n", replaced_count);
 	}
 } ScanReplacePass;
@@ -26,6 +26,18 @@ struct SDFFCutPass : public DifettoPass {
 			     "for the purposes of the cut netlist unless prefixed with !, "
 			     "which will be coerced high.",
 			     "io", false, true}},
+	  {"hierarchical", Arg{"Do not flatten the design. Each unique module at or under the selection is cut "
+			       "exactly once and the pseudo-ports of its flip-flops are punched up through every "
+			       "instance, so the top-level ports match those of a flattened cut netlist."}},
+	  {"instance_map", Arg{"Write a JSON map of every module with pseudo-ports, its pseudo-ports and its "
+			       "instances of other such modules to this file. Requires -hierarchical.",
+			       "filename"}},
+	  {"module_dir", Arg{"Write each module with pseudo-ports to its own netlist in this directory. "
+			     "Requires -hierarchical.",
+			     "directory"}},
+	  {"cache_dir", Arg{"Directory of modules transformed by previous runs, keyed by a hash of their structure and "
+			    "this pass's arguments. Unchanged modules are restored from it instead of being processed again.",
+			    "directory"}},
 	};
 	const std::string description = "From a netlist with scannable flipflops, "
 					"this pass creates a so-called cutaway netlist for automatic test "
@@ -40,31 +52,44 @@ struct SDFFCutPass : public DifettoPass {
 					"note "
 					"that you should not pass this input on to PnR and you should pass "
 					"the true"
-					"netlist instead.";
+					"netlist instead.\n \n"
+					"With -hierarchical, the design is not flattened: modules are cut "
+					"bottom-up, once per module rather than once per instance, which "
+					"keeps memory proportional to the unique logic in the design.";
 
 	virtual const dict<std::string, Arg> &get_args() override { return args; }
 	virtual std::string_view get_description() override { return description; }
 
+	// Pseudo-ports of every module that has them, in creation order
+	dict<IdString, vector<IdString>> pseudo_ports;
+
+	static bool is_bsr(Module *module, IdString name)
+	{
+		return (module->has_attribute(ID(hdlname)) && module->get_string_attribute(ID(hdlname)) == name.str().substr(1)) ||
+		       module->name == name;
+	}
+
 	void sdff_cut(Design *design, Module *module, std::string test_mode_wire_name_raw, std::string clock_wire_name_raw,
-		      const dict<IdString, bool> &exclusions, pool<IdString> &scan_flops)
+		      const dict<IdString, bool> &exclusions, pool<IdString> &scan_flops, bool hierarchical, bool resolve_pins)
 	{
 		if (module->has_attribute(ID(no_boundary_scan))) {
 			if (module->get_bool_attribute(ID(no_boundary_scan))) {
 				return;
 			}
 		}
-		ModWalker mw(module->design, module);
 
 		// Resolve target wires
-		IdString test_mode_wire_id;
-		Wire *test_mode_wire = nullptr;
-		bool test_inverted = false;
-		resolve_wire(test_mode_wire_name_raw, module, test_mode_wire_id, test_mode_wire, test_inverted);
+		if (resolve_pins) {
+			IdString test_mode_wire_id;
+			Wire *test_mode_wire = nullptr;
+			bool test_inverted = false;
+			resolve_wire(test_mode_wire_name_raw, module, test_mode_wire_id, test_mode_wire, test_inverted);
 
-		IdString clock_wire_id;
-		Wire *clock_wire = nullptr;
-		bool clock_negedge = false;
-		resolve_wire(clock_wire_name_raw, module, clock_wire_id, clock_wire, clock_negedge);
+			IdString clock_wire_id;
+			Wire *clock_wire = nullptr;
+			bool clock_negedge = false;
+			resolve_wire(clock_wire_name_raw, module, clock_wire_id, clock_wire, clock_negedge);
+		}
 
 		// Collect and destroy excluded IOs
 		vector<Wire *> inputs, outputs;
@@ -96,29 +121,59 @@ struct SDFFCutPass : public DifettoPass {
 		module->fixup_ports();
 
 		// Handle BSRs
+		vector<Cell *> shorted;
 		for (auto [id, cell] : module->cells_) {
 			if (!design->modules_.count(cell->type)) {
 				continue;
 			}
 			auto target_module = design->modules_[cell->type];
-			if ((target_module->has_attribute(ID(hdlname)) && target_module->get_string_attribute(ID(hdlname)) == "_difetto_ibsr") ||
-			    target_module->name == ID(_difetto_ibsr)) {
+			if (is_bsr(target_module, ID(_difetto_ibsr))) {
 				log("identified difetto input bsr %s, shorting "
 				    "D to Q...\n",
 				    cell->name.c_str());
+				if (hierarchical) {
+					shorted.push_back(cell);
+					continue;
+				}
 				cell->setParam(ID(WIDTH), cell->getPort(ID(D)).bits().size());
 				cell->type = ID(_difetto_ibsr_dummy);
 			}
-			if ((target_module->has_attribute(ID(hdlname)) && target_module->get_string_attribute(ID(hdlname)) == "_difetto_obsr") ||
-			    target_module->name == ID(_difetto_obsr)) {
+			if (is_bsr(target_module, ID(_difetto_obsr))) {
 				log("identified difetto output bsr %s, shorting "
 				    "D to Q...\n",
 				    cell->name.c_str());
+				if (hierarchical) {
+					shorted.push_back(cell);
+					continue;
+				}
 				cell->setParam(ID(WIDTH), cell->getPort(ID(D)).bits().size());
 				cell->type = ID(_difetto_obsr_dummy);
 			}
 		}
 
+		// Without a flatten to inline the dummies, short them in place
+		for (auto cell : shorted) {
+			if (cell->hasPort(ID(Q))) {
+				module->connect(cell->getPort(ID(Q)), cell->getPort(ID(D)));
+			}
+			module->remove(cell);
+		}
+
+		// Drop scan compression logic, which only feeds and observes the scan
+		// chains
+		vector<Cell *> compression;
+		for (auto cell : module->cells()) {
+			if (cell->get_bool_attribute(ID(difetto_compression))) {
+				compression.push_back(cell);
+			}
+		}
+		for (auto cell : compression) {
+			module->remove(cell);
+		}
+		if (!compression.empty()) {
+			log("Removed %zu scan compression cell(s).\n", compression.size());
+		}
+
 		// Cut remaining scanflops
 		vector<Cell *> marked;
 		for (auto pair : module->cells_) {
@@ -138,6 +193,8 @@ struct SDFFCutPass : public DifettoPass {
 			d_port->port_output = true;
 			module->connect(d_port, d_spec);
 			module->connect(q_spec, q_port);
+			pseudo_ports[module->name].push_back(q);
+			pseudo_ports[module->name].push_back(d);
 		}
 
 		for (auto cell : marked) {
@@ -147,6 +204,101 @@ struct SDFFCutPass : public DifettoPass {
 		module->fixup_ports();
 	}
 
+	void collect_postorder(Design *design, Module *module, pool<Module *> &visited, vector<Module *> &order)
+	{
+		if (visited.count(module)) {
+			return;
+		}
+		visited.insert(module);
+		for (auto cell : module->cells()) {
+			auto child = design->module(cell->type);
+			if (child == nullptr || child->get_blackbox_attribute()) {
+				continue;
+			}
+			collect_postorder(design, child, visited, order);
+		}
+		order.push_back(module);
+	}
+
+	void punch_pseudo_ports(Design *design, Module *module)
+	{
+		bool punched_any = false;
+		for (auto cell : module->cells()) {
+			auto found = pseudo_ports.find(cell->type);
+			if (found == pseudo_ports.end()) {
+				continue;
+			}
+			auto child = design->module(cell->type);
+			// copy: pseudo_ports may be rehashed when this module's entry is created
+			auto child_ports = found->second;
+			for (auto port : child_ports) {
+				auto child_wire = child->wire(port);
+				// same naming as flatten, so hierarchical and flat cuts share port names
+				IdString punched(cell->name.str() + "." + RTLIL::unescape_id(port));
+				Wire *wire = module->addWire(punched, 1);
+				wire->port_input = child_wire->port_input;
+				wire->port_output = child_wire->port_output;
+				cell->setPort(port, wire);
+				pseudo_ports[module->name].push_back(punched);
+				punched_any = true;
+			}
+		}
+		if (punched_any) {
+			module->fixup_ports();
+		}
+	}
+
+	void write_instance_map(Design *design, const std::string &filename)
+	{
+		json11::Json::object modules;
+		for (auto &[module_name, ports] : pseudo_ports) {
+			auto module = design->module(module_name);
+			json11::Json::array port_names;
+			for (auto port : ports) {
+				port_names.push_back(RTLIL::unescape_id(port));
+			}
+			json11::Json::object instances;
+			for (auto cell : module->cells()) {
+				if (pseudo_ports.count(cell->type)) {
+					instances[RTLIL::unescape_id(cell->name)] = RTLIL::unescape_id(cell->type);
+				}
+			}
+			modules[RTLIL::unescape_id(module_name)] = json11::Json::object{
+			  {"pseudo_ports", port_names},
+			  {"instances", instances},
+			};
+		}
+		auto top = design->top_module();
+		json11::Json map = json11::Json::object{
+		  {"top", top ? RTLIL::unescape_id(top->name) : ""},
+		  {"modules", modules},
+		};
+
+		std::ofstream f(filename);
+		if (f.fail()) {
+			log_error("Could not open `%s' for writing.\n", filename.c_str());
+		}
+		f << map.dump() << std::endl;
+	}
+
+	void write_module_netlists(Design *design, const std::string &directory)
+	{
+		std::filesystem::path module_dir(directory);
+		if (!std::filesystem::exists(module_dir) && !std::filesystem::create_directories(module_dir)) {
+			log_error("Could not create directory: %s\n", module_dir.c_str());
+		}
+		for (auto &[module_name, _] : pseudo_ports) {
+			auto filename = RTLIL::unescape_id(module_name);
+			for (auto &c : filename) {
+				if (!isalnum(c) && c != '_' && c != '.') {
+					c = '_';
+				}
+			}
+			auto path = module_dir / (filename + ".v");
+			Pass::call_on_module(design, design->module(module_name), {"write_verilog", "-selected", "-noexpr", path.string()});
+		}
+	}
+
 	virtual void execute(std::vector<std::string> args, Design *design) override
 	{
 
@@ -205,12 +357,128 @@ struct SDFFCutPass : public DifettoPass {
 			load_ibsr_definitions(design);
 		}
 
+		pseudo_ports.clear();
+		bool hierarchical = parsed_args.count("hierarchical");
+		std::string cache_dir = parsed_args.count("cache_dir") ? parsed_args["cache_dir"].at(0) : "";
+		std::string salt = stringf("%s %s %s %s", buf.str().c_str(), test_mode_wire_name.c_str(), clock_wire_name.c_str(),
+					   hierarchical ? "hierarchical" : "flat");
+		for (auto &[id, inverted] : exclusions) {
+			salt += stringf(" %s%s", inverted ? "!" : "", id.c_str());
+		}
+		int reused_count = 0;
+
+		if (!hierarchical) {
+			if (parsed_args.count("instance_map") || parsed_args.count("module_dir")) {
+				log_cmd_error("`-instance_map' and `-module_dir' require `-hierarchical'.\n");
+			}
+			for (auto module : design->selected_modules()) {
+				bool reused;
+				transform_cached(
+				  design, module, cache_dir, salt,
+				  [&](Module *module) {
+					  sdff_cut(design, module, test_mode_wire_name, clock_wire_name, exclusions, scanflops, false, true);
+				  },
+				  reused);
+				reused_count += reused;
+			}
+			if (!cache_dir.empty()) {
+				log("Reused %d cached module(s).\n", reused_count);
+			}
+
+			Pass::call(design, "hierarchy");
+			Pass::call(design, "flatten");
+			log_pop();
+			return;
+		}
+
+		// Children before parents: a module's pseudo-ports must exist before
+		// they can be punched through its instances.
+		pool<Module *> selected;
+		pool<Module *> visited;
+		vector<Module *> to_cut;
+		pool<IdString> cut_modules;
 		for (auto module : design->selected_modules()) {
-			sdff_cut(design, module, test_mode_wire_name, clock_wire_name, exclusions, scanflops);
+			selected.insert(module);
+			collect_postorder(design, module, visited, to_cut);
 		}
+		for (auto module : to_cut) {
+			if (is_bsr(module, ID(_difetto_ibsr)) || is_bsr(module, ID(_difetto_obsr))) {
+				continue;
+			}
+			// IO exclusions and test pins only apply to the selected (top) modules
+			bool is_top = selected.count(module);
 
-		Pass::call(design, "hierarchy");
-		Pass::call(design, "flatten");
+			// a module's result also depends on the pseudo-ports punched
+			// through it from its children
+			std::string module_salt = salt + (is_top ? " top" : "");
+			pool<IdString> child_types;
+			for (auto cell : module->cells()) {
+				if (pseudo_ports.count(cell->type)) {
+					child_types.insert(cell->type);
+				}
+			}
+			child_types.sort();
+			for (auto type : child_types) {
+				module_salt += stringf("\n%s:", type.c_str());
+				for (auto port : pseudo_ports.at(type)) {
+					module_salt += stringf(" %s", port.c_str());
+				}
+			}
+
+			bool reused;
+			module = transform_cached(
+			  design, module, cache_dir, module_salt,
+			  [&](Module *module) {
+				  sdff_cut(design, module, test_mode_wire_name, clock_wire_name,
+					   is_top ? exclusions : dict<IdString, bool>{}, scanflops, true, is_top);
+				  punch_pseudo_ports(design, module);
+				  // kept in the cache entry in creation order: parents key
+				  // their own entries on this order, which the ports of a
+				  // module read back from the cache need not follow
+				  auto found = pseudo_ports.find(module->name);
+				  if (found != pseudo_ports.end()) {
+					  std::string names;
+					  for (auto port : found->second) {
+						  names += stringf("%s%s", names.empty() ? "" : " ", port.c_str());
+					  }
+					  module->set_string_attribute(ID(difetto_pseudo_ports), names);
+				  }
+			  },
+			  reused);
+			if (reused) {
+				for (auto &name : split_tokens(module->get_string_attribute(ID(difetto_pseudo_ports)))) {
+					pseudo_ports[module->name].push_back(IdString(name));
+				}
+			}
+			module->attributes.erase(ID(difetto_pseudo_ports));
+			reused_count += reused;
+			cut_modules.insert(module->name);
+		}
+		if (!cache_dir.empty()) {
+			log("Reused %d cached module(s).\n", reused_count);
+		}
+
+		// Carry pseudo-ports up to the design top, through unselected parents.
+		// (by name: modules restored from the cache are new objects)
+		vector<Module *> all_modules;
+		visited.clear();
+		for (auto module : design->modules()) {
+			if (!module->get_blackbox_attribute()) {
+				collect_postorder(design, module, visited, all_modules);
+			}
+		}
+		for (auto module : all_modules) {
+			if (!cut_modules.count(module->name)) {
+				punch_pseudo_ports(design, module);
+			}
+		}
+
+		if (parsed_args.count("instance_map")) {
+			write_instance_map(design, parsed_args["instance_map"].at(0));
+		}
+		if (parsed_args.count("module_dir")) {
+			write_module_netlists(design, parsed_args["module_dir"].at(0));
+		}
 		log_pop();
 	}
 } SDFFCutPass;
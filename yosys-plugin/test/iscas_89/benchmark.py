@@ -0,0 +1,357 @@
+"""
+Benchmarks the Difetto flow (fixup, synthesis with boundary scan and scan
+replacement, cut, nl2bench and Quaigh ATPG) over the ISCAS-89 designs.
+
+Designs run in parallel, each stage recording its wall time and peak RSS.
+Along with cell counts, pattern counts and coverage, they are written to
+``out/benchmark.json`` and ``out/benchmark.csv``, then compared against the
+baseline report in ``baseline.json`` if it exists (or the one given with
+``--baseline``, which must): any metric worse than its baseline beyond its
+tolerance is a regression, as is a design without a baseline, and the script
+exits with a non-zero status. Without a baseline, only failures are.
+
+    python3 benchmark.py [-j JOBS] [--baseline baseline.json] [design.v …]
+    python3 benchmark.py --update-baseline [--with-resources]
+
+The baseline only records the metrics that do not depend on the machine
+(cell counts, pattern counts and coverage) unless ``--with-resources`` is
+given, in which case wall times and peak RSS are recorded (and compared) too.
+
+Tolerances are given per kind of metric (the part of its name after the
+last dot) as ``KIND=RELATIVE[:ABSOLUTE]``, e.g. ``--tolerance wall_time=0.5:2``
+allows stages to take 50% or 2s longer than the baseline, whichever is more.
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import argparse
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+cwd = Path(__file__).resolve().parent
+test_root = cwd.parent
+
+STAGES = ["fixup", "synth", "cut", "bench", "atpg"]
+
+
+@dataclass
+class Tolerance:
+    relative: float
+    absolute: float = 0
+    higher_is_better: bool = False
+
+    def allowed(self, baseline: float) -> float:
+        return max(abs(baseline) * self.relative, self.absolute)
+
+    def regressed(self, baseline: float, current: float) -> bool:
+        change = baseline - current if self.higher_is_better else current - baseline
+        return change > self.allowed(baseline)
+
+
+DEFAULT_TOLERANCES = {
+    "wall_time": Tolerance(0.5, 1.0),
+    "peak_rss": Tolerance(0.2, 16 * 1024 * 1024),
+    "cells": Tolerance(0.02),
+    "patterns": Tolerance(0.1, 2),
+    "coverage": Tolerance(0, 0.5, higher_is_better=True),
+}
+
+# kinds of metrics only comparable between runs on the same machine
+RESOURCE_KINDS = ["wall_time", "peak_rss"]
+
+
+def get_env(test: str) -> Dict[str, str]:
+    env = os.environ.copy()
+    env.setdefault("DIFETTO_SO", str(test_root.parent / "difetto.so"))
+    env["TECH_DIR"] = str(test_root / "tech")
+    env["TEST"] = test
+    return env
+
+
+def stage_command(test: str, stage: str) -> List[str]:
+    out_dir = cwd / "out" / test
+    commands = {
+        "fixup": ["yosys", "-y", "fix_vdd_gnd_inputs.py", "--", test],
+        "synth": ["yosys", "-c", cwd / "synth.tcl"],
+        "cut": ["yosys", "-c", cwd / "cut.tcl"],
+        "bench": [
+            "nl2bench",
+            "-l",
+            test_root / "tech" / "sky130" / "sky130_fd_sc_hd__tt_025C_1v80.lib",
+            "--msb-first",
+            "-o",
+            out_dir / "design.bench",
+            out_dir / "cut.v",
+        ],
+        "atpg": [
+            "quaigh",
+            "atpg",
+            "-o",
+            out_dir / "raw_tvs.txt",
+            out_dir / "design.bench",
+        ],
+    }
+    return [str(e) for e in commands[stage]]
+
+
+@dataclass
+class StageResult:
+    log_path: Path
+    wall_time: float
+    peak_rss: int
+
+
+def run_stage(test: str, stage: str) -> StageResult:
+    """
+    Runs a stage of the flow for a design, logging to ``out/<design>/<stage>.log``.
+
+    :raises subprocess.CalledProcessError: If the stage fails.
+    """
+    out_log_path = cwd / "out" / test / f"{stage}.log"
+    Path(cwd / "out" / test).mkdir(parents=True, exist_ok=True)
+    cmd = stage_command(test, stage)
+    with open(out_log_path, "w", encoding="utf8") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            env=get_env(test),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        # wait4 rather than wait: the resource usage of this child alone,
+        # even with other stages running in parallel
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    # ru_maxrss is in KiB on Linux
+    return StageResult(out_log_path, wall_time, usage.ru_maxrss * 1024)
+
+
+def read_cell_count(stat_json: Path) -> int:
+    with open(stat_json, encoding="utf8") as f:
+        stat = json.load(f)
+    if "design" in stat:
+        return stat["design"]["num_cells"]
+    return sum(module["num_cells"] for module in stat["modules"].values())
+
+
+def read_pattern_count(raw_tvs: Path) -> int:
+    comment_rx = re.compile(r"\*.+$")
+    count = 0
+    with open(raw_tvs, encoding="utf8") as f:
+        for line in f:
+            count += comment_rx.sub("", line).strip() != ""
+    return count
+
+
+coverage_rx = re.compile(r"([\d.]+)% coverage")
+
+
+def read_coverage(atpg_log: Path) -> Optional[float]:
+    match = coverage_rx.search(open(atpg_log, encoding="utf8").read())
+    return None if match is None else float(match[1])
+
+
+def run_design(test: str) -> Dict[str, Any]:
+    """
+    Runs every stage of the flow for a design.
+
+    :returns: The metrics of the design, keyed ``<stage>.<kind>``.
+    """
+    out_dir = cwd / "out" / test
+    metrics: Dict[str, Any] = {}
+    for stage in STAGES:
+        result = run_stage(test, stage)
+        metrics[f"{stage}.wall_time"] = round(result.wall_time, 3)
+        metrics[f"{stage}.peak_rss"] = result.peak_rss
+    metrics["synth.cells"] = read_cell_count(out_dir / "synth.stat.json")
+    metrics["cut.cells"] = read_cell_count(out_dir / "cut.stat.json")
+    metrics["atpg.patterns"] = read_pattern_count(out_dir / "raw_tvs.txt")
+    metrics["atpg.coverage"] = read_coverage(out_dir / "atpg.log")
+    return metrics
+
+
+def write_report(report: Dict[str, Dict[str, Any]], json_path: Path, csv_path: Path):
+    with open(json_path, "w", encoding="utf8") as f:
+        json.dump({"designs": report}, f, indent=2, sort_keys=True)
+    columns = sorted({metric for metrics in report.values() for metric in metrics})
+    with open(csv_path, "w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["design"] + columns)
+        for design, metrics in sorted(report.items()):
+            writer.writerow([design] + [metrics.get(column, "") for column in columns])
+
+
+def compare(
+    report: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Dict[str, Any]],
+    tolerances: Dict[str, Tolerance],
+) -> List[str]:
+    """
+    :returns: A description of every regression against the baseline.
+    """
+    regressions = []
+    for design, metrics in sorted(report.items()):
+        if "error" in metrics:
+            regressions.append(f"{design}: {metrics['error']}")
+            continue
+        if design not in baseline:
+            regressions.append(f"{design}: no baseline")
+            continue
+        for metric, current in sorted(metrics.items()):
+            expected = baseline[design].get(metric)
+            tolerance = tolerances.get(metric.rsplit(".", 1)[-1])
+            if tolerance is None or expected is None:
+                continue
+            if current is None:
+                regressions.append(f"{design}: {metric} missing (baseline: {expected})")
+            elif tolerance.regressed(expected, current):
+                regressions.append(
+                    f"{design}: {metric} {current} vs. baseline {expected} (tolerance: {tolerance.allowed(expected):g})"
+                )
+    return regressions
+
+
+def parse_tolerance(value: str) -> tuple:
+    kind, _, amounts = value.partition("=")
+    relative, _, absolute = amounts.partition(":")
+    if kind not in DEFAULT_TOLERANCES or relative == "":
+        raise argparse.ArgumentTypeError(
+            f"expected KIND=RELATIVE[:ABSOLUTE] with KIND one of {', '.join(DEFAULT_TOLERANCES)}"
+        )
+    default = DEFAULT_TOLERANCES[kind]
+    return kind, Tolerance(
+        float(relative),
+        float(absolute) if absolute else default.absolute,
+        default.higher_is_better,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "designs", nargs="*", help="Designs in rtl/ to run (default: all)"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Designs to run in parallel",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="The baseline report to compare against (default: baseline.json, if it exists)",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Write the results to the baseline instead of comparing against it",
+    )
+    parser.add_argument(
+        "--with-resources",
+        action="store_true",
+        help="Also write wall times and peak RSS to the baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=parse_tolerance,
+        action="append",
+        default=[],
+        metavar="KIND=RELATIVE[:ABSOLUTE]",
+        help="Overrides the tolerance of a kind of metric",
+    )
+    args = parser.parse_args()
+
+    baseline_given = args.baseline is not None
+    if not baseline_given:
+        args.baseline = cwd / "baseline.json"
+    elif not (args.update_baseline or args.baseline.exists()):
+        print(
+            f"No baseline at '{args.baseline}': create one with --update-baseline.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    designs = args.designs or sorted(
+        os.path.basename(e) for e in (cwd / "rtl").glob("*.v")
+    )
+    tolerances = {**DEFAULT_TOLERANCES, **dict(args.tolerance)}
+
+    report: Dict[str, Dict[str, Any]] = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(run_design, design): design for design in designs}
+        for future in as_completed(futures):
+            design = futures[future]
+            try:
+                report[design] = future.result()
+                print(
+                    f"{design}: done in {sum(v for k, v in report[design].items() if k.endswith('.wall_time')):.2f}s."
+                )
+            except (subprocess.CalledProcessError, OSError) as e:
+                report[design] = {"error": str(e)}
+                print(f"{design}: {e}", file=sys.stderr)
+    print(f"Ran {len(designs)} design(s) in {time.perf_counter() - start:.2f}s.")
+
+    (cwd / "out").mkdir(exist_ok=True)
+    write_report(report, cwd / "out" / "benchmark.json", cwd / "out" / "benchmark.csv")
+
+    if args.update_baseline:
+        failed = [design for design, metrics in report.items() if "error" in metrics]
+        if failed:
+            print(
+                f"Not updating the baseline: {', '.join(failed)} failed.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        baseline = {}
+        if args.baseline.exists():
+            with open(args.baseline, encoding="utf8") as f:
+                baseline = json.load(f)["designs"]
+        for design, metrics in report.items():
+            baseline[design] = {
+                metric: value
+                for metric, value in metrics.items()
+                if args.with_resources
+                or metric.rsplit(".", 1)[-1] not in RESOURCE_KINDS
+            }
+        with open(args.baseline, "w", encoding="utf8") as f:
+            json.dump({"designs": baseline}, f, indent=2, sort_keys=True)
+        print(f"Updated '{args.baseline}'.")
+        return
+
+    if not args.baseline.exists():
+        print(
+            f"No baseline at '{args.baseline}': not comparing (record one with --update-baseline).",
+            file=sys.stderr,
+        )
+        sys.exit(1 if any("error" in metrics for metrics in report.values()) else 0)
+    with open(args.baseline, encoding="utf8") as f:
+        baseline = json.load(f)["designs"]
+    regressions = compare(report, baseline, tolerances)
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+    print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,3 +8,4 @@ write_verilog -selected -noexpr ./out/$::env(TEST)/cut_pre_opt.v
 opt_clean -purge
 hilomap -hicell sky130_fd_sc_hd__conb_1 HI -locell sky130_fd_sc_hd__conb_1 LO
 write_verilog -selected -noexpr ./out/$::env(TEST)/cut.v
+tee -q -o ./out/$::env(TEST)/cut.stat.json stat -json
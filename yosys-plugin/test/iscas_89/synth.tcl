@@ -13,3 +13,4 @@ write_verilog -noexpr out/$::env(TEST)/pre_techmap.v
 abc -liberty $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib
 yosys scan_replace -json_mapping $::env(TECH_DIR)/sky130/sky130_mapping.json
 write_verilog -noexpr out/$::env(TEST)/nl.v
+tee -q -o out/$::env(TEST)/synth.stat.json stat -json
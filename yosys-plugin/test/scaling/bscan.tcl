@@ -0,0 +1,10 @@
+file mkdir out
+yosys -import
+yosys plugin -i $::env(DIFETTO_SO)
+read_liberty -ignore_miss_func -lib $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib
+read_verilog out/$::env(TEST)/design.v
+hierarchy -top top
+select top
+yosys boundary_scan -test_mode test -clock clk -exclude_io rstn
+select -clear
+write_rtlil out/$::env(TEST)/bscan.il
@@ -0,0 +1,13 @@
+yosys -import
+plugin -i $::env(DIFETTO_SO)
+read_liberty -ignore_miss_func -lib $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib
+read_verilog -sv ./out/$::env(TEST)/nl.v
+hierarchy -top top
+select top
+yosys sdff_cut -json_mapping $::env(TECH_DIR)/sky130/sky130_mapping.json -test_mode test -clock clk -exclude_io rstn -hierarchical -instance_map ./out/$::env(TEST)/cut_map.json -module_dir ./out/$::env(TEST)/modules
+select -clear
+hierarchy -top top
+opt_clean -purge
+hilomap -hicell sky130_fd_sc_hd__conb_1 HI -locell sky130_fd_sc_hd__conb_1 LO
+write_verilog -noexpr ./out/$::env(TEST)/cut.v
+tee -q -o ./out/$::env(TEST)/cut.stat.json stat -json
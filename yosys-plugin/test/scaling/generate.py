@@ -0,0 +1,165 @@
+"""
+Generates a synthetic gate-level netlist in the sky130 test tech, to stress
+the DFT passes at sizes spm and the ISCAS-89 designs do not reach.
+
+The top module ``top`` chains ``--replicas`` instances of a module ``block``:
+the inputs of the first are ``in``, the outputs of every other are the inputs
+of the next, and the outputs of the last are ``out``. Each block holds its
+share of ``--flops`` flip-flops (a quarter of them with an asynchronous
+reset,) each driven by a cone of ``--depth`` gates over the block's inputs
+and flip-flops. Every bit of ``out`` is the XOR of two flip-flops.
+
+    python3 generate.py --flops 10k [--depth 4] [--io-width 32] [--replicas 1] -o design.v
+
+``test`` (the test mode wire) and ``rstn`` are left for boundary scan to
+exclude.
+"""
+
+import random
+import argparse
+from typing import Dict, List, TextIO
+
+LIB = "sky130_fd_sc_hd"
+
+# cell: (input pins, output pin)
+GATES = {
+    "nand2_1": (["A", "B"], "Y"),
+    "nor2_1": (["A", "B"], "Y"),
+    "and2_1": (["A", "B"], "X"),
+    "xor2_1": (["A", "B"], "X"),
+    "mux2_1": (["A0", "A1", "S"], "X"),
+}
+
+
+def instance(f: TextIO, cell: str, name: str, pins: Dict[str, str]):
+    connections = ", ".join(f".{pin}({net})" for pin, net in pins.items())
+    f.write(f"  {LIB}__{cell} {name} ({connections});\n")
+
+
+def write_block(
+    f: TextIO,
+    flops: int,
+    depth: int,
+    io_width: int,
+    rng: random.Random,
+) -> int:
+    """
+    :returns: The number of cells in the block.
+    """
+    f.write("module block (clk, rstn, in, out);\n")
+    f.write("  input clk;\n  input rstn;\n")
+    f.write(f"  input [{io_width - 1}:0] in;\n  output [{io_width - 1}:0] out;\n")
+    f.write(f"  wire [{flops - 1}:0] q;\n")
+
+    pool: List[str] = [f"in[{i}]" for i in range(io_width)]
+    pool += [f"q[{i}]" for i in range(flops)]
+    cells = 0
+    nets = 0
+    gates = list(GATES)
+    for i in range(flops):
+        net = rng.choice(pool)
+        for _ in range(depth):
+            cell = rng.choice(gates)
+            inputs, output = GATES[cell]
+            pins = {inputs[0]: net}
+            for pin in inputs[1:]:
+                pins[pin] = rng.choice(pool)
+            net = f"n{nets}"
+            nets += 1
+            f.write(f"  wire {net};\n")
+            pins[output] = net
+            instance(f, cell, f"g{cells}", pins)
+            cells += 1
+        # a quarter of the flip-flops have an asynchronous reset
+        if i % 4 == 3:
+            instance(
+                f,
+                "dfrtp_1",
+                f"ff{i}",
+                {"CLK": "clk", "D": net, "RESET_B": "rstn", "Q": f"q[{i}]"},
+            )
+        else:
+            instance(f, "dfxtp_1", f"ff{i}", {"CLK": "clk", "D": net, "Q": f"q[{i}]"})
+        cells += 1
+
+    for i in range(io_width):
+        a, b = rng.randrange(flops), rng.randrange(flops)
+        instance(
+            f, "xor2_1", f"o{i}", {"A": f"q[{a}]", "B": f"q[{b}]", "X": f"out[{i}]"}
+        )
+        cells += 1
+    f.write("endmodule\n\n")
+    return cells
+
+
+def write_top(f: TextIO, io_width: int, replicas: int):
+    f.write("module top (clk, rstn, test, in, out);\n")
+    f.write("  input clk;\n  input rstn;\n  input test;\n")
+    f.write(f"  input [{io_width - 1}:0] in;\n  output [{io_width - 1}:0] out;\n")
+    previous = "in"
+    for i in range(replicas):
+        current = "out" if i == replicas - 1 else f"link{i}"
+        if current != "out":
+            f.write(f"  wire [{io_width - 1}:0] {current};\n")
+        f.write(
+            f"  block u{i} (.clk(clk), .rstn(rstn), .in({previous}), .out({current}));\n"
+        )
+        previous = current
+    f.write("endmodule\n")
+
+
+def generate(
+    f: TextIO,
+    flops: int,
+    depth: int,
+    io_width: int,
+    replicas: int,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """
+    Writes the netlist to ``f``.
+
+    :returns: The number of flip-flops and cells in the flattened netlist.
+    """
+    if replicas < 1 or io_width < 1 or depth < 0:
+        raise ValueError("replicas and io_width must be positive, depth non-negative")
+    block_flops = max(flops // replicas, 1)
+    rng = random.Random(seed)
+    block_cells = write_block(f, block_flops, depth, io_width, rng)
+    write_top(f, io_width, replicas)
+    return {"flops": block_flops * replicas, "cells": block_cells * replicas}
+
+
+def parse_count(value: str) -> int:
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    value = value.strip().lower()
+    multiplier = multipliers.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid count '{value}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--flops", type=parse_count, required=True)
+    parser.add_argument("--depth", type=int, default=4, help="Gates per flip-flop")
+    parser.add_argument("--io-width", type=parse_count, default=32)
+    parser.add_argument("--replicas", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    with open(args.output, "w", encoding="utf8") as f:
+        stats = generate(
+            f, args.flops, args.depth, args.io_width, args.replicas, args.seed
+        )
+    print(f"Wrote {stats['flops']} flip-flops, {stats['cells']} cells.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Measures how the DFT pipeline scales with the size of the design, using
+netlists from ``generate.py``.
+
+For every combination of the given flip-flop counts, logic depths, IO widths
+and replica counts, a netlist is generated and pushed through boundary scan,
+synthesis, scan replacement, ``sdff_cut``, nl2bench and the assembly of
+random patterns, each stage recording its wall time and peak RSS. As in the
+hierarchical spm test, the hierarchy is kept throughout, so boundary scan
+only wraps ``top`` and the replicated block is scan-replaced and cut once.
+The results are written to ``out/scaling.json`` and ``out/scaling.csv``, and
+how each stage scales with the number of cells (the exponent of a power-law
+fit: 1 is linear) is printed.
+
+    python3 scaling.py [--flops 1k,10k,100k] [--depth 4] [--io-width 32] [--replicas 1,8] [-j JOBS]
+
+Quaigh's ATPG is left out: its runtime depends on the logic more than on its
+size, and the ISCAS-89 benchmark covers it. Without the chain Difetto.Chain
+would stitch, patterns are assembled into a random chain order, which costs
+the same.
+"""
+
+import os
+import csv
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from generate import parse_count
+
+cwd = Path(__file__).resolve().parent
+test_root = cwd.parent
+scripts_dir = test_root.parent.parent / "librelane_plugin_difetto" / "scripts"
+
+STAGES = ["generate", "bscan", "synth", "scan_replace", "cut", "bench", "assemble"]
+
+
+@dataclass
+class Point:
+    flops: int
+    depth: int
+    io_width: int
+    replicas: int
+
+    @property
+    def name(self) -> str:
+        return f"f{self.flops}_d{self.depth}_io{self.io_width}_r{self.replicas}"
+
+
+def get_env(point: Point) -> Dict[str, str]:
+    env = os.environ.copy()
+    env.setdefault("DIFETTO_SO", str(test_root.parent / "difetto.so"))
+    env["TECH_DIR"] = str(test_root / "tech")
+    env["TEST"] = point.name
+    return env
+
+
+def stage_command(point: Point, stage: str, patterns: int) -> List[str]:
+    out_dir = cwd / "out" / point.name
+    commands = {
+        "generate": [
+            sys.executable,
+            cwd / "generate.py",
+            "--flops",
+            point.flops,
+            "--depth",
+            point.depth,
+            "--io-width",
+            point.io_width,
+            "--replicas",
+            point.replicas,
+            "-o",
+            out_dir / "design.v",
+        ],
+        "bscan": ["yosys", "-c", cwd / "bscan.tcl"],
+        "synth": ["yosys", "-c", cwd / "synth.tcl"],
+        "scan_replace": ["yosys", "-c", cwd / "scan_replace.tcl"],
+        "cut": ["yosys", "-c", cwd / "cut.tcl"],
+        "bench": [
+            "nl2bench",
+            "-l",
+            test_root / "tech" / "sky130" / "sky130_fd_sc_hd__tt_025C_1v80.lib",
+            "--msb-first",
+            "-o",
+            out_dir / "design.bench",
+            out_dir / "cut.v",
+        ],
+        "assemble": [
+            sys.executable,
+            __file__,
+            "--assemble",
+            out_dir,
+            "--patterns",
+            patterns,
+        ],
+    }
+    return [str(e) for e in commands[stage]]
+
+
+@dataclass
+class StageResult:
+    wall_time: float
+    peak_rss: int
+
+
+def run_stage(point: Point, stage: str, patterns: int) -> StageResult:
+    """
+    Runs a stage for a point, logging to ``out/<point>/<stage>.log``.
+
+    :raises subprocess.CalledProcessError: If the stage fails.
+    """
+    out_log_path = cwd / "out" / point.name / f"{stage}.log"
+    Path(cwd / "out" / point.name).mkdir(parents=True, exist_ok=True)
+    cmd = stage_command(point, stage, patterns)
+    with open(out_log_path, "w", encoding="utf8") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            env=get_env(point),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        # wait4 rather than wait: the resource usage of this child alone,
+        # even with other points running in parallel
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    # ru_maxrss is in KiB on Linux
+    return StageResult(wall_time, usage.ru_maxrss * 1024)
+
+
+def read_cell_count(stat_json: Path) -> int:
+    with open(stat_json, encoding="utf8") as f:
+        stat = json.load(f)
+    if "design" in stat:
+        return stat["design"]["num_cells"]
+    return sum(module["num_cells"] for module in stat["modules"].values())
+
+
+def read_generated_cell_count(out_dir: Path) -> int:
+    # generate.py: "Wrote <flops> flip-flops, <cells> cells."
+    log = (out_dir / "generate.log").read_text(encoding="utf8")
+    return int(log.split(",")[-1].split()[0])
+
+
+def read_bench_io(bench: Path) -> tuple:
+    """
+    :returns: The number of inputs and outputs of a bench netlist, i.e. the
+        width of its test vectors and of their expected responses.
+    """
+    inputs = 0
+    outputs = 0
+    with open(bench, encoding="utf8") as f:
+        for line in f:
+            inputs += line.startswith("INPUT(")
+            outputs += line.startswith("OUTPUT(")
+    return inputs, outputs
+
+
+def write_random_patterns(path: Path, width: int, count: int, rng: random.Random):
+    with open(path, "w", encoding="utf8") as f:
+        for i in range(count):
+            print(f"{i + 1}: {format(rng.getrandbits(width), f'0{width}b')}", file=f)
+
+
+def assemble(out_dir: Path, patterns: int):
+    """
+    Assembles random test vectors and responses as wide as the bench netlist
+    into a random chain order, the way ``Difetto.AssemblePatterns`` does.
+    """
+    sys.path.append(str(scripts_dir / "common"))
+    from patterns import assemble_patterns
+
+    inputs, outputs = read_bench_io(out_dir / "design.bench")
+    chain_length = max(inputs, outputs)
+    rng = random.Random(chain_length)
+    locations = list(range(chain_length))
+    rng.shuffle(locations)
+    with open(out_dir / "raw_tvs.txt", encoding="utf8") as f_in, open(
+        out_dir / "tvs.bin", "wb"
+    ) as f_out:
+        count = assemble_patterns(f_in, f_out, locations[:inputs], chain_length)
+    rng.shuffle(locations)
+    with open(out_dir / "raw_au.txt", encoding="utf8") as f_in, open(
+        out_dir / "au.bin", "wb"
+    ) as f_out:
+        assemble_patterns(f_in, f_out, locations[:outputs], chain_length)
+    print(f"Assembled {count} patterns into a {chain_length}-bit chain.")
+
+
+def run_point(point: Point, patterns: int) -> Dict[str, Any]:
+    """
+    Runs every stage for a point.
+
+    :returns: The metrics of the point, keyed ``<stage>.<kind>``.
+    """
+    out_dir = cwd / "out" / point.name
+    metrics: Dict[str, Any] = {
+        "flops": point.flops,
+        "depth": point.depth,
+        "io_width": point.io_width,
+        "replicas": point.replicas,
+    }
+    for stage in STAGES:
+        if stage == "assemble":
+            inputs, outputs = read_bench_io(out_dir / "design.bench")
+            metrics["bench.inputs"] = inputs
+            metrics["bench.outputs"] = outputs
+            rng = random.Random(point.name)
+            write_random_patterns(out_dir / "raw_tvs.txt", inputs, patterns, rng)
+            write_random_patterns(out_dir / "raw_au.txt", outputs, patterns, rng)
+        result = run_stage(point, stage, patterns)
+        metrics[f"{stage}.wall_time"] = round(result.wall_time, 3)
+        metrics[f"{stage}.peak_rss"] = result.peak_rss
+        if stage == "generate":
+            metrics["generate.cells"] = read_generated_cell_count(out_dir)
+    metrics["scan_replace.cells"] = read_cell_count(out_dir / "scan_replace.stat.json")
+    metrics["cut.cells"] = read_cell_count(out_dir / "cut.stat.json")
+    return metrics
+
+
+def fit_exponent(points: List[tuple]) -> Optional[float]:
+    """
+    :returns: The exponent ``k`` of ``y = a * x ** k`` best fitting the points
+        (a least-squares fit of ``log y`` against ``log x``,) or ``None`` if
+        there are not enough points.
+    """
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y > 0]
+    if len({x for x, _ in points}) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return covariance / variance
+
+
+def write_report(report: Dict[str, Dict[str, Any]], json_path: Path, csv_path: Path):
+    with open(json_path, "w", encoding="utf8") as f:
+        json.dump({"points": report}, f, indent=2, sort_keys=True)
+    columns = sorted({metric for metrics in report.values() for metric in metrics})
+    with open(csv_path, "w", encoding="utf8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["point"] + columns)
+        for point, metrics in sorted(report.items()):
+            writer.writerow([point] + [metrics.get(column, "") for column in columns])
+
+
+def parse_counts(value: str) -> List[int]:
+    return [parse_count(e) for e in value.split(",") if e.strip() != ""]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--flops",
+        type=parse_counts,
+        default=parse_counts("1k,10k,100k"),
+        help="Flip-flop counts, comma-separated",
+    )
+    parser.add_argument(
+        "--depth",
+        type=parse_counts,
+        default=[4],
+        help="Logic depths (gates per flip-flop), comma-separated",
+    )
+    parser.add_argument(
+        "--io-width",
+        type=parse_counts,
+        default=[32],
+        help="IO widths, comma-separated",
+    )
+    parser.add_argument(
+        "--replicas",
+        type=parse_counts,
+        default=[1],
+        help="Replica counts of the block, comma-separated",
+    )
+    parser.add_argument(
+        "--patterns",
+        type=parse_count,
+        default=1000,
+        help="Random patterns to assemble",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Points to run in parallel (at the cost of noisier wall times)",
+    )
+    parser.add_argument("--assemble", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.assemble is not None:
+        assemble(args.assemble, args.patterns)
+        return
+
+    points = [
+        Point(*values)
+        for values in itertools.product(
+            args.flops, args.depth, args.io_width, args.replicas
+        )
+    ]
+
+    report: Dict[str, Dict[str, Any]] = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(run_point, point, args.patterns): point for point in points
+        }
+        for future in as_completed(futures):
+            point = futures[future]
+            try:
+                report[point.name] = future.result()
+                print(
+                    f"{point.name}: done in {sum(v for k, v in report[point.name].items() if k.endswith('.wall_time')):.2f}s."
+                )
+            except (subprocess.CalledProcessError, OSError) as e:
+                report[point.name] = {"error": str(e)}
+                print(f"{point.name}: {e}", file=sys.stderr)
+    print(f"Ran {len(points)} point(s) in {time.perf_counter() - start:.2f}s.")
+
+    (cwd / "out").mkdir(exist_ok=True)
+    write_report(report, cwd / "out" / "scaling.json", cwd / "out" / "scaling.csv")
+
+    ok = [metrics for metrics in report.values() if "error" not in metrics]
+    print("Scaling with the number of cells (1 is linear):")
+    for stage in STAGES:
+        time_exponent = fit_exponent(
+            [(m["generate.cells"], m[f"{stage}.wall_time"]) for m in ok]
+        )
+        memory_exponent = fit_exponent(
+            [(m["generate.cells"], m[f"{stage}.peak_rss"]) for m in ok]
+        )
+        if time_exponent is None or memory_exponent is None:
+            continue
+        print(f"  {stage}: time {time_exponent:.2f}, memory {memory_exponent:.2f}")
+
+    if len(ok) != len(report):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
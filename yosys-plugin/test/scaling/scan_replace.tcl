@@ -0,0 +1,7 @@
+yosys -import
+yosys plugin -i $::env(DIFETTO_SO)
+read_rtlil out/$::env(TEST)/synth.il
+hierarchy -top top
+yosys scan_replace -json_mapping $::env(TECH_DIR)/sky130/sky130_mapping.json
+write_verilog -noexpr out/$::env(TEST)/nl.v
+tee -q -o out/$::env(TEST)/scan_replace.stat.json stat -json
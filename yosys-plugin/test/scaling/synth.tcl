@@ -0,0 +1,6 @@
+yosys -import
+read_rtlil out/$::env(TEST)/bscan.il
+synth -top top
+dfflibmap -liberty $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib
+abc -liberty $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib
+write_rtlil out/$::env(TEST)/synth.il
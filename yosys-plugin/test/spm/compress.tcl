@@ -0,0 +1,13 @@
+yosys -import
+plugin -i $::env(DIFETTO_SO)
+read_liberty -ignore_miss_func -lib $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib
+read_verilog -sv ./out/spm.nl.v
+hierarchy -top spm
+select spm
+yosys scan_compress -json_mapping $::env(TECH_DIR)/sky130/sky130_mapping.json -clock clk -scan_in sci -scan_out sco -chains 4 -structure ./out/spm.scan_compression.json
+write_verilog -noexpr ./out/spm.compressed.nl.v
+write_json ./out/spm.compressed.nl.json
+select spm
+yosys sdff_cut -json_mapping $::env(TECH_DIR)/sky130/sky130_mapping.json -test_mode test -clock clk -exclude_io rstn -exclude_io sce -exclude_io sci -exclude_io sco
+opt_clean -purge
+write_verilog -selected -noexpr ./out/spm.compressed.cut.v
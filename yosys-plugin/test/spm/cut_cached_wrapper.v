@@ -0,0 +1,25 @@
+// Wraps spm in one more level of hierarchy, so spm's pseudo-ports are punched
+// through from its children and the wrapper's cache entry depends on them.
+module spm_cached (
+    input clk,
+    input rstn,
+    input x,
+    input[31: 0] a,
+    output y,
+    input test,
+    input sce,
+    input sci,
+    output sco
+);
+    spm dut (
+        .clk(clk),
+        .rstn(rstn),
+        .x(x),
+        .a(a),
+        .y(y),
+        .test(test),
+        .sce(sce),
+        .sci(sci),
+        .sco(sco)
+    );
+endmodule
@@ -0,0 +1,10 @@
+yosys -import
+plugin -i $::env(DIFETTO_SO)
+read_liberty -ignore_miss_func -lib $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib
+read_verilog -sv ./out/spm.nl.v
+read_verilog -sv drc_no_scan.v
+hierarchy -top spm_drc
+setattr -set no_scan 1 A:no_scan t:* %i
+flatten
+select spm_drc
+yosys dft_drc -liberty $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib -json_mapping $::env(TECH_DIR)/sky130/sky130_mapping.json -test_mode test -clock clk -exclude_io rstn -exclude_io sce -exclude_io sci -exclude_io sco -exclude_io missing_io -report ./out/spm.drc.json
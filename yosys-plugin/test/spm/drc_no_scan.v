@@ -0,0 +1,41 @@
+// Wraps spm with a submodule marked no_scan, which flattening would drop:
+// its flip-flop should be reported as kept out of the chain, not as unscanned.
+(* no_scan *)
+module spm_no_scan (
+    input clk,
+    input d,
+    output q
+);
+    sky130_fd_sc_hd__dfxtp_1 held (.CLK(clk), .D(d), .Q(q));
+endmodule
+
+module spm_drc (
+    input clk,
+    input rstn,
+    input x,
+    input[31: 0] a,
+    output y,
+    output held,
+    input test,
+    input sce,
+    input sci,
+    output sco
+);
+    spm dut (
+        .clk(clk),
+        .rstn(rstn),
+        .x(x),
+        .a(a),
+        .y(y),
+        .test(test),
+        .sce(sce),
+        .sci(sci),
+        .sco(sco)
+    );
+
+    spm_no_scan u_no_scan (
+        .clk(clk),
+        .d(x),
+        .q(held)
+    );
+endmodule
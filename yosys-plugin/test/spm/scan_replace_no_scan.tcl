@@ -0,0 +1,7 @@
+yosys -import
+plugin -i $::env(DIFETTO_SO)
+read_liberty -ignore_miss_func -lib $::env(TECH_DIR)/sky130/sky130_fd_sc_hd__tt_025C_1v80.lib
+read_verilog -sv scan_replace_no_scan.v
+hierarchy -top spm_alias_no_scan
+yosys scan_replace -json_mapping $::env(TECH_DIR)/sky130/sky130_mapping.json
+write_json ./out/spm.scan_replace_no_scan.json
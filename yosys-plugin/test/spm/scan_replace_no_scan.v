@@ -0,0 +1,17 @@
+// Two flip-flops, one of which only reaches a no_scan wire through an alias:
+// it should be kept out of the chain all the same.
+module spm_alias_no_scan (
+    input clk,
+    input d,
+    output q,
+    output held
+);
+    wire held_q;
+    (* no_scan *)
+    wire held_alias;
+    assign held_alias = held_q;
+    assign held = held_alias;
+
+    sky130_fd_sc_hd__dfxtp_1 scanned (.CLK(clk), .D(d), .Q(q));
+    sky130_fd_sc_hd__dfxtp_1 kept (.CLK(clk), .D(d), .Q(held_q));
+endmodule
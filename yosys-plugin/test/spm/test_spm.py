@@ -1,5 +1,9 @@
 import os
+import sys
+import json
 import re
+import random
+import shutil
 import pytest
 from pathlib import Path
 import subprocess
@@ -55,3 +59,334 @@ def test_spm():
     assert atpg_result is not None, "No coverage found"
     coverage = float(atpg_result[1])
     assert coverage == 100, "SPM coverage not 100%"
+
+
+def test_spm_hierarchical():
+    run("spm", "synth_hier", "yosys", "-c", cwd / "synth_hier.tcl")
+    run("spm", "cut_hier", "yosys", "-c", cwd / "cut_hier.tcl")
+    with open(cwd / "out" / "spm.hier.cut_map.json", encoding="utf8") as f:
+        cut_map = json.load(f)
+    assert (
+        cut_map["modules"]["spm"]["instances"]["dsa[0]"] == "delayed_serial_adder"
+    ), "Instance of cut submodule missing from instance map"
+    assert (
+        cwd / "out" / "spm.hier.modules" / "delayed_serial_adder.v"
+    ).exists(), "Per-module cut netlist not written"
+    run(
+        "spm",
+        "bench_hier",
+        "nl2bench",
+        "-l",
+        pytest.test_root / "tech" / "sky130" / "sky130_fd_sc_hd__tt_025C_1v80.lib",
+        "--msb-first",
+        "-o",
+        cwd / "out" / "spm.hier.bench",
+        cwd / "out" / "spm.hier.cut.v",
+    )
+    atpg_result = run(
+        "spm",
+        "atpg_hier",
+        "quaigh",
+        "atpg",
+        "-o",
+        cwd / "out" / "spm.hier.raw_tvs.txt",
+        cwd / "out" / "spm.hier.bench",
+    )
+    atpg_result_str = open(atpg_result).read()
+    coverage_rx = re.compile(r"([\d.]+)% coverage")
+    atpg_result = coverage_rx.search(atpg_result_str)
+    assert atpg_result is not None, "No coverage found"
+    coverage = float(atpg_result[1])
+    assert coverage == 100, "SPM coverage not 100%"
+
+
+def test_spm_hierarchical_cached():
+    run("spm", "synth_hier", "yosys", "-c", cwd / "synth_hier.tcl")
+    cache = cwd / "out" / "spm.hier.cut_cache"
+    shutil.rmtree(cache, ignore_errors=True)
+    reused_rx = re.compile(r"Reused (\d+) cached module\(s\)")
+
+    fresh_log = run(
+        "spm", "cut_hier_cached", "yosys", "-c", cwd / "cut_hier_cached.tcl"
+    )
+    fresh = open(cwd / "out" / "spm.hier.cached.cut.v").read()
+    entries = sorted(cache.glob("*/*.il"))
+    assert len(entries) > 1, "Cut modules not written to the cache"
+    assert reused_rx.search(open(fresh_log).read())[1] == "0"
+
+    reuse_log = run(
+        "spm", "cut_hier_cached_reuse", "yosys", "-c", cwd / "cut_hier_cached.tcl"
+    )
+    reused = open(cwd / "out" / "spm.hier.cached.cut.v").read()
+    assert reused_rx.search(open(reuse_log).read())[1] == str(
+        len(entries)
+    ), "Not every cut module was reused"
+    assert sorted(cache.glob("*/*.il")) == entries, "Reuse run missed the cache"
+    assert reused == fresh, "Cut netlist differs when reused from the cache"
+
+
+def test_spm_compressed():
+    run("spm", "synth", "yosys", "-c", cwd / "synth.tcl")
+    run("spm", "compress", "yosys", "-c", cwd / "compress.tcl")
+    with open(cwd / "out" / "spm.scan_compression.json", encoding="utf8") as f:
+        structure = json.load(f)
+    assert structure["channels"] == 1, "Wrong number of channels"
+    assert len(structure["taps"]) == 4, "Wrong number of internal chains"
+    assert structure["compactor"] == [[0, 1, 2, 3]], "Chains missing from compactor"
+    compressed = open(cwd / "out" / "spm.compressed.nl.v").read()
+    assert (
+        "difetto_decompressor_si_3" in compressed
+    ), "Decompressor not inserted into netlist"
+    cut = open(cwd / "out" / "spm.compressed.cut.v").read()
+    assert "difetto_decompressor" not in cut, "Decompressor not removed from cut"
+    assert "difetto_compactor" not in cut, "Compactor not removed from cut"
+
+
+def test_spm_drc():
+    run("spm", "synth", "yosys", "-c", cwd / "synth.tcl")
+    run("spm", "drc", "yosys", "-c", cwd / "drc.tcl")
+    with open(cwd / "out" / "spm.drc.json", encoding="utf8") as f:
+        report = json.load(f)
+    assert report["flop_count"] > 0, "No flip-flops checked"
+    violations = [
+        (violation["rule"], violation["instance"]) for violation in report["violations"]
+    ]
+    assert (
+        "no_scan_flop",
+        "u_no_scan.held",
+    ) in violations, "Flip-flop of no_scan submodule not excluded"
+    assert [
+        violation for violation in violations if violation[1] != "u_no_scan.held"
+    ] == [("missing_pin", "missing_io")], "Unexpected DFT rule violations"
+
+
+def test_scan_replace_no_scan_alias():
+    log = run(
+        "spm", "scan_replace_no_scan", "yosys", "-c", cwd / "scan_replace_no_scan.tcl"
+    )
+    with open(cwd / "out" / "spm.scan_replace_no_scan.json", encoding="utf8") as f:
+        cells = json.load(f)["modules"]["spm_alias_no_scan"]["cells"]
+    assert (
+        cells["scanned"]["type"] == "sky130_fd_sc_hd__sdfxtp_1"
+    ), "Flip-flop not replaced"
+    assert (
+        cells["kept"]["type"] == "sky130_fd_sc_hd__dfxtp_1"
+    ), "Flip-flop driving an alias of a no_scan wire replaced"
+    metrics = open(log).read()
+    assert "%OL_METRIC_I difetto__scan_replace__replaced_count 1" in metrics
+    assert "%OL_METRIC_F difetto__runtime__scan_replace__pass" in metrics
+
+
+# Arbitrary, uneven lengths for the internal chains: the decompressor does not
+# depend on them
+COMPRESSED_CHAIN_LENGTHS = [20, 19, 18, 17]
+
+
+def import_compression():
+    # the plugin's Python package, which models the decompressor
+    sys.path.insert(0, str(pytest.test_root.parent.parent))
+    from librelane_plugin_difetto import compression
+
+    return compression
+
+
+def simulate_decompressor(structure, cycles):
+    """
+    Symbolically simulates the decompressor cells of the compressed netlist
+    for a number of shift cycles, from a cleared register.
+
+    :returns: The value shifted into each chain on each cycle, as a mask of
+        the variables XORed together, where variable ``t * channels + k`` is
+        the value of channel ``k`` on cycle ``t``.
+    """
+    with open(
+        pytest.test_root / "tech" / "sky130" / "sky130_mapping.json", encoding="utf8"
+    ) as f:
+        spec = json.load(f)["compression"]
+    with open(cwd / "out" / "spm.compressed.nl.json", encoding="utf8") as f:
+        module = json.load(f)["modules"]["spm"]
+
+    channels = {
+        module["ports"][name]["bits"][0]: k for k, name in enumerate(structure.scan_in)
+    }
+    flipflops = {}  # output: data
+    xors = {}  # output: inputs
+    chain_inputs = {}  # chain: input
+    for name, cell in module["cells"].items():
+        if not name.startswith("difetto_decompressor_"):
+            continue
+        connections = cell["connections"]
+        if cell["type"] == spec["flipflop"]["cell"]:
+            output = connections[spec["flipflop"]["output"]][0]
+            flipflops[output] = connections[spec["flipflop"]["data"]][0]
+        elif cell["type"] == spec["xor"]["cell"]:
+            output = connections[spec["xor"]["output"]][0]
+            xors[output] = [connections[pin][0] for pin in spec["xor"]["inputs"]]
+        elif cell["type"] == spec["buffer"]["cell"]:
+            chain = int(name.rsplit("_", 1)[1])
+            chain_inputs[chain] = connections[spec["buffer"]["input"]][0]
+    assert len(flipflops) == structure.stages, "Wrong number of decompressor stages"
+    assert sorted(chain_inputs) == list(
+        range(structure.chains)
+    ), "Decompressor outputs missing"
+
+    state = {output: 0 for output in flipflops}
+    shifted_in = []
+    for t in range(cycles):
+        values = {**state}
+        for bit, k in channels.items():
+            values[bit] = 1 << (t * structure.channels + k)
+
+        def evaluate(bit):
+            if bit not in values:
+                value = 0
+                for input in xors[bit]:
+                    value ^= evaluate(input)
+                values[bit] = value
+            return values[bit]
+
+        shifted_in.append([evaluate(chain_inputs[j]) for j in range(structure.chains)])
+        state = {output: evaluate(data) for output, data in flipflops.items()}
+    return shifted_in
+
+
+def test_spm_compressed_encoding():
+    run("spm", "synth", "yosys", "-c", cwd / "synth.tcl")
+    run("spm", "compress", "yosys", "-c", cwd / "compress.tcl")
+    compression = import_compression()
+    structure = compression.ScanCompression.load(
+        cwd / "out" / "spm.scan_compression.json"
+    )
+    encoder = compression.PatternEncoder(structure, COMPRESSED_CHAIN_LENGTHS)
+    bits = compression.chain_bits(COMPRESSED_CHAIN_LENGTHS)
+    rng = random.Random(0)
+    for care_count in [4, 16, 64]:
+        for _ in range(20):
+            care = {bit: rng.getrandbits(1) for bit in rng.sample(bits, care_count)}
+            stream, dropped = encoder.encode(care)
+            assert len(stream) == encoder.stream_length, "Wrong stream length"
+            contents = encoder.decompress(stream)
+            lost = sum(
+                1
+                for (chain, position), value in care.items()
+                if contents[chain][position] != value
+            )
+            assert lost == dropped, "Care bits lost beyond those dropped"
+
+
+def test_spm_compressed_decompressor():
+    run("spm", "synth", "yosys", "-c", cwd / "synth.tcl")
+    run("spm", "compress", "yosys", "-c", cwd / "compress.tcl")
+    compression = import_compression()
+    structure = compression.ScanCompression.load(
+        cwd / "out" / "spm.scan_compression.json"
+    )
+    encoder = compression.PatternEncoder(structure, COMPRESSED_CHAIN_LENGTHS)
+    shifted_in = simulate_decompressor(structure, encoder.load_cycles)
+    # after loading, the bit shifted in on the last cycle is at position 0
+    contents = [
+        [
+            shifted_in[encoder.load_cycles - 1 - position][chain]
+            for position in range(length)
+        ]
+        for chain, length in enumerate(COMPRESSED_CHAIN_LENGTHS)
+    ]
+    assert (
+        contents == encoder.equations
+    ), "Decompressor netlist does not match the model"
+
+
+def import_diagnosis():
+    sys.path.insert(0, str(pytest.test_root.parent.parent))
+    from librelane_plugin_difetto import bench, diagnosis
+
+    return bench, diagnosis
+
+
+# Six scan flip-flops, each loading one input and capturing one output,
+# stitched into three chains of two
+DIAGNOSIS_BENCH = """
+INPUT(a0)
+INPUT(a1)
+INPUT(a2)
+INPUT(a3)
+INPUT(a4)
+INPUT(a5)
+OUTPUT(y0)
+OUTPUT(y1)
+OUTPUT(y2)
+OUTPUT(y3)
+OUTPUT(y4)
+OUTPUT(y5)
+n0 = NAND(a0, a1)
+n1 = NOR(a1, a2)
+n2 = XOR(a2, a3)
+n3 = AND(a3, a4)
+n4 = OR(a4, a5)
+y0 = NAND(n0, n1)
+y1 = XOR(n1, n2)
+y2 = NOR(n2, n3)
+y3 = AND(n3, n4)
+y4 = OR(n0, n4)
+y5 = XNOR(n0, n2)
+"""
+DIAGNOSIS_CHAIN_LENGTHS = [2, 2, 2]
+DIAGNOSIS_FAULT = ("n2", 1)
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_diagnosis(compressed, tmp_path):
+    from bitarray import bitarray
+
+    bench_module, diagnosis = import_diagnosis()
+    compression = import_compression()
+    bench = bench_module.Bench.parse(DIAGNOSIS_BENCH.splitlines())
+    patterns = bench_module.random_patterns(random.Random(0), 16, len(bench.inputs))
+    au_locations = [(i // 2, i % 2) for i in range(len(bench.outputs))]
+    encoder = None
+    if compressed:
+        structure = compression.ScanCompression(
+            channels=2,
+            stages=4,
+            injectors=[[0], [1]],
+            taps=[[1], [2], [3]],
+            compactor=[[0, 1], [1, 2]],
+            scan_in=["sci0", "sci1"],
+            scan_out=["sco0", "sco1"],
+        )
+        encoder = compression.PatternEncoder(structure, DIAGNOSIS_CHAIN_LENGTHS)
+    layout = diagnosis.ResponseLayout(DIAGNOSIS_CHAIN_LENGTHS, au_locations, encoder)
+
+    # inject the fault by tying its net to a constant
+    net, stuck = DIAGNOSIS_FAULT
+    faulty_bench = bench_module.Bench(bench.inputs, bench.outputs, dict(bench.gates))
+    faulty_bench.gates[net] = ("VDD" if stuck else "GND", [])
+    good = bench_module.FaultSimulator(bench, patterns).responses()
+    faulty = bench_module.FaultSimulator(faulty_bench, patterns).responses()
+
+    def scan_out(response):
+        contents = [[None] * length for length in DIAGNOSIS_CHAIN_LENGTHS]
+        for output, (chain, position) in enumerate(au_locations):
+            contents[chain][position] = int(response[output])
+        if encoder is not None:
+            return encoder.unload(contents)
+        stream = bitarray(endian="little")
+        for chain in contents:
+            stream.extend(chain)
+        return stream, bitarray([1] * len(stream), endian="little")
+
+    for i, (good_response, faulty_response) in enumerate(zip(good, faulty)):
+        expected, mask = scan_out(good_response)
+        out, _ = scan_out(faulty_response)
+        with open(tmp_path / f"tv_{i}.log", "w", encoding="utf8") as f:
+            print("^", ((expected ^ out) & mask).to01(), file=f)
+
+    diffs = diagnosis.read_diffs(str(tmp_path))
+    assert any(len(diffs[i]) for i in diffs), "Injected fault not detected"
+    dictionary = diagnosis.FaultDictionary(bench, patterns)
+    candidates = diagnosis.diagnose(
+        dictionary, layout, [diffs[i] for i in range(len(patterns))]
+    )
+    assert len(candidates), "No candidates"
+    assert DIAGNOSIS_FAULT in candidates[0].faults, "Injected fault not ranked first"
+    assert candidates[0].score == 1, "Injected fault does not explain the failures"
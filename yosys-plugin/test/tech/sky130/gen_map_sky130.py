@@ -46,6 +46,18 @@ final_dict = {"meta": {"version": 1}, "mapping": {}}
 for cell, scannable_cell in scannable_cells.items():
     final_dict["mapping"][cell] = scannable_cell
 
+# cells for the decompressor and compactor inserted by scan_compress
+final_dict["compression"] = {
+    "buffer": {"cell": "sky130_fd_sc_hd__buf_1", "input": "A", "output": "X"},
+    "xor": {"cell": "sky130_fd_sc_hd__xor2_1", "inputs": ["A", "B"], "output": "X"},
+    "flipflop": {
+        "cell": "sky130_fd_sc_hd__dfxtp_1",
+        "clock": "CLK",
+        "data": "D",
+        "output": "Q",
+    },
+}
+
 
 with open("sky130_mapping.json", "w") as f:
     json.dump(final_dict, fp=f)